@@ -0,0 +1,111 @@
+#--------------------------------------------------------------------------
+# File:          Benchmark_Output_Encodings.py
+# Author:        Bradley Kumm (bkumm@wisc.edu)
+# Last Modified: 2026/10/18 (YYYY/MM/DD)
+# Description:   Script that rewrites an existing qk or qMODES file with
+#                each of the output encodings (see OUTPUT ENCODINGS in
+#                qMODES_Functions.py) and reports the file size against the
+#                time it takes to read back a single pressure level and a
+#                single band of latitudes, as well as the largest error
+#                relative to the original values.
+#
+# Notes:         Run from the src/misc directory, e.g.
+#                    python Benchmark_Output_Encodings.py -f ../../output_data/qMODES_data/qmodes_20200101.nc
+#                The rewritten files are saved in a temporary directory and
+#                removed at the end.
+#
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#IMPORTS
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy    as np
+import xarray   as xa
+
+sys.path.append("../qMODES_scripts/")
+from qMODES_Functions import get_output_encoding, get_encoding_attrs, OUTPUT_LEVEL_DIMS
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#READING IN COMMAND LINE ARGUMENTS
+
+parser = argparse.ArgumentParser(description="This script benchmarks the file size and read time of the qk/qMODES output encodings")
+parser.add_argument('-f', '--file', help='qk or qMODES file to benchmark', required=True)
+parser.add_argument('-n', '--nread', help='number of times to repeat each read (the median time is reported)', type=int, default=5)
+parser.add_argument('--band_size', help='number of latitudes per band for the band reads and band chunking', type=int, default=32)
+args = parser.parse_args()
+
+infile    = args.file
+nread     = args.nread
+band_size = args.band_size
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#ENCODINGS TO BENCHMARK
+
+# (dtype, zlib level, chunking)
+encoding_list = [ ('float64', 0, 'default'),
+                  ('float64', 4, 'level'  ),
+                  ('float32', 0, 'default'),
+                  ('float32', 4, 'level'  ),
+                  ('float32', 4, 'band'   ),
+                  ('int16',   4, 'level'  ),
+                  ('int16',   4, 'band'   ) ]
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# BENCHMARK
+
+def time_read(outfile, var, isel):
+    '''returns the median time (in s) to open outfile and read var[isel] over nread repeats'''
+    times = []
+    for i in range(nread):
+        tic = time.perf_counter()
+        with xa.open_dataset(outfile) as ds: ds[var].isel(isel).values
+        times.append(time.perf_counter() - tic)
+    return np.median(times)
+
+in_ds     = xa.load_dataset(infile)
+var_list  = [name for name in in_ds.data_vars if name != 'noMRG']
+var       = var_list[0]
+level_dim = [dim for dim in in_ds[var].dims if dim in OUTPUT_LEVEL_DIMS][0]
+
+level_isel = {level_dim: in_ds.sizes[level_dim]//2}
+band_isel  = {'lat': slice(0, min(band_size, in_ds.sizes['lat']))}
+
+print(f"benchmarking {infile} ({var} reads, median of {nread})")
+print(f"{'dtype':>8} {'zlib':>4} {'chunking':>8} {'size (MB)':>10} {'level read (ms)':>16} {'band read (ms)':>15} {'max rel err':>12}")
+
+with tempfile.TemporaryDirectory() as tmp_dir:
+    for dtype, complevel, chunking in encoding_list:
+
+        out_encoding = {'dtype':dtype, 'complevel':complevel, 'chunking':chunking, 'band_size':band_size}
+        outfile      = os.path.join(tmp_dir, f"{dtype}_{complevel}_{chunking}.nc")
+
+        out_ds = in_ds.copy()
+        out_ds.attrs.update( get_encoding_attrs(**out_encoding) )
+        out_ds.to_netcdf(outfile, encoding=get_output_encoding(out_ds, **out_encoding))
+
+        size_mb  = os.path.getsize(outfile) / 1.0e6
+        level_ms = time_read(outfile, var, level_isel) * 1.0e3
+        band_ms  = time_read(outfile, var, band_isel ) * 1.0e3
+
+        with xa.open_dataset(outfile) as ds:
+            max_err = max( float(np.max(np.abs(ds[name].values - in_ds[name].values)) / np.max(np.abs(in_ds[name].values))) for name in var_list )
+
+        print(f"{dtype:>8} {complevel:>4} {chunking:>8} {size_mb:>10.2f} {level_ms:>16.2f} {band_ms:>15.2f} {max_err:>12.2e}")
+#--------------------------------------------------------------------------
@@ -13,9 +13,16 @@
 #-------------------------------------------------------------------------
 # Imports
 
+import os
+import glob
 import math
+import time
+import hashlib
+import inspect
+import functools
 import xarray as xa
 import numpy  as np
+from collections import OrderedDict
 
 #-------------------------------------------------------------------------
 
@@ -39,6 +46,36 @@ def Deriv(xvals, yvals):
 
     return deriv
 
+def Deriv_Along_Axis(xvals, yvals, axis=0):
+    """
+    Array version of Deriv, calculates the derivative of the N-D array yvals
+    along the given axis (with xvals the grid values along that axis) all at
+    once. Interior points use the same three point (nonuniform spacing)
+    polynomial fit as Deriv_At_Point, with the same order of operations, and
+    the end points use one sided differences, so the output is identical to
+    calling Deriv on each 1-D slice.
+    """
+    yvals = np.moveaxis(np.asarray(yvals), axis, 0)
+    xvals = np.asarray(xvals).reshape((-1,) + (1,)*(yvals.ndim-1))
+    ny    = yvals.shape[0]
+    deriv = np.zeros(yvals.shape)
+
+    # deriv at end points
+    deriv[0]    = (yvals[1] - yvals[0]) / (xvals[1]-xvals[0])
+    deriv[ny-1] = (yvals[ny-1] - yvals[ny-2]) / (xvals[ny-1] - xvals[ny-2])
+
+    # deriv at interior points (see Deriv_At_Point)
+    x = xvals.astype(np.float64)
+    y = yvals.astype(np.float64)
+    x1, x2, x3 = x[:-2], x[1:-1], x[2:]
+    y1, y2, y3 = y[:-2], y[1:-1], y[2:]
+
+    a = ( x1 * ( y3 - y2) + x2 * (y1 - y3) + x3 * (y2 - y1) ) / ((x1 - x2)*(x1 - x3)*(x2 - x3))
+    b = (y2 - y1) / (x2 - x1)  - a * (x1 + x2)
+    deriv[1:ny-1] = 2.0 * a * x2 + b
+
+    return np.moveaxis(deriv, 0, axis)
+
 def Deriv_At_Point(points_list,xval):
     """
     This function calculates the derivative at the given point xval, from
@@ -66,11 +103,151 @@ def Deriv_At_Point(points_list,xval):
 
 
 
+#-------------------------------------------------------------------------
+# DECOMPOSITION CACHE
+#
+# The get_*_q_data* functions below are cached so that making several
+# plots for the same date and pressure level only reads and computes the
+# decomposition once. Results are kept in an in-process LRU cache of at
+# most q_data_cache_mb MB (entries larger than that, e.g. the full field
+# decompositions at F320, are never kept) and, if q_data_cache_dir is set,
+# saved as .npy files in that directory. Entries are keyed by the ERA and
+# MODES files, the pressure level, the timestep, and the background type,
+# and an entry is invalidated when the modification time or size of either
+# file changes. Cached arrays are returned read only, so callers that want
+# to modify them need to copy them first.
+#
+# The on disk cache is off by default, set q_data_cache_dir (e.g. to
+# "../../output_data/q_data_cache/", which is ignored by git) to turn it
+# on, and set q_data_cache_mb = 0 to turn off the in-process cache.
+#
+# The number of cache hits and the time spent reading/computing the
+# decompositions are counted in q_data_stats (see print_q_data_stats).
+
+q_data_cache_dir = None   #directory for the on disk cache (None for no on disk cache)
+q_data_cache_mb  = 2048.0 #max size (in MB) of the decompositions kept in memory
+
+_q_data_cache = OrderedDict()
+
+q_data_stats = {'calls':0, 'memory_hits':0, 'disk_hits':0, 'computed':0,
+                'compute_s':0.0, 'disk_read_s':0.0, 'input_mb':0.0}
+
+def get_q_data_cache_key(ERA_datafile, MODES_datafile, iplev, itime, bkg_type):
+	'''returns the (entry, version) cache key for a decomposition, the version changes if either file is modified'''
+	entry   = (os.path.abspath(ERA_datafile), os.path.abspath(MODES_datafile), iplev, itime, bkg_type)
+	version = tuple( (os.stat(datafile).st_mtime_ns, os.stat(datafile).st_size) for datafile in (ERA_datafile, MODES_datafile) )
+	return entry, version
+
+def get_q_data_cache_file(cache_dir, entry, version):
+	'''returns the on disk cache file name for a cache key, the entry and version hashes are kept separate so old versions can be found'''
+	entry_hash   = hashlib.sha1(repr(entry  ).encode()).hexdigest()[:16]
+	version_hash = hashlib.sha1(repr(version).encode()).hexdigest()[:16]
+	return os.path.join(cache_dir, f"q_data_{entry_hash}_{version_hash}.npy")
+
+def clear_q_data_cache(disk=False):
+	'''empties the in-process decomposition cache (and the on disk cache if disk=True)'''
+	_q_data_cache.clear()
+	if disk and q_data_cache_dir is not None:
+		for cache_file in glob.glob(os.path.join(q_data_cache_dir, "q_data_*.npy")): os.remove(cache_file)
+
+def print_q_data_stats():
+	'''prints the decomposition cache and timing counters (e.g. at the end of a plotting script)'''
+	print(f"q data: {q_data_stats['calls']} calls, {q_data_stats['memory_hits']} memory hits, {q_data_stats['disk_hits']} disk hits, {q_data_stats['computed']} computed")
+	print(f"\tcompute (read + decomposition) time = {q_data_stats['compute_s']:.3f} s for {q_data_stats['input_mb']:.1f} MB of input files")
+	print(f"\tdisk cache read time = {q_data_stats['disk_read_s']:.3f} s")
+
+def cache_q_data(bkg_type):
+	"""
+	Decorator that adds the decomposition cache to a get_*_q_data* function
+	with the given background type ('p' or 'p_and_lat'). The wrapped
+	function is only called on a cache miss, and the cached [qERA, qEIG,
+	qWIG, qBAL, qM] array is returned read only (not copied).
+	"""
+	def decorator(get_q_data):
+		signature = inspect.signature(get_q_data)
+
+		@functools.wraps(get_q_data)
+		def cached_get_q_data(*args, **kwargs):
+			arguments = signature.bind(*args, **kwargs)
+			arguments.apply_defaults()
+			ERA_datafile   = arguments.arguments['ERA_datafile']
+			MODES_datafile = arguments.arguments['MODES_datafile']
+			iplev          = arguments.arguments.get('iplev')
+			itime          = arguments.arguments['itime']
+
+			entry, version = get_q_data_cache_key(ERA_datafile, MODES_datafile, iplev, itime, bkg_type)
+			q_data_stats['calls'] += 1
+
+			# in-process cache
+			if _q_data_cache.get(entry, (None,))[0] == version:
+				_q_data_cache.move_to_end(entry)
+				q_data_stats['memory_hits'] += 1
+				return _q_data_cache[entry][1]
+
+			# on disk cache, old versions of the entry are removed
+			q_data = None
+			if q_data_cache_dir is not None:
+				cache_file = get_q_data_cache_file(q_data_cache_dir, entry, version)
+				if os.path.exists(cache_file):
+					tic    = time.perf_counter()
+					q_data = np.load(cache_file)
+					q_data_stats['disk_read_s'] += time.perf_counter() - tic
+					q_data_stats['disk_hits']   += 1
+				else:
+					for old_file in glob.glob(cache_file.rsplit('_',1)[0] + "_*.npy"): os.remove(old_file)
+
+			if q_data is None:
+				tic = time.perf_counter()
+				q_data = get_q_data(*arguments.args, **arguments.kwargs)
+				q_data_stats['compute_s'] += time.perf_counter() - tic
+				q_data_stats['input_mb']  += sum(os.path.getsize(datafile) for datafile in (ERA_datafile, MODES_datafile)) / 1.0e6
+				q_data_stats['computed']  += 1
+
+				if q_data_cache_dir is not None:
+					os.makedirs(q_data_cache_dir, exist_ok=True)
+					tmp_file = cache_file + f".{os.getpid()}.tmp"
+					with open(tmp_file, 'wb') as f: np.save(f, q_data)
+					os.replace(tmp_file, cache_file)
+
+			q_data.setflags(write=False)
+
+			# least recently used entries are dropped until the cache fits in q_data_cache_mb
+			if q_data.nbytes <= q_data_cache_mb * 1.0e6:
+				_q_data_cache[entry] = (version, q_data)
+				_q_data_cache.move_to_end(entry)
+				while sum(cached[1].nbytes for cached in _q_data_cache.values()) > q_data_cache_mb * 1.0e6: _q_data_cache.popitem(last=False)
+
+			return q_data
+
+		return cached_get_q_data
+	return decorator
+
+#-------------------------------------------------------------------------
+
+
+
 #-------------------------------------------------------------------------
 # DATA READING FUNCTIONS
+#
+# The combined ERA-MODES readers use the timestep itime of the ERA file (and
+# of the MODES file if it has a time dimension). With itime=None every
+# timestep is read and done at once, and the outputs have an extra time
+# index after the variable index, i.e. [var,time,...].
+
+def get_time_slice(itime):
+	'''returns the time slice to read for itime (None for all timesteps)'''
+	if itime is None: return slice(None)
+	return slice(itime, itime+1)
+
+def read_flippedMODES_data(MODES_ds, var, tslice, iplev=slice(None)):
+	'''reads the MODES variable var at pressure level(s) iplev for the timesteps tslice flipped along lat, indexing is [time,(plev),lat,lon]'''
+	if 'time' in MODES_ds[var].dims: indata = MODES_ds[var][tslice,iplev,:,:].values
+	else:                            indata = MODES_ds[var][iplev,:,:].values[np.newaxis,...] #single time MODES file
+	return np.flip(indata, axis=-2)
 
 # Combined ERA-MODES Data
-def get_full_field_ERA_and_flippedMODES_q_data(ERA_datafile, MODES_datafile):
+@cache_q_data('p')
+def get_full_field_ERA_and_flippedMODES_q_data(ERA_datafile, MODES_datafile, itime=0):
 	"""
 	This functions reads in and computes relavent q and qmodes data. 
 	Output data includes the following perturbation data for a single pressure level:
@@ -82,35 +259,39 @@ def get_full_field_ERA_and_flippedMODES_q_data(ERA_datafile, MODES_datafile):
 	"""
 	ERA_ds   = xa.open_dataset(ERA_datafile) 
 	MODES_ds = xa.open_dataset(MODES_datafile)
+	tslice   = get_time_slice(itime)
 
-	#Reading in qERA data (full q not perturbation quantity ... yet)
-	qERA = ERA_ds['q'].values[0,:,:,:]
+	#Reading in qERA data (full q not perturbation quantity ... yet), indexing is [time,plev,lat,lon]
+	qERA = ERA_ds['q'][tslice,:,:,:].values
 	
 	#Initial qERA calcs
-	qbkg = np.mean(qERA, axis=(1,2)) #average over lat and lon indicies (indicies 1 and 2 respectively)
+	qbkg = np.mean(qERA, axis=(2,3)) #average over lat and lon indicies (indicies 2 and 3 respectively)
 	
 	plev = ERA_ds['plev'].values
-	qbkg_deriv = Deriv(plev, qbkg)
+	qbkg_deriv = Deriv_Along_Axis(plev, qbkg, axis=1)
 
 	#Reading MODES Data
-	qEIG = np.flip(MODES_ds['q_EIG'].values, axis=1)
-	qWIG = np.flip(MODES_ds['q_WIG'].values, axis=1)
-	qBAL = np.flip(MODES_ds['q_BAL'].values, axis=1)
+	qEIG = read_flippedMODES_data(MODES_ds, 'q_EIG', tslice)
+	qWIG = read_flippedMODES_data(MODES_ds, 'q_WIG', tslice)
+	qBAL = read_flippedMODES_data(MODES_ds, 'q_BAL', tslice)
 
 	#turning qERA into a perturbation quantity and reading in and computing MODES values
-	for i in range(len(plev)):
-		qERA[i,:,:] = qERA[i,:,:]   - qbkg[i]
-		qEIG[i,:,:] = qbkg_deriv[i] * qEIG[i,:,:] # indexing is [plev,lat,lon] flipping MODES data along lat ERA and MODES data grids correspond
-		qWIG[i,:,:] = qbkg_deriv[i] * qWIG[i,:,:] # indexing is [plev,lat,lon] flipping MODES data along lat ERA and MODES data grids correspond
-		qBAL[i,:,:] = qbkg_deriv[i] * qBAL[i,:,:] # indexing is [plev,lat,lon] flipping MODES data along lat ERA and MODES data grids correspond
+	#(out of place so a single time MODES file broadcasts against all of the ERA timesteps)
+	qERA -= qbkg[:,:,np.newaxis,np.newaxis]
+	qEIG = qbkg_deriv[:,:,np.newaxis,np.newaxis] * qEIG # indexing is [time,plev,lat,lon] flipping MODES data along lat ERA and MODES data grids correspond
+	qWIG = qbkg_deriv[:,:,np.newaxis,np.newaxis] * qWIG # indexing is [time,plev,lat,lon] flipping MODES data along lat ERA and MODES data grids correspond
+	qBAL = qbkg_deriv[:,:,np.newaxis,np.newaxis] * qBAL # indexing is [time,plev,lat,lon] flipping MODES data along lat ERA and MODES data grids correspond
 
 	#Calculating qM
 	qM = qERA - qEIG - qWIG - qBAL
 
-	return np.array([qERA, qEIG, qWIG, qBAL, qM])
+	q_data = np.array([qERA, qEIG, qWIG, qBAL, qM])
+	if itime is not None: q_data = q_data[:,0]
+	return q_data
 
 # Combined ERA-MODES Data
-def get_full_field_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background(ERA_datafile, MODES_datafile):
+@cache_q_data('p_and_lat')
+def get_full_field_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background(ERA_datafile, MODES_datafile, itime=0):
 	"""
 	This functions reads in and computes relavent q and qmodes data. 
 	Output data includes the following perturbation data for a single pressure level:
@@ -125,42 +306,46 @@ def get_full_field_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_backgrou
 	"""
 	ERA_ds   = xa.open_dataset(ERA_datafile) 
 	MODES_ds = xa.open_dataset(MODES_datafile)
+	tslice   = get_time_slice(itime)
 
-	#Reading in qERA data (full q not perturbation quantity ... yet)
-	qERA  = ERA_ds['q'].values[0,:,:,:]
+	#Reading in qERA data (full q not perturbation quantity ... yet), indexing is [time,plev,lat,lon]
+	qERA  = ERA_ds['q'][tslice,:,:,:].values
 	plev  = ERA_ds['plev'].values
-	nplev = np.shape(qERA)[0]
-	nlat  = np.shape(qERA)[1]
 	
 
 	#Background Calculations
-	qbkg = np.mean(qERA, axis=2) #average over lat and lon indicies (indicies 1 and 2 respectively)
+	qbkg = np.mean(qERA, axis=3) #average over lon indicies (index 3)
 
-	qbkg_deriv = np.zeros((nplev,nlat))
-	for ilat in range(nlat):
-			qbkg_deriv[:,ilat] = Deriv(plev,qbkg[:,ilat])
+	qbkg_deriv = Deriv_Along_Axis(plev, qbkg, axis=1)
 
 
 	#Reading MODES Data
-	qEIG = np.flip(MODES_ds['q_EIG'].values, axis=1)
-	qWIG = np.flip(MODES_ds['q_WIG'].values, axis=1)
-	qBAL = np.flip(MODES_ds['q_BAL'].values, axis=1)
+	qEIG = read_flippedMODES_data(MODES_ds, 'q_EIG', tslice)
+	qWIG = read_flippedMODES_data(MODES_ds, 'q_WIG', tslice)
+	qBAL = read_flippedMODES_data(MODES_ds, 'q_BAL', tslice)
 
 	#turning qERA into a perturbation quantity and reading in and computing MODES values
-	for i in range(nplev):
-		for j in range(nlat):
-			qERA[i,j,:] = qERA[i,j,:]     - qbkg[i,j]
-			qEIG[i,j,:] = qbkg_deriv[i,j] * qEIG[i,j,:] # indexing is [plev,lat,lon] flipping MODES data along lat ERA and MODES data grids correspond
-			qWIG[i,j,:] = qbkg_deriv[i,j] * qWIG[i,j,:] # indexing is [plev,lat,lon] flipping MODES data along lat ERA and MODES data grids correspond
-			qBAL[i,j,:] = qbkg_deriv[i,j] * qBAL[i,j,:] # indexing is [plev,lat,lon] flipping MODES data along lat ERA and MODES data grids correspond
+	#(out of place so a single time MODES file broadcasts against all of the ERA timesteps)
+	qERA -= qbkg[:,:,:,np.newaxis]
+	qEIG = qbkg_deriv[:,:,:,np.newaxis] * qEIG # indexing is [time,plev,lat,lon] flipping MODES data along lat ERA and MODES data grids correspond
+	qWIG = qbkg_deriv[:,:,:,np.newaxis] * qWIG # indexing is [time,plev,lat,lon] flipping MODES data along lat ERA and MODES data grids correspond
+	qBAL = qbkg_deriv[:,:,:,np.newaxis] * qBAL # indexing is [time,plev,lat,lon] flipping MODES data along lat ERA and MODES data grids correspond
 
 	#Calculating qM
 	qM = qERA - qEIG - qWIG - qBAL
 
-	return np.array([qERA, qEIG, qWIG, qBAL, qM])
+	q_data = np.array([qERA, qEIG, qWIG, qBAL, qM])
+	if itime is not None: q_data = q_data[:,0]
+	return q_data
+
 
+def get_plev_window(nplev, iplev):
+	'''returns the slice of pressure levels needed for the background derivative at iplev (iplev and its neighbours) and the index of iplev in that slice'''
+	plev_window = slice(max(iplev-1,0), min(iplev+2,nplev))
+	return plev_window, iplev - plev_window.start
 
-def get_single_plev_ERA_and_flippedMODES_q_data(ERA_datafile, MODES_datafile, iplev):
+@cache_q_data('p')
+def get_single_plev_ERA_and_flippedMODES_q_data(ERA_datafile, MODES_datafile, iplev, itime=0):
 	"""
 	This functions reads in and computes relavent q and qmodes data. 
 	Output data includes the following perturbation data for a single pressure level:
@@ -169,35 +354,38 @@ def get_single_plev_ERA_and_flippedMODES_q_data(ERA_datafile, MODES_datafile, ip
 		qWIG
 		qBAL
 		qM   (qERA - all qMODES)
+
+	Only the pressure level iplev and its neighbouring levels (needed for the 
+	background derivative) are read from the files.
 	"""
 	ERA_ds   = xa.open_dataset(ERA_datafile) 
 	MODES_ds = xa.open_dataset(MODES_datafile)
+	tslice   = get_time_slice(itime)
 
-	#Reading in qERA data (full q not perturbation quantity ... yet)
-	qERA = ERA_ds['q'].values[0,:,:,:]
-	plev = ERA_ds['plev'].values
+	#Reading in qERA data (full q not perturbation quantity ... yet) for the levels around iplev, indexing is [time,plev,lat,lon]
+	plev  = ERA_ds['plev'].values
+	[plev_window, iwin] = get_plev_window(len(plev), iplev)
+	qERA  = ERA_ds['q'][tslice,plev_window,:,:].values
 	
 	#Initial qERA calcs
-	qbkg = np.mean(qERA, axis=(1,2)) #average over lat and lon indicies (indicies 1 and 2 respectively)
-	
-	plev = ERA_ds['plev'].values
-	qbkg_deriv = Deriv(plev, qbkg)
-	
-
-	
+	qbkg = np.mean(qERA, axis=(2,3)) #average over lat and lon indicies (indicies 2 and 3 respectively)
+	qbkg_deriv = Deriv_Along_Axis(plev[plev_window], qbkg, axis=1)
 
 	#Reading MODES Data
-	qERA = qERA[iplev,:,:]   - qbkg[iplev]
-	qEIG = qbkg_deriv[iplev] * np.flip( MODES_ds['q_EIG'].values[iplev,:,:], axis=0 ) # indexing for full q_EIG is [plev,lat,lon] flipping 
-	qWIG = qbkg_deriv[iplev] * np.flip( MODES_ds['q_WIG'].values[iplev,:,:], axis=0 ) # indexing for full q_WIG is [plev,lat,lon] flipping 
-	qBAL = qbkg_deriv[iplev] * np.flip( MODES_ds['q_BAL'].values[iplev,:,:], axis=0 ) # indexing for full q_BAL is [plev,lat,lon] flipping 
+	qERA = qERA[:,iwin,:,:]   - qbkg[:,iwin,np.newaxis,np.newaxis]
+	qEIG = qbkg_deriv[:,iwin,np.newaxis,np.newaxis] * read_flippedMODES_data(MODES_ds, 'q_EIG', tslice, iplev) # indexing for full q_EIG is [plev,lat,lon] flipping 
+	qWIG = qbkg_deriv[:,iwin,np.newaxis,np.newaxis] * read_flippedMODES_data(MODES_ds, 'q_WIG', tslice, iplev) # indexing for full q_WIG is [plev,lat,lon] flipping 
+	qBAL = qbkg_deriv[:,iwin,np.newaxis,np.newaxis] * read_flippedMODES_data(MODES_ds, 'q_BAL', tslice, iplev) # indexing for full q_BAL is [plev,lat,lon] flipping 
 
 	#Calculating qM
 	qM = qERA - qEIG - qWIG - qBAL
 
-	return np.array([qERA, qEIG, qWIG, qBAL, qM])
+	q_data = np.array([qERA, qEIG, qWIG, qBAL, qM])
+	if itime is not None: q_data = q_data[:,0]
+	return q_data
 
-def get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background(ERA_datafile, MODES_datafile, iplev):
+@cache_q_data('p_and_lat')
+def get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background(ERA_datafile, MODES_datafile, iplev, itime=0):
 	"""
 	This functions reads in and computes relavent q and qmodes data. 
 	Output data includes the following perturbation data for a single pressure level:
@@ -206,39 +394,103 @@ def get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_backgro
 		qWIG
 		qBAL
 		qM   (qERA - all qMODES)
+
+	Only the pressure level iplev and its neighbouring levels (needed for the 
+	background derivative) are read from the files.
 	"""
 	ERA_ds   = xa.open_dataset(ERA_datafile) 
 	MODES_ds = xa.open_dataset(MODES_datafile)
+	tslice   = get_time_slice(itime)
 
-	#Reading in qERA data (full q not perturbation quantity ... yet)
-	qERA  = ERA_ds['q'].values[0,:,:,:]
+	#Reading in qERA data (full q not perturbation quantity ... yet) for the levels around iplev, indexing is [time,plev,lat,lon]
 	plev  = ERA_ds['plev'].values
-	nplev = np.shape(qERA)[0]
-	nlat  = np.shape(qERA)[1]
-	nlon  = np.shape(qERA)[2]
+	[plev_window, iwin] = get_plev_window(len(plev), iplev)
+	qERA  = ERA_ds['q'][tslice,plev_window,:,:].values
 	
-	#Background Calculations
-	qbkg = np.mean(qERA, axis=2) #average over lon indicies (index 2)
+	#Background Calculations (done once for every latitude)
+	qbkg = np.mean(qERA, axis=3) #average over lon indicies (index 3)
 
-	qbkg_deriv = np.zeros((nplev,nlat))
-	for ilat in range(nlat):
-			qbkg_deriv[:,ilat] = Deriv(plev,qbkg[:,ilat])
+	qbkg_deriv = Deriv_Along_Axis(plev[plev_window], qbkg, axis=1)[:,iwin,:]
 
 	#Reading MODES Data
-	qERA = qERA[iplev,:,:] #Reducing qERA to desired plev data only
-	qEIG = np.zeros((nlat,nlon))
-	qWIG = np.zeros((nlat,nlon))
-	qBAL = np.zeros((nlat,nlon))
-	for ilat in range(nlat):
-		qERA[ilat,:] = qERA[ilat,:]   - qbkg[iplev,ilat]
-		qEIG[ilat,:] = qbkg_deriv[iplev,ilat] * np.flip( MODES_ds['q_EIG'].values[iplev,:,:], axis=0 )[ilat,:] # indexing for full q_EIG is [plev,lat,lon] flipping 
-		qWIG[ilat,:] = qbkg_deriv[iplev,ilat] * np.flip( MODES_ds['q_WIG'].values[iplev,:,:], axis=0 )[ilat,:] # indexing for full q_WIG is [plev,lat,lon] flipping 
-		qBAL[ilat,:] = qbkg_deriv[iplev,ilat] * np.flip( MODES_ds['q_BAL'].values[iplev,:,:], axis=0 )[ilat,:] # indexing for full q_BAL is [plev,lat,lon] flipping 
+	qERA = qERA[:,iwin,:,:] - qbkg[:,iwin,:,np.newaxis] #Reducing qERA to desired plev data only
+	qEIG = qbkg_deriv[:,:,np.newaxis] * read_flippedMODES_data(MODES_ds, 'q_EIG', tslice, iplev) # indexing for full q_EIG is [plev,lat,lon] flipping 
+	qWIG = qbkg_deriv[:,:,np.newaxis] * read_flippedMODES_data(MODES_ds, 'q_WIG', tslice, iplev) # indexing for full q_WIG is [plev,lat,lon] flipping 
+	qBAL = qbkg_deriv[:,:,np.newaxis] * read_flippedMODES_data(MODES_ds, 'q_BAL', tslice, iplev) # indexing for full q_BAL is [plev,lat,lon] flipping 
 
 	#Calculating qM
 	qM = qERA - qEIG - qWIG - qBAL
 
-	return np.array([qERA, qEIG, qWIG, qBAL, qM])
+	q_data = np.array([qERA, qEIG, qWIG, qBAL, qM])
+	if itime is not None: q_data = q_data[:,0]
+	return q_data
+
+def get_lat_variance_profiles(ERA_datafile, MODES_datafile, plev_list, components=None, bkg_type='p', itime=0, ddof=1):
+	"""
+	Calculates the zonal variance at every latitude of the q components
+	(qERA perturbations, qEIG, qWIG, qBAL, and qM as in the get_single_plev_* 
+	readers) for all of the pressure level indices in plev_list at once. 
+	bkg_type is 'p' (pressure dependent background) or 'p_and_lat' 
+	(pressure and latitude dependent background).
+
+	The requested levels and their neighbours (for the background
+	derivative) are read in one sliced pass and the variance is a single
+	reduction over longitude for all components, levels, and latitudes.
+	components is a dictionary of lists of the parts above (ERA, EIG, WIG,
+	BAL, M) keyed by component name, where the listed parts are added
+	before the variance is taken, e.g. {'qIG':['EIG','WIG']}. By default
+	each part is its own component.
+
+	Returns an xarray DataArray with dimensions (component, plev, lat), with
+	time after component if itime=None.
+	"""
+	if components is None: components = {name:[name] for name in ['ERA','EIG','WIG','BAL','M']}
+
+	ERA_ds   = xa.open_dataset(ERA_datafile)
+	MODES_ds = xa.open_dataset(MODES_datafile)
+	tslice   = get_time_slice(itime)
+	plev     = ERA_ds['plev'].values
+	lat      = ERA_ds['lat'].values
+
+	#Levels to read (the requested levels and their neighbours) and the position of each window in them
+	windows    = [get_plev_window(len(plev), iplev) for iplev in plev_list]
+	read_plev  = sorted( set( ilev for plev_window, _ in windows for ilev in range(plev_window.start, plev_window.stop) ) )
+	read_index = {ilev: iread for iread, ilev in enumerate(read_plev)}
+
+	#Reading in qERA data for the levels, indexing is [time,plev,lat,lon]
+	qERA = ERA_ds['q'][tslice,read_plev,:,:].values
+
+	#Background and background derivative at the requested levels
+	if bkg_type == 'p': qbkg = np.mean(qERA, axis=(2,3), keepdims=True) #indexing is [time,plev,1,1]
+	else:               qbkg = np.mean(qERA, axis=3,     keepdims=True) #indexing is [time,plev,lat,1]
+
+	qbkg_deriv = []
+	for plev_window, iwin in windows:
+		iread = [read_index[ilev] for ilev in range(plev_window.start, plev_window.stop)]
+		qbkg_deriv.append( Deriv_Along_Axis(plev[plev_window], qbkg[:,iread], axis=1)[:,iwin] )
+	qbkg_deriv = np.stack(qbkg_deriv, axis=1)
+
+	#Perturbations and MODES values at the requested levels, indexing is [time,plev,lat,lon]
+	iread  = [read_index[iplev] for iplev in plev_list]
+	q_part = {'ERA': qERA[:,iread] - qbkg[:,iread]}
+	for imode in ['EIG','WIG','BAL']:
+		q_part[imode] = qbkg_deriv * read_flippedMODES_data(MODES_ds, f'q_{imode}', tslice, list(plev_list))
+	q_part['M'] = q_part['ERA'] - q_part['EIG'] - q_part['WIG'] - q_part['BAL']
+
+	#Zonal variance of every component, level, and latitude at once
+	q_data   = np.array([ sum(q_part[part] for part in part_list) for part_list in components.values() ])
+	variance = np.var(q_data, axis=-1, ddof=ddof)
+
+	dims   = ['component', 'time', 'plev', 'lat']
+	coords = {'component':list(components), 'plev':plev[list(plev_list)], 'lat':lat}
+	if itime is None:
+		if 'time' in ERA_ds.coords: coords['time'] = ERA_ds['time'].values
+	else:
+		variance = variance[:,0]
+		dims.remove('time')
+
+	return xa.DataArray(variance, dims=dims, coords=coords, name='q_variance',
+	                    attrs={'long_name':'zonal variance of q', 'bkg_type':bkg_type, 'ddof':ddof})
 
 
 
@@ -257,7 +509,7 @@ def read_ERA_entire_Field_data_from_file(datafile,var):
 def read_ERA_t0_field_plev_contour_from_file(datafile,var,iplev):
 	''' This function reads in the variable var, from the datafile'''
 	ERA_ds = xa.open_dataset(datafile)
-	return ERA_ds[var].values[0,iplev,:,:] #index ordering time,plev,lat,lon
+	return ERA_ds[var][0,iplev,:,:].values #index ordering time,plev,lat,lon
 
 
 
@@ -278,9 +530,85 @@ def read_flippedMODES_entire_Field_data_from_file(datafile,var):
 def read_flippedMODES_t0_field_plev_contour_from_file(datafile,var,iplev):
 	''' This function reads in the variable var, from the datafile'''
 	ERA_ds = xa.open_dataset(datafile)
-	indata = ERA_ds[var].values[iplev,:,:] #index ordering [plev,lat,lon]
+	indata = ERA_ds[var][iplev,:,:].values #index ordering [plev,lat,lon]
 	iflip  = 0 # index 0 is now latitude, index 1 is now longitude
 	return np.flip(indata,iflip)
 
 
 #-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# LATITUDE BAND SPECTRA
+#
+# Bands are given in degrees as {name: (lat_min, lat_max)} and resolved to
+# a [band,lat] averaging matrix once per latitude grid (cos(lat) weighted
+# by default), so the band means and their longitude spectra are computed
+# for every component, band, pressure level, and timestep in one batched
+# matrix multiply and rfft. The amplitudes are |rfft| / nlon, the same as
+# np.abs(np.fft.fft(band_mean)/nlon)[:nlon//2+1].
+#
+# The band spectra of the qMODES components can also be computed straight
+# from the qk values: the band mean of the series is the series of the band
+# mean of qk, and the rfft/nlon of the series at k >= 1 is qk_Re + i*qk_Im
+# (times a phase for the grid offset), so the amplitudes are |qk| of the
+# band mean qk (and |qk_Re| at k=0) without synthesizing the field.
+
+def get_lat_band_weights(lat, bands, weighted=True):
+	'''returns the [band,lat] matrix that averages over the latitudes lat_min <= lat <= lat_max of each band (cos(lat) weighted if weighted)'''
+	band_weights = np.zeros((len(bands), len(lat)))
+	for iband, (lat_min, lat_max) in enumerate(bands.values()):
+		in_band = (lat >= min(lat_min, lat_max)) & (lat <= max(lat_min, lat_max))
+		if not np.any(in_band): raise ValueError(f"no latitudes in the band {list(bands)[iband]} ({lat_min}, {lat_max})")
+		band_weights[iband,in_band] = np.cos(np.radians(lat[in_band])) if weighted else 1.0
+	return band_weights / np.sum(band_weights, axis=1, keepdims=True)
+
+def get_band_spectra(q_data, lat, bands, weighted=True):
+	"""
+	Calculates the latitude band means of q_data (indexing [...,lat,lon],
+	any number of leading indices, e.g. [component,plev,lat,lon]) and the
+	rfft amplitudes of the band means. Returns [band_means, amplitudes]
+	with indexing [...,band,lon] and [...,band,k] (k = 0 to nlon//2).
+	"""
+	nlon       = q_data.shape[-1]
+	band_means = np.matmul(get_lat_band_weights(lat, bands, weighted), q_data)
+	amplitudes = np.abs( np.fft.rfft(band_means, axis=-1) ) / nlon
+	return [band_means, amplitudes]
+
+def get_qk_band_spectra(qk_datafile, bands, components={'EIG':['EIG'], 'WIG':['WIG'], 'BAL':['BAL']}, levels=slice(None), lat_scale=None, weighted=True):
+	"""
+	Calculates the rfft amplitudes of the latitude band means of each
+	qMODES component straight from the qk file (see above). components is a
+	dictionary of lists of modes keyed by component name, where the qk values
+	of the listed modes are added, e.g. {'IG':['EIG','WIG'], 'ROT':['BAL']}.
+	levels are the vgrid_int indices to use (all by default). lat_scale, if
+	given, multiplies the qk values before the band means (e.g. the
+	background derivative, indexing [vgrid_int,lat] of the selected levels
+	in the qk file latitude order).
+
+	Returns an xarray DataArray of the amplitudes with dimensions
+	(component, [time], vgrid_int, band, k_mode).
+	"""
+	qk_ds        = xa.open_dataset(qk_datafile)
+	band_weights = get_lat_band_weights(qk_ds['lat'].values, bands, weighted)
+
+	amplitudes = []
+	for name, mode_list in components.items():
+		qk = sum( qk_ds[f'qk_{imode}'][...,levels,:].values for imode in mode_list ) # indexing is [...,Re+Im,k,vgrid_int,lat]
+		if lat_scale is not None: qk = qk * lat_scale
+
+		qk_band = np.matmul(qk, band_weights.T)                       # indexing is [...,Re+Im,k,vgrid_int,band]
+		qk_band = np.moveaxis(qk_band[...,0,:,:,:] + 1j*qk_band[...,1,:,:,:], -3, -1) # indexing is [...,vgrid_int,band,k]
+		qk_band[...,0] = qk_band[...,0].real
+		amplitudes.append( np.abs(qk_band) )
+
+	qk_var = qk_ds[f'qk_{components[list(components)[0]][0]}'][...,levels,:]
+	dims   = ['component'] + [dim for dim in qk_var.dims if dim not in ['Re+Im','k_mode','lat']] + ['band','k_mode']
+	coords = {dim: qk_var[dim].values for dim in dims if dim in qk_var.coords}
+	qk_ds.close()
+
+	return xa.DataArray(np.array(amplitudes), dims=dims, coords={**coords, 'component':list(components), 'band':list(bands)},
+	                    name='q_band_amplitude', attrs={'long_name':'rfft amplitude of the latitude band mean of q', 'weighted':int(weighted)})
+
+#-------------------------------------------------------------------------
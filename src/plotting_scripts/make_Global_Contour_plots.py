@@ -2,7 +2,7 @@
 # Imports
 from mpl_toolkits.basemap import Basemap, shiftgrid
 from matplotlib.patches   import Polygon
-from OmegaMODES_Functions import read_ERA_grid_data, get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background
+from OmegaMODES_Functions import read_ERA_grid_data, get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background, print_q_data_stats
 
 import cartopy.feature    as cfeature
 import cartopy.crs        as ccrs
@@ -62,6 +62,7 @@ nlon  = lon.shape[0]
 
 # Reading in ERA and qMODES data
 [qERA, qEIG, qWIG, qROT, qM] = get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background(ERA_datafile, qMODES_datafile, iplev)
+print_q_data_stats()
 
 #changing units to g/kg and creating combined IG mode
 qERA = 1000.0 * qERA
@@ -2,7 +2,7 @@
 # Imports
 from mpl_toolkits.basemap import Basemap, shiftgrid
 from matplotlib.patches   import Polygon
-from OmegaMODES_Functions import read_ERA_grid_data, get_single_plev_ERA_and_flippedMODES_q_data
+from OmegaMODES_Functions import read_ERA_grid_data, get_single_plev_ERA_and_flippedMODES_q_data, print_q_data_stats, get_plev_window, Deriv_Along_Axis
 
 import cartopy.feature    as cfeature
 import cartopy.crs        as ccrs
@@ -15,6 +15,10 @@ import numpy             as np
 import custom_colormap   as cc
 
 import argparse
+import sys
+
+sys.path.append("../qMODES_scripts/")
+from qMODES_Functions import get_qmodes_window, get_lat_window_index, get_lon_window_index
 
 #-------------------------------------------------------------------------
 
@@ -26,10 +30,12 @@ import argparse
 parser = argparse.ArgumentParser(description='This script is used to generate pressure level contour plots for an event over a specific region (originally Madison WI )')
 parser.add_argument('-d','--date', help='date to make the contours for',                    required=True)
 parser.add_argument('-p','--plev', help='pressure level to generate the contour plots for', required=True)
+parser.add_argument('--from_qk', help='command line flag that, if included, synthesizes the MODES components only inside the plotted region straight from the qk file (no qMODES file needed)', action='store_true')
 
-args   = parser.parse_args()
-date   = args.date
-iplev  = int( args.plev )
+args    = parser.parse_args()
+date    = args.date
+iplev   = int( args.plev )
+from_qk = args.from_qk
 
 #-------------------------------------------------------------------------
 
@@ -41,6 +47,11 @@ iplev  = int( args.plev )
 # Input Parameters
 ERA_datafile    = f"../../ERA_Data/ERA_{date}_q_pl_data.nc"           # (ntime:1, nplev:137, nlat:640, nlon:1280)
 qMODES_datafile = f"../../output_data/qMODES_Data/qMODES_{date}0000000.nc" # (nplev:137, nlat:640, nlon:1280)
+qk_datafile     = f"../../output_data/qk_data/qk_{date}0000000.nc"         # (Re+Im:2, k_mode:351, vgrid_int:137, lat:640)
+
+# Plotted region (lat_min, lat_max) and (lon_min, lon_max) in degrees
+lat_bounds = (20, 70)    # full globe values (-90, 90)
+lon_bounds = (-135, -60) # full globe values (-180, 180)
 
 # Output Parameters
 outputfile = f"../../output_data/plots/qMODES_plev"
@@ -59,7 +70,32 @@ nlat  = lat.shape[0]
 nlon  = lon.shape[0]
 
 # Reading in ERA and qMODES data
-[qERA, qEIG, qWIG, qROT, qM] = get_single_plev_ERA_and_flippedMODES_q_data(ERA_datafile, qMODES_datafile, iplev)
+if from_qk:
+	# the background uses the full ERA levels around iplev, everything else is only read/synthesized inside the region
+	ERA_ds = xa.open_dataset(ERA_datafile)
+	[plev_window, iwin] = get_plev_window(nplev, iplev)
+	qERA_window = ERA_ds['q'][0,plev_window,:,:].values
+	qbkg        = np.mean(qERA_window, axis=(1,2))
+	qbkg_deriv  = Deriv_Along_Axis(plev[plev_window], qbkg)[iwin]
+
+	lat_index = get_lat_window_index(lat, *lat_bounds)
+	lon_index = get_lon_window_index(lon, *lon_bounds)
+	qERA      = qERA_window[iwin][lat_index][:,lon_index] - qbkg[iwin]
+
+	# MODES lat runs the other way, so the region is put on the ERA latitudes
+	q_window = get_qmodes_window(qk_datafile, lon, lat_bounds, lon_bounds, levels=iplev)
+	q_window = q_window.sel(lat=lat[lat_index], method='nearest')
+
+	qEIG = qbkg_deriv * q_window['q_EIG'].values[0]
+	qWIG = qbkg_deriv * q_window['q_WIG'].values[0]
+	qROT = qbkg_deriv * q_window['q_BAL'].values[0]
+	qM   = qERA - qEIG - qWIG - qROT
+
+	lat = lat[lat_index]
+	lon = lon[lon_index]
+else:
+	[qERA, qEIG, qWIG, qROT, qM] = get_single_plev_ERA_and_flippedMODES_q_data(ERA_datafile, qMODES_datafile, iplev)
+	print_q_data_stats()
 
 #Changing units to g/kg and adding IG modes
 qERA = 1000.0 * qERA
@@ -77,10 +113,10 @@ qIG  = qEIG + qWIG
 #-------------------------------------------------------------------------
 #Setting Plot Parameters
 cllw = 0.5
-latmin = 20   # full globe values -90
-latmax = 70   # full globe values 90
-lonmin = -135 # full globe values -180 
-lonmax = -60 # full globe values 180
+latmin = lat_bounds[0]
+latmax = lat_bounds[1]
+lonmin = lon_bounds[0]
+lonmax = lon_bounds[1]
 
 qERA_line_color = "blue"
 qROT_line_color = "green"
@@ -114,10 +150,13 @@ map = Basemap( projection = 'mill', resolution = 'i',
                llcrnrlat  = latmin,  urcrnrlat = latmax,
                llcrnrlon  = lonmin,  urcrnrlon = lonmax  )
 
-qERA, shifted_lon = shiftgrid(180., qERA, lon, start=False)  # shiftgrid
-qROT, _           = shiftgrid(180., qROT, lon, start=False)  # shiftgrid
-qIG,  _           = shiftgrid(180., qIG,  lon, start=False)  # shiftgrid
-qM,   _           = shiftgrid(180., qM,   lon, start=False)  # shiftgrid
+if from_qk:
+	shifted_lon = np.where(lon > 180.0, lon - 360.0, lon) # region values are already in order from lonmin
+else:
+	qERA, shifted_lon = shiftgrid(180., qERA, lon, start=False)  # shiftgrid
+	qROT, _           = shiftgrid(180., qROT, lon, start=False)  # shiftgrid
+	qIG,  _           = shiftgrid(180., qIG,  lon, start=False)  # shiftgrid
+	qM,   _           = shiftgrid(180., qM,   lon, start=False)  # shiftgrid
 
 X , Y  = np.meshgrid(shifted_lon,lat)
 xx, yy = map(X,Y)
@@ -2,7 +2,7 @@
 # Imports
 from mpl_toolkits.basemap import Basemap, shiftgrid
 from matplotlib.patches   import Polygon
-from OmegaMODES_Functions import read_ERA_grid_data, get_single_plev_ERA_and_flippedMODES_q_data, get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background
+from OmegaMODES_Functions import read_ERA_grid_data, get_single_plev_ERA_and_flippedMODES_q_data, get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background, print_q_data_stats, get_band_spectra
 
 import cartopy.feature    as cfeature
 import cartopy.crs        as ccrs
@@ -58,9 +58,11 @@ qMODES_datafile = f"../../output_data/qMODES_Data/qMODES_{date}0000000.nc" # (np
 # Script/Plotting Parameters
 ilat       = 150 #latitude index to perform the FFT along
 ilat_delta = 20 # number of lat indicies above and below that are included in the "average FFT"
-MidlatN_indicies =  [105, 213] # 45 N +- 15 deg      ########[123, 195] # 45 N +- 10 deg
-Tropics_indicies =  [266, 373] # 0    +- 15 deg      ########[283, 356] # 0    +- 10 deg
-MidlatS_indicies =  [426, 534] # 45 S +- 15 deg      ########[444, 516] # 45 S +- 10 deg
+
+# Latitude bands (lat_min, lat_max) in degrees, the band means are cos(lat) weighted
+bands = {'MidlatN': ( 30.0,  60.0),  # 45 N +- 15 deg      ########( 35.0,  55.0) # 45 N +- 10 deg
+         'Tropics': (-15.0,  15.0),  # 0    +- 15 deg      ########(-10.0,  10.0) # 0    +- 10 deg
+         'MidlatS': (-60.0, -30.0)}  # 45 S +- 15 deg      ########(-55.0, -35.0) # 45 S +- 10 deg
 
 
 #-------------------------------------------------------------------------
@@ -80,6 +82,7 @@ nlon  = lon.shape[0]
 # Reading in ERA and qMODES data
 
 [qERA, qEIG, qWIG, qROT, qM] = get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background(ERA_datafile, qMODES_datafile, iplev)
+print_q_data_stats()
 
 #Changing units to g/kg and adding IG modes
 qERA = 1000.0 * qERA
@@ -97,24 +100,20 @@ qIG  = qEIG + qWIG
 #-------------------------------------------------------------------------
 #Calculations
 
-#Calculating the averages for the 3 regions
-
-MidlatN_qERA_avg = np.mean( qERA[MidlatN_indicies[0]:MidlatN_indicies[1]+1, :], 0)
-MidlatN_qROT_avg = np.mean( qROT[MidlatN_indicies[0]:MidlatN_indicies[1]+1, :], 0)
-MidlatN_qIG_avg  = np.mean(  qIG[MidlatN_indicies[0]:MidlatN_indicies[1]+1, :], 0)
-MidlatN_qM_avg   = np.mean(   qM[MidlatN_indicies[0]:MidlatN_indicies[1]+1, :], 0)
+#Calculating the band averages and their FFT amplitudes for the 3 regions and 4 components at once
+#indexing is [component,band,lon] for the averages and [component,band,k] for the FFTs
 
+[band_avg, band_FFT] = get_band_spectra(np.array([qERA, qROT, qIG, qM]), lat, bands)
 
-Tropics_qERA_avg = np.mean( qERA[Tropics_indicies[0]:Tropics_indicies[1]+1, :], 0)
-Tropics_qROT_avg = np.mean( qROT[Tropics_indicies[0]:Tropics_indicies[1]+1, :], 0)
-Tropics_qIG_avg  = np.mean(  qIG[Tropics_indicies[0]:Tropics_indicies[1]+1, :], 0)
-Tropics_qM_avg   = np.mean(   qM[Tropics_indicies[0]:Tropics_indicies[1]+1, :], 0)
+[[MidlatN_qERA_avg, Tropics_qERA_avg, MidlatS_qERA_avg],
+ [MidlatN_qROT_avg, Tropics_qROT_avg, MidlatS_qROT_avg],
+ [MidlatN_qIG_avg,  Tropics_qIG_avg,  MidlatS_qIG_avg ],
+ [MidlatN_qM_avg,   Tropics_qM_avg,   MidlatS_qM_avg  ]] = band_avg
 
-
-MidlatS_qERA_avg = np.mean( qERA[MidlatS_indicies[0]:MidlatS_indicies[1]+1, :], 0)
-MidlatS_qROT_avg = np.mean( qROT[MidlatS_indicies[0]:MidlatS_indicies[1]+1, :], 0)
-MidlatS_qIG_avg  = np.mean(  qIG[MidlatS_indicies[0]:MidlatS_indicies[1]+1, :], 0)
-MidlatS_qM_avg   = np.mean(   qM[MidlatS_indicies[0]:MidlatS_indicies[1]+1, :], 0)
+[[MidlatN_qERA_FFT, Tropics_qERA_FFT, MidlatS_qERA_FFT],
+ [MidlatN_qROT_FFT, Tropics_qROT_FFT, MidlatS_qROT_FFT],
+ [MidlatN_qIG_FFT,  Tropics_qIG_FFT,  MidlatS_qIG_FFT ],
+ [MidlatN_qM_FFT,   Tropics_qM_FFT,   MidlatS_qM_FFT  ]] = band_FFT
 
 #-------------------------------------------------------------------------
 
@@ -128,22 +127,6 @@ qROT_FFT = np.fft.fft( qROT[ilat,:] ) / nlon
 qIG_FFT  = np.fft.fft( qIG[ilat, :] ) / nlon 
 qM_FFT   = np.fft.fft( qM[ilat,  :] ) / nlon 
 
-
-MidlatN_qERA_FFT = np.fft.fft( MidlatN_qERA_avg ) / nlon
-MidlatN_qROT_FFT = np.fft.fft( MidlatN_qROT_avg ) / nlon
-MidlatN_qIG_FFT  = np.fft.fft( MidlatN_qIG_avg  ) / nlon
-MidlatN_qM_FFT   = np.fft.fft( MidlatN_qM_avg   ) / nlon
-
-Tropics_qERA_FFT = np.fft.fft( Tropics_qERA_avg ) / nlon
-Tropics_qROT_FFT = np.fft.fft( Tropics_qROT_avg ) / nlon
-Tropics_qIG_FFT  = np.fft.fft( Tropics_qIG_avg  ) / nlon
-Tropics_qM_FFT   = np.fft.fft( Tropics_qM_avg   ) / nlon
-
-MidlatS_qERA_FFT = np.fft.fft( MidlatS_qERA_avg ) / nlon
-MidlatS_qROT_FFT = np.fft.fft( MidlatS_qROT_avg ) / nlon
-MidlatS_qIG_FFT  = np.fft.fft( MidlatS_qIG_avg  ) / nlon
-MidlatS_qM_FFT   = np.fft.fft( MidlatS_qM_avg   ) / nlon
-
 #-------------------------------------------------------------------------
 
 
@@ -165,14 +148,14 @@ band_alpha       = 0.20 # setting alpha value (transparancy) of the band region
 line_alpha       = 0.75
 
 # Coreners of regions for drawing rectangle over region
-MidlatN_lats = [lat[MidlatN_indicies[0]], lat[MidlatN_indicies[1]], lat[MidlatN_indicies[1]], lat[MidlatN_indicies[0]] ]
-MidlatN_lons = [lonmin,                   lonmin,                   lonmax,                   lonmax                   ]
+MidlatN_lats = [bands['MidlatN'][1], bands['MidlatN'][0], bands['MidlatN'][0], bands['MidlatN'][1] ]
+MidlatN_lons = [lonmin,              lonmin,              lonmax,              lonmax              ]
 
-Tropics_lats = [lat[Tropics_indicies[0]], lat[Tropics_indicies[1]], lat[Tropics_indicies[1]], lat[Tropics_indicies[0]] ]
-Tropics_lons = [lonmin,                   lonmin,                   lonmax,                   lonmax                   ]
+Tropics_lats = [bands['Tropics'][1], bands['Tropics'][0], bands['Tropics'][0], bands['Tropics'][1] ]
+Tropics_lons = [lonmin,              lonmin,              lonmax,              lonmax              ]
 
-MidlatS_lats = [lat[MidlatS_indicies[0]], lat[MidlatS_indicies[1]], lat[MidlatS_indicies[1]], lat[MidlatS_indicies[0]] ]
-MidlatS_lons = [lonmin,                   lonmin,                   lonmax,                   lonmax                   ]
+MidlatS_lats = [bands['MidlatS'][1], bands['MidlatS'][0], bands['MidlatS'][0], bands['MidlatS'][1] ]
+MidlatS_lons = [lonmin,              lonmin,              lonmax,              lonmax              ]
 
 # Plot Contours and Colormap info
 qERA_contours = np.linspace(-10.0, 10.0,21)
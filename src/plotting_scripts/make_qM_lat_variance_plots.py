@@ -3,7 +3,7 @@
 
 from mpl_toolkits.basemap    import Basemap, shiftgrid
 from matplotlib.patches      import Polygon
-from OmegaMODES_Functions    import read_ERA_grid_data, get_single_plev_ERA_and_flippedMODES_q_data
+from OmegaMODES_Functions    import read_ERA_grid_data, get_lat_variance_profiles
 
 import matplotlib.pyplot as plt
 import xarray            as xa
@@ -62,33 +62,18 @@ fig, axes = plt.subplots(nrows=2, ncols=2, figsize=(12,8))
 
 color_list = ['r','g','b','goldenrod','c','mediumpurple','m','k','gray','darkorange']
 
-#Initalizing values for loop
+#Calculating the variance profiles for all of the levels at once, indexing is [component,plev,lat]
+components = {'qERA':['ERA'], 'qROT':['BAL'], 'qIG':['EIG','WIG'], 'qM':['M']}
 
-qERA = np.zeros((nlat,nlon))
-qROT = np.zeros((nlat,nlon))
-qIG  = np.zeros((nlat,nlon))
-qM   = np.zeros((nlat,nlon))
-
-qERA_variance = np.zeros(nlat)
-qROT_variance = np.zeros(nlat)
-qIG_variance  = np.zeros(nlat)
-qM_variance   = np.zeros(nlat)
+q_variance = get_lat_variance_profiles(ERA_datafile, qMODES_datafile, plev_list, components)
+q_variance = 1000.0**2 * q_variance #converting to g^2/kg^2
 
 for iplev in range(len(plev_list)):
 
-	[qERA,qEIG,qWIG,qROT,qM] = get_single_plev_ERA_and_flippedMODES_q_data(ERA_datafile, qMODES_datafile, plev_list[iplev]) #indexing for q vars is [lat,lon]
-
-	qERA = 1000.0 * qERA          #converting to g/kg
-	qROT = 1000.0 * qROT          #converting to g/kg
-	qIG  = 1000.0 * (qEIG + qWIG) #converting to g/kg and switch to IG only
-	qM   = 1000.0 * qM            #converting to g/kg
-
-	for ilat in range(nlat):
-
-		qERA_variance[ilat] = np.var(qERA[ilat,:],ddof=1)
-		qROT_variance[ilat] = np.var(qROT[ilat,:],ddof=1)
-		qIG_variance[ilat]  = np.var(qIG[ilat,:], ddof=1)
-		qM_variance[ilat]   = np.var(qM[ilat,:],  ddof=1)
+	qERA_variance = q_variance.sel(component='qERA').values[iplev,:]
+	qROT_variance = q_variance.sel(component='qROT').values[iplev,:]
+	qIG_variance  = q_variance.sel(component='qIG' ).values[iplev,:]
+	qM_variance   = q_variance.sel(component='qM'  ).values[iplev,:]
 
     #Generating The Plots
 
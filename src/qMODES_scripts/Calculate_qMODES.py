@@ -14,11 +14,14 @@
 
 #--------------------------------------------------------------------------
 #IMPORTS
+import os
 import time
 import argparse
 import xarray as xa
-import numpy as np
 from datetime import datetime
+from qMODES_Functions import synthesize_qmodes, synthesize_qmodes_bands, get_k_bands, get_k_band_name, create_streamed_outfile, get_qmodes_streamed_layout, get_qmodes_block_size, \
+                             add_output_encoding_args, get_output_encoding_args, get_output_encoding, get_encoding_attrs, write_zarr_date, \
+                             add_input_read, timed_stage, get_run_stats_attrs, write_run_stats
 
 #--------------------------------------------------------------------------
 
@@ -30,13 +33,36 @@ from datetime import datetime
 parser = argparse.ArgumentParser(description="This script calculates the qk values for a specified date")
 parser.add_argument('-d', '--date', help='date to calculate in YYYYMMDD format', required=True)
 parser.add_argument('-k', '--k_lower_bound', help='high pass filter that only allows k modes above the given value to be included in the sums', type=int, default=0)
+parser.add_argument('--k_bands', help='comma separated list of k bands (e.g. 0-3,4-20,21-350) that are all synthesized in one pass, each band is saved as its own variable (e.g. q_EIG_k000-003)', default=None)
+parser.add_argument('--lev', help='command line flag that, if included, synthesizes the qk_lev files (qk for only some pressure levels, see Calculate_qk.py --levels/--plevs)', action='store_true')
 parser.add_argument('--noMRG', help='command line flag that, if included, removes the n=0 mode for BAL component',action='store_true')
+parser.add_argument('--mem_budget_mb', help='if given, the output is synthesized and written in blocks of pressure levels (or latitudes) that fit in this memory budget (in MB) instead of all at once', type=float, default=None)
+parser.add_argument('--block_dim', help='dimension to split the output blocks along when --mem_budget_mb is given (plev or lat)', choices=['plev','lat'], default='plev')
+parser.add_argument('--zarr', help='command line flag that, if included, writes the output into a time store for all dates (e.g. qmodes.zarr) in place of the per date file', action='store_true')
+add_output_encoding_args(parser)
 args = parser.parse_args()
 
 date      = args.date
-k_lb_orig = args.k_lower_bound 
-k_lb      = k_lb_orig
+k_lb      = args.k_lower_bound
+k_bands   = args.k_bands
+use_lev   = args.lev
 noMRG     = args.noMRG
+mem_budget_mb = args.mem_budget_mb
+block_dim     = args.block_dim
+out_encoding  = get_output_encoding_args(args)
+use_zarr      = args.zarr
+
+if mem_budget_mb is not None and out_encoding['dtype'] == 'int16':
+    print(f"EXITING: int16 output can't be used with --mem_budget_mb (streamed output), use --out_dtype float32")
+    exit()
+
+if k_bands is not None and k_lb != 0:
+    print(f"EXITING: --k_bands and --k_lower_bound can't be used together (give the lower bound in the bands)")
+    exit()
+
+if use_zarr and (mem_budget_mb is not None or out_encoding['dtype'] == 'int16'):
+    print(f"EXITING: --zarr can't be used with --mem_budget_mb or int16 output")
+    exit()
 #--------------------------------------------------------------------------
 
 
@@ -60,9 +86,21 @@ nN = 200 #number of N modes
 # Input and Output File Data
 grid_infile      = "../../input_data/ERA_Data/ERA_FILE_HERE.nc" # sample file to get grid parameters, and ERA file should work if you want to use the same grid
 
-qk_dir           = "../../MODES_Data/qmodes/"
-qk_infile        = qk_dir + f"qk_{date}0000000.nc"
-qk_noMRG_infile  = qk_dir + f"qk_noMRG_{date}0000000.nc"
+qk_dir           = "../../output_data/qk_data/" # Calculate_qk.py output directory
+level_tag        = "_lev" if use_lev else ""
+qk_infile        = qk_dir + f"qk{level_tag}_{date}0000000.nc"
+qk_noMRG_infile  = qk_dir + f"qk_noMRG{level_tag}_{date}0000000.nc"
+
+k_lb_str = str(0)*(3-len(str(k_lb))) + str(k_lb)
+
+outfile  = f"../../output_data/qMODES_Data/qmodes"
+if noMRG:                outfile += f"_noMRG"
+if use_lev:              outfile += f"_lev"
+if k_lb != 0:            outfile += f"_k{k_lb_str}-{nK}"
+if k_bands is not None:  outfile += f"_kbands"
+zarr_store = outfile + ".zarr" # time store for all dates (--zarr)
+outfile += f"_{date}0000000.nc"
+os.makedirs(os.path.dirname(outfile), exist_ok=True)
 #--------------------------------------------------------------------------
 
 
@@ -71,8 +109,10 @@ qk_noMRG_infile  = qk_dir + f"qk_noMRG_{date}0000000.nc"
 # READING INPUT DATA
 
 #Reading in Grid Data
+tic            = time.perf_counter()
 grid_ds        = xa.open_dataset(grid_infile)
 lon            = grid_ds["lon"].values
+add_input_read('ERA', lon.nbytes, time.perf_counter() - tic)
 
 #Reading in Data for Calculations
 
@@ -81,9 +121,39 @@ qk_ds  = xa.open_dataset(qk_infile)
 lat  = qk_ds["lat"  ].values
 plev = qk_ds["vgrid_int"].values
 
+# qk files made with Calculate_qk.py --all_times have a leading time dimension,
+# all of the timesteps are synthesized together
+if 'time' in qk_ds.dims: qk_time = qk_ds["time"].values
+else:                    qk_time = None
+ntime = 1 if qk_time is None else len(qk_time)
+
+if use_zarr and qk_time is not None:
+    print(f"EXITING: --zarr can't be used with qk files that have a time dimension (one timestep per date in the store)")
+    exit()
+
 nlon           = lon.shape[0]
 nlat           = lat.shape[0]
 nplev          = plev.shape[0]
+
+# k bands synthesized for each mode, the output variables are q_{mode} or q_{mode}_{band} with --k_bands
+if k_bands is None:
+    band_list = [(k_lb, None)]
+else:
+    try:
+        band_list = get_k_bands(k_bands, qk_ds.sizes['k_mode'])
+    except ValueError as err:
+        print(f"EXITING: {err}")
+        exit()
+
+def get_var_names(imode):
+    '''returns the output variable names (without the q_) of imode, one per k band'''
+    if k_bands is None: return [imode]
+    return [f"{imode}_{get_k_band_name(*band)}" for band in band_list]
+
+def synthesize_bands(qk_mode):
+    '''returns the list of physical space values of qk_mode, one per k band'''
+    if k_bands is None: return [synthesize_qmodes(qk_mode, lon, k_lb)]
+    return synthesize_qmodes_bands(qk_mode, lon, band_list)
 #--------------------------------------------------------------------------
 
 
@@ -94,59 +164,115 @@ nplev          = plev.shape[0]
 dtnow = datetime.now()
 tic = time.perf_counter()
 
-for imode in Mode_list:
+attrs = {'creation_date':dtnow.strftime("%m/%d/%Y, %H:%M:%S"),
+         'author':author_name,
+         'email' :author_email}
+if k_bands is not None: attrs['k_bands'] = k_bands
 
-    #Reading in q_k fourier coefficient data
-    if imode == 'BAL' and noMRG: qk_ds = xa.open_dataset(qk_noMRG_infile)
-    else: qk_ds = xa.open_dataset(qk_infile)
+# Streaming mode, the output file is created up front and each mode is
+# synthesized and written one block of pressure levels (or latitudes) at a
+# time, only reading the qk values for that block
+if mem_budget_mb is not None:
 
-    qk_mode = qk_ds[f"qk_{imode}"].values 
-    
-    #Initalizing q_mode
-    q_mode  = np.zeros(( nplev, nlat, nlon))
+    var_names = [name for imode in Mode_list for name in get_var_names(imode)]
+    q_ds = create_streamed_outfile(outfile, *get_qmodes_streamed_layout(var_names, plev, lat, lon, qk_time), attrs, **out_encoding)
+
+    # each k band has its own output block, so the budget is split between the bands
+    if block_dim == 'plev': nblock, nrow = nplev, ntime*nlat
+    else:                   nblock, nrow = nlat,  ntime*nplev
+    block_size = get_qmodes_block_size(mem_budget_mb/len(band_list), qk_ds.sizes['k_mode'], nrow, nlon)
+    print(f"synthesizing {block_size} {block_dim} values at a time")
+
+    for imode in Mode_list:
+
+        #Lazily opening q_k fourier coefficient data (only read one block at a time)
+        if imode == 'BAL' and noMRG: qk_ds = xa.open_dataset(qk_noMRG_infile)
+        else: qk_ds = xa.open_dataset(qk_infile)
+
+        for iblock in range(0, nblock, block_size):
+            block = slice(iblock, min(iblock + block_size, nblock))
+
+            tic_read = time.perf_counter()
+            if block_dim == 'plev': qk_block = qk_ds[f"qk_{imode}"][...,block,:].values
+            else:                   qk_block = qk_ds[f"qk_{imode}"][...,block].values
+            add_input_read('qk', qk_block.nbytes, time.perf_counter() - tic_read, files=0)
 
-    # Main Loop
-    for ilon in range(nlon):
-        
-        if k_lb == 0:
-            q_mode[:,:,ilon] += qk_mode[0,0,:,:]
-            k_lb += 1 #shift k_lb by one so loop below calculates remaining terms in sum
+            with timed_stage('synthesize'): q_blocks = synthesize_bands(qk_block)
 
-        # k!= 0 terms of longitude fourier expansion or terms starting from the lower bound
-        for kk in range(k_lb,nK):
-            q_mode[:,:,ilon] += 2.0 * ( qk_mode[0,kk,:,:] * np.cos(float(kk) * np.radians(lon[ilon])) - qk_mode[1,kk,:,:] * np.sin(float(kk) * np.radians(lon[ilon])) )
+            with timed_stage('write'):
+                for name, q_block in zip(get_var_names(imode), q_blocks):
+                    if block_dim == 'plev': q_ds[f'q_{name}'][...,block,:,:] = q_block
+                    else:                   q_ds[f'q_{name}'][...,block,:]   = q_block
 
+        qk_ds.close()
+        print(f"q_{imode} data saved to:\n\t{outfile}")
+        if noMRG: print(f"WARNING: THIS IS A noMRG FILE")
 
+    q_ds.attrs.update( get_run_stats_attrs() )
+    with timed_stage('write'): q_ds.close()
 
-    # SAVING DATA TO NETCDF FILE
+# Otherwise each mode is synthesized all at once and appended to the output file
+# (or all modes are written to the zarr store together at the end)
+else:
 
-    coords    = {'plev': ( ['plev'     ], plev ),
-                 'lat' : ( ['lat'      ], lat  ),
-                 'lon' : ( ['lon'      ], lon  ) }
+    zarr_vars = {}
 
-    data_vars = {f'q_{imode}' :([ 'plev', 'lat', 'lon'], q_mode,
-                        { 'long_name':f'{imode} Part of q'}) }
+    for imode in Mode_list:
 
-    attrs     = {'creation_date':dtnow.strftime("%m/%d/%Y, %H:%M:%S"),
-                 'author':author_name,
-                 'email' :author_email}
+        #Reading in q_k fourier coefficient data
+        tic_read = time.perf_counter()
+        if imode == 'BAL' and noMRG: qk_ds = xa.open_dataset(qk_noMRG_infile)
+        else: qk_ds = xa.open_dataset(qk_infile)
 
-    ds        = xa.Dataset(data_vars=data_vars,
-                           coords=coords,
-                           attrs=attrs)
+        qk_mode = qk_ds[f"qk_{imode}"].values 
+        add_input_read('qk', qk_mode.nbytes, time.perf_counter() - tic_read)
+    
+        # Summing the longitude fourier series for all lon at once with an inverse
+        # real FFT over k (k modes outside of each band are zeroed), indexing is [(time),plev,lat,lon]
+        with timed_stage('synthesize'): q_bands = synthesize_bands(qk_mode)
+
+
+
+        # SAVING DATA TO NETCDF FILE
+
+        coords    = {'plev': ( ['plev'     ], plev ),
+                     'lat' : ( ['lat'      ], lat  ),
+                     'lon' : ( ['lon'      ], lon  ) }
 
-    k_lb_str = str(0)*(3-len(str(k_lb_orig))) + str(k_lb_orig)
+        var_dims  = [ 'plev', 'lat', 'lon']
+        if qk_time is not None:
+            coords['time'] = ( ['time'], qk_time )
+            var_dims       = ['time'] + var_dims
 
-    outfile  = f"../../output_data/qMODES_Data/qmodes"
-    if noMRG:          outfile += f"_noMRG"
-    if k_lb_orig != 0: outfile += f"_k{k_lb_str}-{nK}"
-    outfile += f"_{date}0000000.nc"
+        data_vars = {f'q_{name}' :(var_dims, q_mode,
+                            { 'long_name':f'{name} Part of q'}) for name, q_mode in zip(get_var_names(imode), q_bands)}
 
+        if use_zarr:
+            zarr_vars.update(data_vars)
+            continue
 
-    ds.to_netcdf(outfile, mode='a')
-    print(f"q_{imode} data saved to:\n\t{outfile}")
-    if noMRG: print(f"WARNING: THIS IS A noMRG FILE")
+        # the run statistics so far are saved in the attributes (the full statistics, with the write time, in the .stats.json file)
+        ds        = xa.Dataset(data_vars=data_vars,
+                               coords=coords,
+                               attrs={**attrs, **get_encoding_attrs(**out_encoding), **get_run_stats_attrs()})
+
+        with timed_stage('write'): ds.to_netcdf(outfile, mode='a', encoding=get_output_encoding(ds, **out_encoding))
+        print(f"q_{imode} data saved to:\n\t{outfile}")
+        if noMRG: print(f"WARNING: THIS IS A noMRG FILE")
+
+    if use_zarr:
+        ds = xa.Dataset(data_vars=zarr_vars,
+                        coords=coords,
+                        attrs={**attrs, **get_run_stats_attrs()})
+
+        zarr_chunking = 'level_band' if out_encoding['chunking'] == 'default' else out_encoding['chunking']
+        with timed_stage('write'): write_zarr_date(ds, zarr_store, date, out_encoding['dtype'], zarr_chunking, out_encoding['band_size'])
+        print(f"q data for {date} saved to:\n\t{zarr_store}")
+        if noMRG: print(f"WARNING: THIS IS A noMRG FILE")
 
 toc = time.perf_counter()
 print(f"time to complete main loop = {(toc - tic)/60.0} min")
+
+stats_file = write_run_stats(zarr_store if use_zarr else outfile, "Calculate_qMODES.py", {'date':date, 'k_lb':k_lb, 'k_bands':k_bands, 'noMRG':noMRG, 'main_loop_s':toc - tic})
+print(f"run statistics saved to:\n\t{stats_file}")
 #--------------------------------------------------------------------------
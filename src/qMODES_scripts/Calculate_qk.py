@@ -24,6 +24,9 @@ import argparse
 import numpy    as np
 import xarray   as xa
 from datetime import datetime
+from qMODES_Functions import compute_qk_modes, make_qk_dataset, read_hough_store_lat, read_qk_operator_grid, get_date_list, get_vsf_int_levels, \
+                             add_output_encoding_args, get_output_encoding_args, get_output_encoding, get_encoding_attrs, write_zarr_date, \
+                             add_input_read, timed_stage, reset_run_stats, get_run_stats_attrs, write_run_stats
 
 #--------------------------------------------------------------------------
 
@@ -35,18 +38,50 @@ from datetime import datetime
 
 # Getting command line arguments
 parser = argparse.ArgumentParser(description="This script calculates the omegakk values for a specified date")
-parser.add_argument('-d', '--date', help='date to calculate in YYYYMMDD format', required=True)
-parser.add_argument('-m', '--mode', help='mode to perform calculation for (EIG, WIG, or BAL)', required=True)
+date_group = parser.add_mutually_exclusive_group(required=True)
+date_group.add_argument('-d', '--date', help='date to calculate in YYYYMMDD format')
+date_group.add_argument('--dates', help='comma separated list of dates and/or date ranges (YYYYMMDD-YYYYMMDD) to calculate together, each hough slab is then read once for all of the dates')
+parser.add_argument('-m', '--mode', help='mode to perform calculation for (EIG, WIG, BAL, or ALL). ALL computes EIG, WIG, BAL, and the noMRG BAL variant in a single pass', required=True)
 parser.add_argument('--noMRG', help='command line flag that, if included, removes the n=0 mode for BAL component',action='store_true')
+parser.add_argument('--hough_store', help='command line flag that, if included, reads the hough functions from the consolidated hough store (see Consolidate_Hough_Files.py)',action='store_true')
+parser.add_argument('--operator', help='command line flag that, if included, uses the precomputed qk operator (see Precompute_qk_Operator.py) in place of the hough functions and vsf_int',action='store_true')
+parser.add_argument('-w', '--workers', help='number of worker processes to spread the k modes over (set OMP_NUM_THREADS=1 when using many workers)', type=int, default=1)
+parser.add_argument('--date_batch', help='number of dates (with --dates) computed together, the coefficients and qk values of a batch are all kept in memory (~0.5 GB per mode per date of qk at F320) and each hough slab is read once per batch', type=int, default=4)
+parser.add_argument('--all_times', help='command line flag that, if included, calculates every timestep in the coefficient files (the qk files then have a time dimension) instead of only the first', action='store_true')
+level_group = parser.add_mutually_exclusive_group()
+level_group.add_argument('-l', '--levels', help='comma separated list of vgrid_int indices to calculate qk for (default all levels), saved as qk_lev_{date} files', default=None)
+level_group.add_argument('--plevs', help='comma separated list of pressures (in hPa) to calculate qk for, vsf_int is interpolated (linearly in log pressure) to pressures between the vgrid_int levels, saved as qk_lev_{date} files', default=None)
+parser.add_argument('--zarr', help='command line flag that, if included, writes the qk values into the qk.zarr and qk_noMRG.zarr time stores (one store for all dates) in place of the per date files, only for -m ALL', action='store_true')
+add_output_encoding_args(parser)
 args = parser.parse_args()
 
-date  = args.date
-mode  = args.mode
-noMRG = args.noMRG
+mode         = args.mode
+noMRG        = args.noMRG
+workers      = args.workers
+use_store    = args.hough_store
+use_operator = args.operator
+out_encoding = get_output_encoding_args(args)
+use_zarr     = args.zarr
+all_times    = args.all_times
+date_batch   = args.date_batch
+levels       = None if args.levels is None else [int(i) for i in args.levels.split(',')]
+plevs        = None if args.plevs  is None else [100.0*float(p) for p in args.plevs.split(',')] # hPa to Pa (vgrid_int units)
+
+if args.dates is not None: date_list = get_date_list(args.dates)
+else:                      date_list = [args.date]
 
 # Initial calcs
-outdir  = "../../output_data/qk_data/"
-outfile = outdir + f"qk_{date}0000000.nc"
+# (qk files for only some pressure levels (--levels/--plevs) are saved as qk_lev_* so they
+# never replace or get mixed with the full level qk files)
+outdir       = "../../output_data/qk_data/"
+level_tag    = "" if levels is None and plevs is None else "_lev"
+os.makedirs(outdir, exist_ok=True)
+
+def get_qk_outfile(date, save_noMRG=False):
+    '''returns the qk (or noMRG qk) output file for date'''
+    return outdir + "qk" + ("_noMRG" if save_noMRG else "") + level_tag + f"_{date}0000000.nc"
+
+outfile_list = [get_qk_outfile(date) for date in date_list]
 #--------------------------------------------------------------------------
 
 
@@ -54,9 +89,36 @@ outfile = outdir + f"qk_{date}0000000.nc"
 #--------------------------------------------------------------------------
 # INPUT DATA CHECKS
 
+if date_batch < 1:
+    print("EXITING: --date_batch must be at least 1")
+    exit()
+
 # Checking mode input from command line
-if mode not in ["EIG","WIG","BAL"]:
-    print("EXITING: --mode command line flag must be EIG, WIG, or BAL")
+if mode not in ["EIG","WIG","BAL","ALL"]:
+    print("EXITING: --mode command line flag must be EIG, WIG, BAL, or ALL")
+    exit()
+
+# ALL mode already computes the noMRG BAL variant
+if noMRG and mode == 'ALL':
+    print("EXITING: --noMRG command line flag is not needed with ALL mode (noMRG BAL is always computed)")
+    exit()
+
+# Every date in a zarr store must have all of the variables
+if use_zarr and mode != 'ALL':
+    print("EXITING: --zarr command line flag can only be used with ALL mode")
+    exit()
+
+if use_zarr and all_times:
+    print("EXITING: --zarr command line flag can't be used with --all_times (one timestep per date in the store)")
+    exit()
+
+# The operator already has vsf_int built in for its pressure levels
+if use_operator and (levels is not None or plevs is not None):
+    print("EXITING: --levels and --plevs can't be used with --operator (build the operator for those levels with Precompute_qk_Operator.py --levels)")
+    exit()
+
+if use_zarr and out_encoding['dtype'] == 'int16':
+    print("EXITING: int16 output can't be used with --zarr, use --out_dtype float32")
     exit()
 
 # Checking noMRG logic
@@ -68,11 +130,12 @@ if noMRG:
     #checking to see if EIG and WIG already computed and stored in outfile
     #should only compute BAL with noMRG after EIG and WIG already computed 
     #(for file naming logic)
-    test_ds = xa.open_dataset(outfile)
-    test_ds_vars = [i for i in test_ds.data_vars]
-    if 'qk_EIG' not in test_ds_vars or 'qk_WIG' not in test_ds_vars:
-        print(f"EXITING: MUST compute EIG and WIG first if computing BAL with noMRG")
-        exit()
+    for outfile in outfile_list:
+        test_ds = xa.open_dataset(outfile)
+        test_ds_vars = [i for i in test_ds.data_vars]
+        if 'qk_EIG' not in test_ds_vars or 'qk_WIG' not in test_ds_vars:
+            print(f"EXITING: MUST compute EIG and WIG first if computing BAL with noMRG ({outfile})")
+            exit()
 #--------------------------------------------------------------------------
 
 
@@ -94,7 +157,9 @@ nN = 200 #number of N modes
 # Input Data Directories and Files
 vsf_int_infile = "../../input_data/MODES_data/vsf_int/vsf_int.data.nc"
 hough_dir      = "../../input_data/MODES_data/hough/"
-coef_infile    = f"../../input_data/MODES_data/coef/Hough_coeff_M60_F320_{date}0000000.nc" # Trailing zeros are for time, only one time per day for now
+hough_store    = "../../input_data/MODES_data/hough_store/"
+operator_dir   = "../../input_data/MODES_data/qk_operator/"
+coef_dir       = "../../input_data/MODES_data/coef/"
 
 #Initial calcs
 sample_hough_infile = "../../input_data/MODES_data/hough/...SAMPLE_HOUGH_FILE.wn00000.nc";
@@ -104,8 +169,16 @@ sample_hough_infile = "../../input_data/MODES_data/hough/...SAMPLE_HOUGH_FILE.wn
 
 #--------------------------------------------------------------------------
 # READING IN GRID DATA
-sample_hough_ds = xa.open_dataset(sample_hough_infile)
-lat             = sample_hough_ds["lat"].values
+if use_operator:
+    # the operator is only built for some pressure levels so the grid is read from the operator
+    [vgrid_int, lat] = read_qk_operator_grid(operator_dir)
+elif use_store:
+    # the store is read in place of the per k hough files
+    hough_dir = hough_store
+    lat       = read_hough_store_lat(hough_store)
+else:
+    sample_hough_ds = xa.open_dataset(sample_hough_infile)
+    lat             = sample_hough_ds["lat"].values
 nlat            = lat.shape[0]
 
 #--------------------------------------------------------------------------
@@ -115,85 +188,70 @@ nlat            = lat.shape[0]
 #--------------------------------------------------------------------------
 # READING IN OTHER PRELIMINARY DATA
 
-# Reading in hough_coef data
-coef_ds = xa.open_dataset(coef_infile)
-coefs   = coef_ds[mode].values
-
-# Reading in vsf_int data
-vsf_int_ds = xa.open_dataset(vsf_int_infile)
-vsf_int    = vsf_int_ds["vsf_int"].values
-vgrid_int  = vsf_int_ds["vgrid_int"].values
+# Modes needed for this run
+if mode == "ALL": mode_list = ["EIG","WIG","BAL"]
+else:             mode_list = [mode]
+
+def get_coef_infile(date):
+    '''returns the hough coefficient file for date'''
+    return coef_dir + f"Hough_coeff_M60_F320_{date}0000000.nc" # Trailing zeros are for time, only one time per day for now
+
+def read_coefs(batch_dates):
+    """
+    Reads in the hough_coef data (first timestep only unless --all_times)
+    for the dates in batch_dates. The timesteps for all of the dates are
+    stacked, indexing is [date+time,Re+Im,k,m,n], and date_slices gives the
+    timesteps of each date. Returns [coefs, time_list, date_slices].
+    """
+    coefs       = {imode: [] for imode in mode_list}
+    time_list   = []
+    date_slices = []
+    tslice      = slice(None) if all_times else slice(0,1)
+    for date in batch_dates:
+        tic     = time.perf_counter()
+        coef_ds = xa.open_dataset(get_coef_infile(date))
+        for imode in mode_list:
+            coefs[imode].append( coef_ds[imode][tslice,:,:,:,:].values )
+        add_input_read('coef', sum(coefs[imode][-1].nbytes for imode in mode_list), time.perf_counter() - tic)
+
+        ntime  = coefs[mode_list[0]][-1].shape[0]
+        itime0 = date_slices[-1].stop if date_slices else 0
+        date_slices.append( slice(itime0, itime0 + ntime) )
+
+        if 'time' in coef_ds.coords: time_list.append( coef_ds['time'].values[tslice] )
+        else:                        time_list.append( np.arange(ntime) )
+        coef_ds.close()
+    coefs = {imode: np.concatenate(coefs[imode]) for imode in mode_list}
+    return [coefs, time_list, date_slices]
+
+# Reading in vsf_int data (already included in the operator)
+if use_operator:
+    vsf_int = None
+else:
+    tic        = time.perf_counter()
+    vsf_int_ds = xa.open_dataset(vsf_int_infile)
+    vsf_int    = vsf_int_ds["vsf_int"].values
+    vgrid_int  = vsf_int_ds["vgrid_int"].values
+    add_input_read('vsf_int', vsf_int.nbytes + vgrid_int.nbytes, time.perf_counter() - tic)
+
+    # Reducing vsf_int to the requested pressure levels, so the m sum is only done for those
+    # levels (the qk vgrid_int values are then the actual pressures of the levels)
+    try:
+        [vsf_int, vgrid_int] = get_vsf_int_levels(vsf_int, vgrid_int, levels, plevs)
+    except (IndexError, ValueError) as err:
+        print(f"EXITING: bad --levels or --plevs ({err})")
+        exit()
 nplev      = vgrid_int.shape[0]
-#--------------------------------------------------------------------------
-
-
-
-#-------------------------------------------------------------------------
-# MAIN LOOP
-
-# initalize qk
-qk = np.zeros((2, nK, nplev, nlat))
-
-#initalize freq and hough
-hough    = np.zeros((nM,3,nN,nlat)) 
-freq_EIG = np.zeros((nN,nM))
-freq_WIG = np.zeros((nN,nM))
-freq_BAL = np.zeros((nN,nM))
-
-#different modes have different portions of frequency values in files
-#defining upper and lower frequency index bounds
-
-#initalizing for EIG mode bounds
-freq_lb = 0
-freq_ub = nN
-
-#changing to proper bounds if mode isn't EIG
-if mode == "WIG":
-    freq_lb = nN
-    freq_ub = 2*nN
-elif mode == "BAL":
-    freq_lb = 2*nN
-    freq_ub = 3*nN
-
 
-# Main Loop
-
-#initalizing values used in loop
-RE_inner_sum = 0
-IM_inner_sum = 0
-n_lb         = int(noMRG) 
-
-tic = time.perf_counter()
-
-for kk in range(nK):
-    
-    #print(f"\t{kk+1} out of {nK}")
-    
-    #read in Hough Function data
-    # Hough files are stored by "k" index
-    kstr = "0"*(3-len(str(kk)))+str(kk)
-    hough_infile = hough_dir + f"hough_F320_M60.wn00{kstr}.nc"
-    hough_ds   = xa.open_dataset(hough_infile)
-    hough  = hough_ds[f"{mode}"].values
-
-    for iplev in range(nplev):
-
-        for mm in range(nM):
-            
-            #re-initializing inner sums
-            RE_inner_sum = 0
-            IM_inner_sum = 0
-
-            #calculating the n portion of the sum (the "inner sum") starting from the lower bound n_lb 
-            for nn in range(n_lb,nN):
-                RE_inner_sum += coefs[0,0,kk,mm,nn] * hough[mm,2,:,nn] # [2,:,mm,nn] -- reordered indexing
-                IM_inner_sum += coefs[0,1,kk,mm,nn] * hough[mm,2,:,nn] # [2,:,mm,nn] -- reordered indexing
-
-            qk[0,kk,iplev,:] +=  vsf_int[mm,iplev] * RE_inner_sum
-            qk[1,kk,iplev,:] +=  vsf_int[mm,iplev] * IM_inner_sum 
-
-toc = time.perf_counter()
-print(f"time to complete main loop = {(toc - tic)/60.0} min")
+# Single mode runs append to the existing files, which must have the same pressure levels
+if mode != "ALL":
+    for date in date_list:
+        for check_file in set([get_qk_outfile(date), get_qk_outfile(date, noMRG)]):
+            if not os.path.exists(check_file): continue
+            with xa.open_dataset(check_file) as check_ds: file_vgrid_int = check_ds['vgrid_int'].values
+            if not np.array_equal(file_vgrid_int, vgrid_int):
+                print(f"EXITING: {check_file} doesn't have the same pressure levels as this run, remove it or use the same --levels/--plevs")
+                exit()
 #--------------------------------------------------------------------------
 
 
@@ -203,31 +261,95 @@ print(f"time to complete main loop = {(toc - tic)/60.0} min")
 
 dtnow = datetime.now()
 
-coords    = {'k_mode'    : ( ['k_mode'    ], np.array(range(nK)) ),
-             'vgrid_int' : ( ['vgrid_int' ], vgrid_int           ),
-             'lat'       : ( ['lat'       ], lat                 )  }
-
-data_vars = {f'qk_{mode}' :(['Re+Im', 'k_mode', 'vgrid_int', 'lat'], qk,
-                    { 'long_name':f'{mode} Part of specific humidity'})      }
-
-if noMRG:
-    data_vars.update({'noMRG':True})
-
-
 attrs     = {'creation_date':dtnow.strftime("%m/%d/%Y, %H:%M:%S"),
              'author':author_name,
              'email' :author_email}
+attrs.update( get_encoding_attrs(**out_encoding) )
+
+def save_qk_batch(batch_dates, qk, time_list, date_slices):
+    '''saves the qk values of a batch of dates, one qk (and noMRG qk) file per date (with the run statistics of the batch)'''
+    for idate, date in enumerate(batch_dates):
+
+        outfile       = get_qk_outfile(date)
+        noMRG_outfile = get_qk_outfile(date, True)
+
+        # qk for the timesteps of this date, without the time index if only the first timestep is used
+        if all_times: qk_date = {name: qk[name][date_slices[idate]]    for name in qk}
+        else:         qk_date = {name: qk[name][date_slices[idate]][0] for name in qk}
+        date_time = time_list[idate] if all_times else None
+
+        # list of (outfile, qk data to save, noMRG flag, write mode)
+        if mode == "ALL":
+            # all standard modes are written together, so the file is written from scratch
+            save_list = [ (outfile,       {imode:qk_date[imode] for imode in mode_list}, False, 'w'),
+                          (noMRG_outfile, {'BAL':qk_date['BAL_noMRG']},                  True,  'w') ]
+        elif noMRG:
+            save_list = [ (noMRG_outfile, {mode:qk_date[mode]}, True,  'a') ]
+        else:
+            save_list = [ (outfile,       {mode:qk_date[mode]}, False, 'a') ]
+
+        for save_outfile, save_qk, save_noMRG, save_mode in save_list:
+
+            # the run statistics so far are saved in the attributes (the full statistics, with the write time, in the .stats.json file)
+            ds = make_qk_dataset(save_qk, lat, vgrid_int, {**attrs, **get_run_stats_attrs()}, noMRG=save_noMRG, time=date_time)
+
+            with timed_stage('write'):
+                if use_zarr:
+                    # writing into the time store for all dates in place of the per date file
+                    save_outfile = outdir + "qk" + ("_noMRG" if save_noMRG else "") + level_tag + ".zarr"
+                    zarr_chunking = 'level_band' if out_encoding['chunking'] == 'default' else out_encoding['chunking']
+                    write_zarr_date(ds, save_outfile, date, out_encoding['dtype'], zarr_chunking, out_encoding['band_size'])
+                else:
+                    ds.to_netcdf(save_outfile, mode=save_mode, encoding=get_output_encoding(ds, **out_encoding))
+            for imode in save_qk: print(f"qk_{imode} data saved to:\n\t{save_outfile}")
+
+            stats_file = write_run_stats(save_outfile, "Calculate_qk.py", {'dates':batch_dates, 'mode':mode, 'workers':workers, 'date_batch':date_batch, 'nplev':nplev, 'main_loop_s':time.perf_counter() - batch_tic})
+            print(f"run statistics saved to:\n\t{stats_file}")
+
+            if save_noMRG:
+                print(f"WARNING: This is a noMRG file!!!!!")
+#--------------------------------------------------------------------------
 
-ds        = xa.Dataset(data_vars=data_vars,
-                       coords=coords,
-                       attrs=attrs)
 
-if noMRG:
-    outfile = outdir + f"qk_noMRG_{date}0000000.nc"
 
-ds.to_netcdf(outfile, mode='a')
-print(f"qk_{mode} data saved to:\n\t{outfile}")
+#-------------------------------------------------------------------------
+# MAIN LOOP
+
+#defining the qk outputs as (mode, lower bound of the n sum) pairs
+#n=0 is the MRG mode, so n_lb=1 gives the noMRG variant
+if mode == "ALL":
+    qk_specs = {'EIG'      :('EIG',0),
+                'WIG'      :('WIG',0),
+                'BAL'      :('BAL',0),
+                'BAL_noMRG':('BAL',1)}
+else:
+    qk_specs = {mode:(mode,int(noMRG))}
 
-if noMRG:
-    print(f"WARNING: This is a noMRG file!!!!!")
+tic = time.perf_counter()
+
+# The dates are computed --date_batch at a time, so only the coefficients
+# and qk values of one batch are in memory, and each batch is saved before
+# the next one is computed
+for ibatch in range(0, len(date_list), date_batch):
+    # the run statistics (and main_loop_s) saved with each date are for its batch only
+    # (the setup reads, e.g. vsf_int, are counted in the first batch)
+    if ibatch > 0: reset_run_stats()
+    batch_tic   = time.perf_counter()
+    batch_dates = date_list[ibatch:ibatch + date_batch]
+    [coefs, time_list, date_slices] = read_coefs(batch_dates)
+
+    # qk is computed one k slab at a time as two batched contractions
+    # (coefs x hough over n, then vsf_int over m) see qMODES_Functions.py
+    # every hough file is only opened once for all of the outputs and dates in the batch
+    # (with --operator each k slab is instead a single matmul against the operator)
+    # (the hough/operator reads and the time of each k slab are recorded by the engine)
+    with timed_stage('qk_compute'):
+        if use_operator: qk = compute_qk_modes(coefs, hough_dir, vsf_int, qk_specs, workers=workers, operator_dir=operator_dir)
+        else:            qk = compute_qk_modes(coefs, hough_dir, vsf_int, qk_specs, workers=workers)
+
+    save_qk_batch(batch_dates, qk, time_list, date_slices)
+    print(f"dates {batch_dates[0]} to {batch_dates[-1]} done ({ibatch + len(batch_dates)}/{len(date_list)})")
+
+toc = time.perf_counter()
+print(f"time to complete main loop = {(toc - tic)/60.0} min")
 #--------------------------------------------------------------------------
@@ -0,0 +1,226 @@
+#--------------------------------------------------------------------------
+# File:          Calculate_qk_and_qMODES.py
+# Author:        Bradley Kumm (bkumm@wisc.edu)
+# Last Modified: 2026/10/18 (YYYY/MM/DD)
+# Description:   Script that calculates the physical space q modes (EIG,
+#                WIG, and BAL) straight from the hough coefficients, i.e.
+#                the Calculate_qk.py and Calculate_qMODES.py steps in a
+#                single run without the intermediate qk file.
+#
+#                The level independent part of the qk sum (the n sum over
+#                the hough functions) is done once for every k, and then
+#                the vsf_int sum and the longitude synthesis are done one
+#                chunk of pressure levels at a time, with each chunk
+#                written to the output file as soon as it is done.
+#
+# Notes:         WARNING!!! The input files must be netCDF files!!!
+#                The qk values are only saved if --save_qk is included.
+#
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#IMPORTS
+
+import time
+import argparse
+import xarray   as xa
+from datetime import datetime
+from qMODES_Functions import compute_inner_modes, apply_vsf_int, synthesize_qmodes, read_hough_store_lat, \
+                             create_streamed_outfile, add_noMRG_flag, get_qk_streamed_layout, get_qmodes_streamed_layout, \
+                             add_output_encoding_args, get_output_encoding_args, \
+                             add_input_read, timed_stage, get_run_stats_attrs, write_run_stats
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#READING IN COMMAND LINE ARGUMENTS (frequently changed params only)
+
+parser = argparse.ArgumentParser(description="This script calculates the qk and qMODES values for a specified date in a single run")
+parser.add_argument('-d', '--date', help='date to calculate in YYYYMMDD format', required=True)
+parser.add_argument('-k', '--k_lower_bound', help='high pass filter that only allows k modes above the given value to be included in the sums', type=int, default=0)
+parser.add_argument('--noMRG', help='command line flag that, if included, removes the n=0 mode for BAL component',action='store_true')
+parser.add_argument('--save_qk', help='command line flag that, if included, also saves the qk values to the qk_data directory',action='store_true')
+parser.add_argument('-c', '--plev_chunk', help='number of pressure levels to synthesize and write at a time', type=int, default=8)
+parser.add_argument('--hough_store', help='command line flag that, if included, reads the hough functions from the consolidated hough store (see Consolidate_Hough_Files.py)',action='store_true')
+parser.add_argument('-w', '--workers', help='number of worker processes to spread the k modes over (set OMP_NUM_THREADS=1 when using many workers)', type=int, default=1)
+add_output_encoding_args(parser)
+args = parser.parse_args()
+
+date       = args.date
+k_lb       = args.k_lower_bound
+noMRG      = args.noMRG
+save_qk    = args.save_qk
+plev_chunk = args.plev_chunk
+use_store  = args.hough_store
+workers    = args.workers
+out_encoding = get_output_encoding_args(args)
+
+if out_encoding['dtype'] == 'int16':
+    print(f"EXITING: int16 output can't be used when streaming the output, use --out_dtype float32")
+    exit()
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#USER INPUTS AND CONSTANTS
+
+# author details for output file
+author_name = "USER's NAME"
+author_email = "USER's EMAIL"
+
+# Mode, Mode Number, and Grid Data
+Mode_list = ['EIG','WIG','BAL']
+
+#Fourier Space Parameters
+#Hard coding these in for now ... should read in from config/ files later
+nK = 351 #number of K modes
+nM = 60  #number of M modes
+nN = 200 #number of N modes
+
+# Input Data Directories and Files
+grid_infile    = "../../input_data/ERA_Data/ERA_FILE_HERE.nc" # sample file to get grid parameters, and ERA file should work if you want to use the same grid
+vsf_int_infile = "../../input_data/MODES_data/vsf_int/vsf_int.data.nc"
+hough_dir      = "../../input_data/MODES_data/hough/"
+hough_store    = "../../input_data/MODES_data/hough_store/"
+coef_infile    = f"../../input_data/MODES_data/coef/Hough_coeff_M60_F320_{date}0000000.nc" # Trailing zeros are for time, only one time per day for now
+
+sample_hough_infile = "../../input_data/MODES_data/hough/...SAMPLE_HOUGH_FILE.wn00000.nc";
+
+# Output Files
+qk_outdir        = "../../output_data/qk_data/"
+qk_outfile       = qk_outdir + f"qk_{date}0000000.nc"
+qk_noMRG_outfile = qk_outdir + f"qk_noMRG_{date}0000000.nc"
+
+k_lb_str = str(0)*(3-len(str(k_lb))) + str(k_lb)
+
+outfile  = f"../../output_data/qMODES_Data/qmodes"
+if noMRG:     outfile += f"_noMRG"
+if k_lb != 0: outfile += f"_k{k_lb_str}-{nK}"
+outfile += f"_{date}0000000.nc"
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# READING INPUT DATA
+
+#Reading in Grid Data
+tic     = time.perf_counter()
+grid_ds = xa.open_dataset(grid_infile)
+lon     = grid_ds["lon"].values
+add_input_read('ERA', lon.nbytes, time.perf_counter() - tic)
+
+if use_store:
+    # the store is read in place of the per k hough files
+    hough_dir = hough_store
+    lat       = read_hough_store_lat(hough_store)
+else:
+    sample_hough_ds = xa.open_dataset(sample_hough_infile)
+    lat             = sample_hough_ds["lat"].values
+
+# Reading in hough_coef data (first timestep only)
+tic     = time.perf_counter()
+coef_ds = xa.open_dataset(coef_infile)
+coefs   = {imode: coef_ds[imode].values[0,:,:,:,:] for imode in Mode_list}
+add_input_read('coef', sum(coef_ds[imode].nbytes for imode in Mode_list), time.perf_counter() - tic)
+
+# Reading in vsf_int data
+tic        = time.perf_counter()
+vsf_int_ds = xa.open_dataset(vsf_int_infile)
+vsf_int    = vsf_int_ds["vsf_int"].values
+vgrid_int  = vsf_int_ds["vgrid_int"].values
+add_input_read('vsf_int', vsf_int.nbytes + vgrid_int.nbytes, time.perf_counter() - tic)
+nplev      = vgrid_int.shape[0]
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# MAIN LOOP
+
+dtnow = datetime.now()
+tic   = time.perf_counter()
+
+attrs = {'creation_date':dtnow.strftime("%m/%d/%Y, %H:%M:%S"),
+         'author':author_name,
+         'email' :author_email}
+
+#defining the qk outputs as (mode, lower bound of the n sum) pairs
+#n=0 is the MRG mode, so n_lb=1 gives the noMRG variant
+qk_specs = {'EIG':('EIG',0),
+            'WIG':('WIG',0),
+            'BAL':('BAL',int(noMRG))}
+
+# Level independent inner sums for every k, indexing is [Re+Im,k,m,lat]
+# (the hough reads and the time of each k slab are recorded by the engine)
+with timed_stage('inner_sums'): inner = compute_inner_modes(coefs, hough_dir, qk_specs, workers=workers)
+nK_qk = inner[Mode_list[0]].shape[1]
+
+# Creating the output files
+q_ds = create_streamed_outfile(outfile, *get_qmodes_streamed_layout(Mode_list, vgrid_int, lat, lon), attrs, **out_encoding)
+
+# For noMRG runs only the noMRG BAL qk values are saved (so an existing qk
+# file isn't replaced)
+qk_ds         = None
+qk_save_modes = []
+if save_qk:
+    if noMRG:
+        qk_save_modes = ['BAL']
+        qk_ds         = create_streamed_outfile(qk_noMRG_outfile, *get_qk_streamed_layout(qk_save_modes, nK_qk, vgrid_int, lat), attrs, **out_encoding)
+        add_noMRG_flag(qk_ds)
+    else:
+        qk_save_modes = Mode_list
+        qk_ds         = create_streamed_outfile(qk_outfile, *get_qk_streamed_layout(qk_save_modes, nK_qk, vgrid_int, lat), attrs, **out_encoding)
+
+# Streaming over chunks of pressure levels
+for iplev in range(0, nplev, plev_chunk):
+
+    plev_slice = slice(iplev, min(iplev + plev_chunk, nplev))
+
+    for imode in Mode_list:
+
+        # qk for the chunk, indexing is [Re+Im,k,plev,lat]
+        with timed_stage('vsf_int_sum'): qk_chunk = apply_vsf_int(inner[imode], vsf_int[:,plev_slice])
+
+        # physical space values for the chunk, indexing is [plev,lat,lon]
+        with timed_stage('synthesize'): q_chunk = synthesize_qmodes(qk_chunk, lon, k_lb)
+
+        with timed_stage('write'):
+            q_ds[f'q_{imode}'][plev_slice,:,:] = q_chunk
+            if imode in qk_save_modes:
+                qk_ds[f'qk_{imode}'][:,:,plev_slice,:] = qk_chunk
+
+# the run statistics so far are saved in the attributes (the full statistics, with the write time, in the .stats.json files)
+with timed_stage('write'):
+    for ds in [q_ds, qk_ds]:
+        if ds is None: continue
+        ds.attrs.update( get_run_stats_attrs() )
+        ds.close()
+
+toc = time.perf_counter()
+print(f"time to complete main loop = {(toc - tic)/60.0} min")
+
+stats_extra = {'date':date, 'k_lb':k_lb, 'noMRG':noMRG, 'workers':workers, 'main_loop_s':toc - tic}
+stats_files = [write_run_stats(outfile, "Calculate_qk_and_qMODES.py", stats_extra)]
+if save_qk: stats_files.append( write_run_stats(qk_noMRG_outfile if noMRG else qk_outfile, "Calculate_qk_and_qMODES.py", stats_extra) )
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# OUTPUT SUMMARY
+
+for imode in Mode_list: print(f"q_{imode} data saved to:\n\t{outfile}")
+if noMRG: print(f"WARNING: THIS IS A noMRG FILE")
+
+if save_qk:
+    if noMRG: print(f"qk_BAL data saved to:\n\t{qk_noMRG_outfile}\nWARNING: This is a noMRG file!!!!!")
+    else:     print(f"qk data saved to:\n\t{qk_outfile}")
+
+for stats_file in stats_files: print(f"run statistics saved to:\n\t{stats_file}")
+#--------------------------------------------------------------------------
@@ -0,0 +1,66 @@
+#--------------------------------------------------------------------------
+# File:          Consolidate_Hough_Files.py
+# Author:        Bradley Kumm (bkumm@wisc.edu)
+# Last Modified: 2026/10/18 (YYYY/MM/DD)
+# Description:   Script that converts the per wavenumber hough function
+#                files (hough_F320_M60.wn00XXX.nc) into a single
+#                consolidated hough store. Like the integrated VSFs the
+#                hough functions don't change between runs, so this only
+#                needs to be done once.
+#
+#                The store only holds the q relevant (index 2) component
+#                of the EIG, WIG, and BAL hough functions, saved as one
+#                memory mappable .npy file per mode with [k,m,lat,n]
+#                indexing. Calculate_qk.py can then read each k slab as a
+#                zero-copy slice instead of opening a netCDF file per k.
+#
+# Notes:         WARNING!!! The input files must be netCDF files!!!
+#
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#IMPORTS
+
+import os
+import time
+from qMODES_Functions import create_hough_store
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#USER INPUTS
+
+#Fourier Space Parameters
+#Hard coding these in for now ... should read in from config/ files later
+nK = 351 #number of K modes
+
+# Modes to save in the store
+Mode_list = ['EIG','WIG','BAL']
+
+# Input and Output Directories
+hough_dir = "../../input_data/MODES_data/hough/"
+store_dir = "../../input_data/MODES_data/hough_store/"
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# CREATING THE HOUGH STORE
+
+os.makedirs(store_dir, exist_ok=True)
+
+tic = time.perf_counter()
+store_files = create_hough_store(hough_dir, store_dir, nK, Mode_list)
+toc = time.perf_counter()
+
+print(f"time to create hough store = {(toc - tic)/60.0} min")
+print(f"hough store saved to:")
+for store_file in store_files:
+    print(f"\t{store_file} ({os.path.getsize(store_file)/1.0e9:.2f} GB)")
+
+#--------------------------------------------------------------------------
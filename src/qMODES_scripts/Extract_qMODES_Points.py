@@ -0,0 +1,137 @@
+#--------------------------------------------------------------------------
+# File:          Extract_qMODES_Points.py
+# Author:        Bradley Kumm (bkumm@wisc.edu)
+# Last Modified: 2026/10/18 (YYYY/MM/DD)
+# Description:   Script that extracts vertical profiles of the q modes (EIG,
+#                WIG, and BAL) at a set of lat/lon points (e.g. stations or
+#                sounding sites) for a range of dates straight from the qk
+#                files, without synthesizing the global qMODES fields. The
+#                qk values are interpolated linearly in latitude to each
+#                point and the longitude series is summed at each point's
+#                longitude (see get_qmodes_point_profiles).
+#
+# Notes:         The points are given with --points as "lat,lon;lat,lon;..."
+#                or with --points_file as a text file with one "lat,lon"
+#                (and optionally ",name") per line. Longitudes can be
+#                -180 to 180 or 0 to 360.
+#
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#IMPORTS
+
+import os
+import time
+import argparse
+import numpy    as np
+import xarray   as xa
+from datetime import datetime
+from qMODES_Functions import get_qmodes_point_profiles, get_date_list, get_date_time
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#READING IN COMMAND LINE ARGUMENTS (frequently changed params only)
+
+parser = argparse.ArgumentParser(description="This script extracts q mode vertical profiles at lat/lon points from the qk files")
+parser.add_argument('--dates', help='comma separated list of dates and/or date ranges (YYYYMMDD-YYYYMMDD) to extract', required=True)
+point_group = parser.add_mutually_exclusive_group(required=True)
+point_group.add_argument('--points', help='points to extract as "lat,lon;lat,lon;..." in degrees')
+point_group.add_argument('--points_file', help='text file with one "lat,lon[,name]" point per line')
+parser.add_argument('-k', '--k_lower_bound', help='high pass filter that only allows k modes above the given value to be included in the sums', type=int, default=0)
+parser.add_argument('--noMRG', help='command line flag that, if included, uses the noMRG qk values for BAL',action='store_true')
+parser.add_argument('--zarr', help='command line flag that, if included, reads the dates from the qk.zarr (or qk_noMRG.zarr) time store in place of the per date files', action='store_true')
+parser.add_argument('-o', '--outfile', help='output file (default qmodes_points_{first date}-{last date}.nc in the qMODES_Data directory)', default=None)
+args = parser.parse_args()
+
+date_list = get_date_list(args.dates)
+k_lb      = args.k_lower_bound
+noMRG     = args.noMRG
+use_zarr  = args.zarr
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#USER INPUTS AND CONSTANTS
+
+# author details for output file
+author_name = "USER's NAME"
+author_email = "USER's EMAIL"
+
+Mode_list = ['EIG','WIG','BAL']
+
+# Input and Output File Data (Calculate_qk.py output directory, per date files and the qk.zarr store)
+qk_dir = "../../output_data/qk_data/"
+
+outfile = args.outfile
+if outfile is None:
+    outfile = "../../output_data/qMODES_Data/qmodes_points"
+    if noMRG: outfile += "_noMRG"
+    outfile += f"_{date_list[0]}-{date_list[-1]}.nc"
+os.makedirs(os.path.dirname(os.path.abspath(outfile)), exist_ok=True)
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# READING THE POINTS
+
+if args.points is not None:
+    point_lines = args.points.split(';')
+else:
+    with open(args.points_file) as f: point_lines = [line for line in f.read().splitlines() if line.strip() and not line.startswith('#')]
+
+point_items = [line.split(',') for line in point_lines]
+lat_points  = np.array([float(item[0]) for item in point_items])
+lon_points  = np.array([float(item[1]) for item in point_items])
+point_names = [item[2].strip() if len(item) > 2 else f"{item[0].strip()},{item[1].strip()}" for item in point_items]
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# MAIN LOOP
+
+dtnow = datetime.now()
+tic   = time.perf_counter()
+
+def get_points(qk_name, mode_list):
+    '''extracts the point profiles of mode_list from the qk_name files (or zarr store)'''
+    if use_zarr:
+        q_points = get_qmodes_point_profiles(qk_dir + f"{qk_name}.zarr", lat_points, lon_points, mode_list, k_lb=k_lb)
+        return q_points.sel(time=[get_date_time(date) for date in date_list])
+
+    qk_infiles = [qk_dir + f"{qk_name}_{date}0000000.nc" for date in date_list]
+    return get_qmodes_point_profiles(qk_infiles, lat_points, lon_points, mode_list, k_lb=k_lb,
+                                     times=[get_date_time(date) for date in date_list])
+
+# noMRG qk files only hold BAL, EIG and WIG still come from the full qk files (as in Calculate_qMODES.py)
+if noMRG: q_points = xa.concat([get_points("qk", ['EIG','WIG']), get_points("qk_noMRG", ['BAL'])], dim='component')
+else:     q_points = get_points("qk", Mode_list)
+
+toc = time.perf_counter()
+print(f"time to complete main loop = {(toc - tic)/60.0} min")
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# SAVING DATA TO NETCDF FILE
+
+q_points = q_points.assign_coords(point_name=('point', point_names))
+ds       = q_points.to_dataset()
+ds.attrs = {'creation_date':dtnow.strftime("%m/%d/%Y, %H:%M:%S"),
+            'author':author_name,
+            'email' :author_email,
+            'k_lb'  :k_lb,
+            'noMRG' :int(noMRG)}
+
+ds.to_netcdf(outfile)
+print(f"q profiles for {len(lat_points)} points and {len(date_list)} dates saved to:\n\t{outfile}")
+if noMRG: print(f"WARNING: THIS IS A noMRG FILE")
+#--------------------------------------------------------------------------
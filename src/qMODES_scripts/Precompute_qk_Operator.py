@@ -0,0 +1,138 @@
+#--------------------------------------------------------------------------
+# File:          Precompute_qk_Operator.py
+# Author:        Bradley Kumm (bkumm@wisc.edu)
+# Last Modified: 2026/10/18 (YYYY/MM/DD)
+# Description:   Script that precomputes the date independent qk operator.
+#                The hough functions and integrated VSFs are the same for
+#                every date (only the hough coefficients change), so they
+#                are combined ahead of time into
+#
+#                    A_k(m*nN + n, plev*nlat + lat) = vsf_int(m,plev) * hough(k,m,lat,n)
+#
+#                and the qk values for a new date are then a single matrix
+#                multiply of the coefficients against A_k for each k (see
+#                the --operator flag of Calculate_qk.py).
+#
+# Notes:         WARNING!!! The operator is LARGE. For all 137 F320
+#                pressure levels it is ~2.9 TB per mode, so it is normally
+#                only built for the handful of pressure levels that are
+#                needed. The size is reported before anything is written
+#                and the script exits if it is larger than --max_gb.
+#                NOTE: the operator is never faster than Calculate_qk.py
+#                with --hough_store. It repeats the hough functions for
+#                each of the L pressure levels, so every date reads L
+#                times the hough bytes and does L times the flops of the
+#                hough store path (which applies vsf_int after the n
+#                sum). Use --hough_store (and --levels/--plevs) for
+#                production runs, tests/qMODES_benchmark.py times both.
+#
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#IMPORTS
+
+import os
+import time
+import argparse
+import xarray   as xa
+from qMODES_Functions import create_qk_operator, get_qk_operator_nbytes, is_hough_store, read_hough_store_lat, get_hough_infile
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#READING IN COMMAND LINE ARGUMENTS
+
+parser = argparse.ArgumentParser(description="This script precomputes the date independent qk operator")
+parser.add_argument('-l', '--levels', help='comma separated list of vgrid_int indices to build the operator for (default all levels)', default=None)
+parser.add_argument('--max_gb', help='maximum size (in GB) of the operator files on disk (all modes), the script exits if the operator would be larger', type=float, default=100.0)
+parser.add_argument('--hough_store', help='command line flag that, if included, reads the hough functions from the consolidated hough store (see Consolidate_Hough_Files.py)',action='store_true')
+args = parser.parse_args()
+
+levels    = args.levels
+max_gb    = args.max_gb
+use_store = args.hough_store
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#USER INPUTS
+
+#Fourier Space Parameters
+#Hard coding these in for now ... should read in from config/ files later
+nK = 351 #number of K modes
+nM = 60  #number of M modes
+nN = 200 #number of N modes
+
+# Modes to build the operator for
+Mode_list = ['EIG','WIG','BAL']
+
+# Input and Output Directories and Files
+vsf_int_infile = "../../input_data/MODES_data/vsf_int/vsf_int.data.nc"
+hough_dir      = "../../input_data/MODES_data/hough/"
+hough_store    = "../../input_data/MODES_data/hough_store/"
+operator_dir   = "../../input_data/MODES_data/qk_operator/"
+
+if use_store: hough_dir = hough_store
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# READING IN DATA
+
+# Reading in vsf_int data
+vsf_int_ds = xa.open_dataset(vsf_int_infile)
+vsf_int    = vsf_int_ds["vsf_int"].values
+vgrid_int  = vsf_int_ds["vgrid_int"].values
+
+# Reducing to the requested pressure levels
+if levels is not None:
+    iplev_list = [int(i) for i in levels.split(',')]
+    vsf_int    = vsf_int[:,iplev_list]
+    vgrid_int  = vgrid_int[iplev_list]
+
+# Reading in latitudes
+if is_hough_store(hough_dir):
+    nlat = read_hough_store_lat(hough_dir).shape[0]
+else:
+    nlat = xa.open_dataset(get_hough_infile(hough_dir, 0))["lat"].shape[0]
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# CHECKING OPERATOR SIZE
+
+nplev         = vgrid_int.shape[0]
+operator_size = len(Mode_list) * get_qk_operator_nbytes(nK, nM, nN, nplev, nlat) / 1.0e9
+
+print(f"qk operator size for {nplev} pressure levels and {len(Mode_list)} modes = {operator_size:.2f} GB")
+print(f"\t({operator_size/nplev:.2f} GB per pressure level)")
+
+if operator_size > max_gb:
+    print(f"EXITING: qk operator would be larger than --max_gb ({max_gb} GB), use --levels to reduce the number of pressure levels")
+    exit()
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# CREATING THE OPERATOR
+
+os.makedirs(operator_dir, exist_ok=True)
+
+tic = time.perf_counter()
+operator_files = create_qk_operator(hough_dir, operator_dir, vsf_int, vgrid_int, nK, Mode_list)
+toc = time.perf_counter()
+
+print(f"time to create qk operator = {(toc - tic)/60.0} min")
+print(f"qk operator saved to:")
+for operator_file in operator_files:
+    print(f"\t{operator_file} ({os.path.getsize(operator_file)/1.0e9:.2f} GB)")
+
+#--------------------------------------------------------------------------
@@ -0,0 +1,250 @@
+#--------------------------------------------------------------------------
+# File:          Run_qMODES_Pipeline.py
+# Author:        Bradley Kumm (bkumm@wisc.edu)
+# Last Modified: 2026/10/18 (YYYY/MM/DD)
+# Description:   Driver script that runs the full qk -> qMODES chain for a
+#                range of dates. For every date Calculate_qk.py is run in
+#                ALL mode (EIG, WIG, BAL, and noMRG BAL in one pass) and
+#                then Calculate_qMODES.py (and the noMRG variant if
+#                --noMRG is included) once the qk files exist.
+#
+#                Several dates are run at the same time (--jobs), each
+#                date running its stages in order. Finished and failed
+#                stages are recorded in a JSON ledger so an interrupted run
+#                can just be started again. A stage is skipped if it isn't
+#                recorded as failed in the ledger and its output files
+#                exist and are valid (all variables present with the
+#                expected shapes), so done stages whose outputs were since
+#                removed are rerun. Failed stages and invalid or partial
+#                outputs are removed and rerun.
+#
+# Notes:         The output file names below must match the names used in
+#                Calculate_qk.py and Calculate_qMODES.py. The output of
+#                every stage is saved to a log file in --log_dir.
+#
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#IMPORTS
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+import xarray   as xa
+from datetime           import datetime
+from concurrent.futures import ThreadPoolExecutor
+from qMODES_Functions   import get_date_list
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#READING IN COMMAND LINE ARGUMENTS
+
+parser = argparse.ArgumentParser(description="This script runs the qk and qMODES calculations for a range of dates")
+parser.add_argument('--dates', help='comma separated list of dates and/or date ranges (YYYYMMDD-YYYYMMDD) to run', required=True)
+parser.add_argument('-k', '--k_lower_bound', help='k lower bound passed on to Calculate_qMODES.py', type=int, default=0)
+parser.add_argument('--noMRG', help='command line flag that, if included, also calculates the noMRG qMODES files',action='store_true')
+parser.add_argument('-j', '--jobs', help='number of dates to run at the same time', type=int, default=1)
+parser.add_argument('-w', '--workers', help='number of worker processes for each Calculate_qk.py run', type=int, default=1)
+parser.add_argument('--hough_store', help='command line flag passed on to Calculate_qk.py',action='store_true')
+parser.add_argument('--operator', help='command line flag passed on to Calculate_qk.py',action='store_true')
+parser.add_argument('--ledger', help='JSON file recording the finished stages', default="../../output_data/qMODES_pipeline_ledger.json")
+parser.add_argument('--log_dir', help='directory for the stage log files', default="../../output_data/qMODES_pipeline_logs/")
+parser.add_argument('--force', help='command line flag that, if included, reruns every stage even if it is already done',action='store_true')
+args = parser.parse_args()
+
+date_list = get_date_list(args.dates)
+k_lb      = args.k_lower_bound
+noMRG     = args.noMRG
+jobs      = args.jobs
+workers   = args.workers
+ledger    = args.ledger
+log_dir   = args.log_dir
+force     = args.force
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#USER INPUTS
+
+Mode_list = ['EIG','WIG','BAL']
+
+# Only used for the qMODES file names, must match Calculate_qMODES.py
+nK = 351 #number of K modes
+
+# Output directories used by Calculate_qk.py and Calculate_qMODES.py
+# (relative to the qMODES_scripts directory the scripts are run from)
+script_dir    = os.path.dirname(os.path.abspath(__file__))
+qk_outdir     = os.path.join(script_dir, "../../output_data/qk_data/")
+qMODES_outdir = os.path.join(script_dir, "../../output_data/qMODES_Data/")
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# STAGES
+
+def get_qmodes_outfile(date, stage_noMRG):
+    '''returns the Calculate_qMODES.py output file for date (same naming as in Calculate_qMODES.py)'''
+    k_lb_str = str(0)*(3-len(str(k_lb))) + str(k_lb)
+
+    outfile  = qMODES_outdir + "qmodes"
+    if stage_noMRG: outfile += "_noMRG"
+    if k_lb != 0:   outfile += f"_k{k_lb_str}-{nK}"
+    return outfile + f"_{date}0000000.nc"
+
+def get_stages(date):
+    """
+    Returns the ordered list of stages for date. Each stage is a dictionary
+    with the stage name, the command to run, and the expected outputs as a
+    dictionary of {outfile: list of variables}.
+    """
+    qk_cmd = [sys.executable, "Calculate_qk.py", "-d", date, "-m", "ALL", "-w", str(workers)]
+    if args.hough_store: qk_cmd.append("--hough_store")
+    if args.operator:    qk_cmd.append("--operator")
+
+    stages = [ {'name'   : 'qk',
+                'cmd'    : qk_cmd,
+                'outputs': {qk_outdir + f"qk_{date}0000000.nc"      : [f'qk_{imode}' for imode in Mode_list],
+                            qk_outdir + f"qk_noMRG_{date}0000000.nc": ['qk_BAL', 'noMRG']}},
+               {'name'   : 'qMODES',
+                'cmd'    : [sys.executable, "Calculate_qMODES.py", "-d", date, "-k", str(k_lb)],
+                'outputs': {get_qmodes_outfile(date, False): [f'q_{imode}' for imode in Mode_list]}} ]
+
+    if noMRG:
+        stages.append( {'name'   : 'qMODES_noMRG',
+                        'cmd'    : [sys.executable, "Calculate_qMODES.py", "-d", date, "-k", str(k_lb), "--noMRG"],
+                        'outputs': {get_qmodes_outfile(date, True): [f'q_{imode}' for imode in Mode_list]}} )
+
+    return stages
+
+def is_valid_output(outfile, var_list):
+    '''checks that outfile can be opened and has every variable in var_list, with the same shape for all of the data variables'''
+    if not os.path.exists(outfile): return False
+    try:
+        with xa.open_dataset(outfile) as ds:
+            if any(var not in ds.variables for var in var_list): return False
+            shapes = set(ds[var].shape for var in var_list if var != 'noMRG')
+            return len(shapes) == 1 and 0 not in list(shapes)[0]
+    except Exception:
+        return False
+
+def is_stage_done(stage):
+    '''checks if every output of stage is valid'''
+    return all(is_valid_output(outfile, var_list) for outfile, var_list in stage['outputs'].items())
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# LEDGER
+#
+# The ledger is a JSON file of {date: {stage: record}} where the record
+# holds the status ('done' or 'failed'), the finish time, the run time,
+# and the log file. It is rewritten (atomically) after every stage.
+
+ledger_lock = threading.Lock()
+
+def read_ledger():
+    '''reads the ledger (empty if it doesn't exist yet)'''
+    if not os.path.exists(ledger): return {}
+    with open(ledger) as f: return json.load(f)
+
+def update_ledger(date, stage_name, record):
+    '''adds the record for (date, stage_name) to the ledger file'''
+    with ledger_lock:
+        ledger_data = read_ledger()
+        ledger_data.setdefault(date, {})[stage_name] = record
+
+        tmp_file = ledger + ".tmp"
+        with open(tmp_file, 'w') as f: json.dump(ledger_data, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, ledger)
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# RUNNING THE DATES
+
+def run_date(date):
+    '''runs the stages of a single date in order, stopping at the first failed stage, returns the status of every stage'''
+    status = {}
+    rerun  = force # once a stage is rerun every later stage is rerun as well
+
+    with ledger_lock: date_ledger = read_ledger().get(date, {})
+
+    for stage in get_stages(date):
+        ledger_status = date_ledger.get(stage['name'], {}).get('status')
+
+        # skipping stages that are done (not failed in the ledger, and with valid outputs)
+        if not rerun and ledger_status != 'failed' and is_stage_done(stage):
+            if ledger_status != 'done':
+                update_ledger(date, stage['name'], {'status':'done', 'finished':datetime.now().isoformat(timespec='seconds'), 'note':'outputs already present'})
+            status[stage['name']] = 'skipped'
+            continue
+
+        rerun = True
+
+        # removing partial outputs, Calculate_qMODES.py appends to an existing file
+        for outfile in stage['outputs']:
+            if os.path.exists(outfile): os.remove(outfile)
+
+        log_file = os.path.join(log_dir, f"{stage['name']}_{date}.log")
+        tic      = time.perf_counter()
+        with open(log_file, 'w') as log:
+            result = subprocess.run(stage['cmd'], cwd=script_dir, stdout=log, stderr=subprocess.STDOUT)
+        toc      = time.perf_counter()
+
+        # the scripts exit normally on some input errors, so the outputs are checked as well
+        done = result.returncode == 0 and is_stage_done(stage)
+        update_ledger(date, stage['name'], {'status'    : 'done' if done else 'failed',
+                                            'returncode': result.returncode,
+                                            'finished'  : datetime.now().isoformat(timespec='seconds'),
+                                            'run_time_s': round(toc - tic, 3),
+                                            'log'       : log_file})
+
+        status[stage['name']] = 'done' if done else 'failed'
+        if not done:
+            print(f"{date} {stage['name']} FAILED (see {log_file})")
+            break
+
+        print(f"{date} {stage['name']} done in {(toc - tic)/60.0:.2f} min")
+
+    return status
+
+os.makedirs(log_dir, exist_ok=True)
+os.makedirs(qk_outdir, exist_ok=True)
+os.makedirs(qMODES_outdir, exist_ok=True)
+os.makedirs(os.path.dirname(os.path.abspath(ledger)), exist_ok=True)
+
+tic = time.perf_counter()
+with ThreadPoolExecutor(max_workers=jobs) as pool:
+    status_list = list(pool.map(run_date, date_list))
+toc = time.perf_counter()
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# SUMMARY
+
+failed_dates = [date for date, status in zip(date_list, status_list) if 'failed' in status.values()]
+
+print(f"time to run {len(date_list)} dates = {(toc - tic)/60.0} min")
+print(f"\t{len(date_list) - len(failed_dates)} dates complete, {len(failed_dates)} failed")
+if failed_dates: print(f"\tfailed dates: {','.join(failed_dates)}")
+print(f"ledger saved to:\n\t{ledger}")
+
+if failed_dates: sys.exit(1)
+#--------------------------------------------------------------------------
@@ -0,0 +1,1290 @@
+#-------------------------------------------------------------------------
+# Script: qMODES_Functions.py
+# Author: Bradley Kumm (bkumm@wisc.edu)
+# Creation Date: October 18, 2026
+# Description: This script contains commonly used functions for the main
+#              qMODES computations (Fourier space qk and physical space
+#              qMODES values).
+# Notes:
+#
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# Imports
+
+import os
+import json
+import time
+import importlib.util
+import multiprocessing as mp
+import xarray   as xa
+import numpy    as np
+import h5netcdf
+
+from datetime        import datetime, timedelta
+from contextlib      import contextmanager
+from multiprocessing import shared_memory
+
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# HOUGH FUNCTION READERS
+
+def get_hough_infile(hough_dir, kk):
+    '''returns the name of the hough function file for zonal wavenumber kk'''
+    kstr = "0"*(3-len(str(kk)))+str(kk)
+    return hough_dir + f"hough_F320_M60.wn00{kstr}.nc"
+
+def read_hough_q_slab(hough_dir, kk, mode):
+    """
+    Reads in the q relevant (index 2) component of the hough functions for
+    zonal wavenumber kk and the given mode. Output indexing is [m,lat,n],
+    which is the ordering used by the contractions in compute_qk_slab.
+    """
+    return read_hough_q_slabs(hough_dir, kk, [mode])[mode]
+
+def read_hough_q_slabs(hough_dir, kk, mode_list):
+    """
+    Same as read_hough_q_slab but reads in every mode in mode_list while
+    only opening the hough file for zonal wavenumber kk once. Output is a
+    dictionary of [m,lat,n] arrays keyed by mode.
+
+    If hough_dir is a consolidated hough store (see Consolidate_Hough_Files.py)
+    the slabs are zero-copy slices of the memory mapped store instead.
+    """
+    tic = time.perf_counter()
+
+    if is_hough_store(hough_dir):
+        # the memory mapped slabs are only read when they are used, so only the bytes are recorded
+        hough = {imode: open_hough_store(hough_dir, imode)[kk] for imode in mode_list}
+        add_input_read('hough', sum(hough[imode].nbytes for imode in mode_list), 0.0, files=0)
+        return hough
+
+    hough_ds = xa.open_dataset(get_hough_infile(hough_dir, kk))
+    nbytes   = sum(hough_ds[imode].nbytes for imode in mode_list) # the whole variable is read before slicing
+    hough    = {imode: np.ascontiguousarray( hough_ds[imode].values[:,2,:,:] ) for imode in mode_list} # file indexing is [m,component,lat,n]
+    hough_ds.close()
+
+    add_input_read('hough', nbytes, time.perf_counter() - tic)
+    return hough
+
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# CONSOLIDATED HOUGH STORE
+#
+# The store is a directory holding one .npy file per mode with only the q
+# relevant (index 2) component of the hough functions, indexed [k,m,lat,n]
+# so each k slab is one contiguous [m,lat,n] block, and a .npy file with
+# the latitudes. The .npy files are memory mapped when read.
+
+_hough_store_cache = {}
+
+def get_hough_store_file(store_dir, mode):
+    '''returns the name of the hough store file for the given mode'''
+    return store_dir + f"hough_q_{mode}.npy"
+
+def get_hough_store_lat_file(store_dir):
+    '''returns the name of the hough store latitude file'''
+    return store_dir + "hough_q_lat.npy"
+
+def is_hough_store(hough_dir):
+    '''returns True if hough_dir is a consolidated hough store'''
+    return os.path.isfile(get_hough_store_lat_file(hough_dir))
+
+def open_hough_store(store_dir, mode):
+    """
+    Memory maps (read only) the hough store file for the given mode. The
+    memory maps are cached so each process only opens each file once.
+    Output indexing is [k,m,lat,n].
+    """
+    key = (store_dir, mode)
+    if key not in _hough_store_cache:
+        _hough_store_cache[key] = np.load(get_hough_store_file(store_dir, mode), mmap_mode='r')
+    return _hough_store_cache[key]
+
+def read_hough_store_lat(store_dir):
+    '''reads in the latitudes of the hough functions saved in a hough store'''
+    return np.load(get_hough_store_lat_file(store_dir))
+
+def create_hough_store(hough_dir, store_dir, nK, mode_list=['EIG','WIG','BAL']):
+    """
+    Converts the nK per wavenumber hough netCDF files in hough_dir into a
+    consolidated hough store in store_dir. Each hough file is only read
+    once and the store files are filled in one k slab at a time so the
+    full store is never held in memory.
+    """
+    # removing the latitude file of any old store so a partial store is never used
+    if is_hough_store(store_dir): os.remove(get_hough_store_lat_file(store_dir))
+
+    store = {}
+    for kk in range(nK):
+        hough = read_hough_q_slabs(hough_dir, kk, mode_list)
+
+        for imode in mode_list:
+            if imode not in store:
+                store[imode] = np.lib.format.open_memmap(get_hough_store_file(store_dir, imode), mode='w+',
+                                                         dtype=np.float64, shape=(nK,) + hough[imode].shape)
+            store[imode][kk,:,:,:] = hough[imode]
+
+    for imode in mode_list:
+        store[imode].flush()
+
+    # the latitude file is written last since it marks the store as complete
+    hough_ds = xa.open_dataset(get_hough_infile(hough_dir, 0))
+    np.save(get_hough_store_lat_file(store_dir), hough_ds["lat"].values)
+    hough_ds.close()
+
+    return [get_hough_store_file(store_dir, imode) for imode in mode_list]
+
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# qk PROJECTION ENGINE
+
+def hough_inner_sum(coefs_k, hough_k, n_lb=0):
+    """
+    Calculates the n portion of the qk sum (the "inner sum") for a single
+    zonal wavenumber,
+
+        inner(m,lat) = sum_{n >= n_lb} coefs(m,n) * hough(m,lat,n)
+
+    coefs_k has indexing [...,m,n] (any leading indices, e.g. Re+Im, are
+    treated as a batch) and hough_k has indexing [m,lat,n]. The sum is done
+    as a single batched matmul over m. Output indexing is [...,m,lat].
+    """
+    coefs_k = np.asarray(coefs_k)
+    batch   = coefs_k.shape[:-2]
+    nM, nN  = coefs_k.shape[-2:]
+
+    # moving the batch indices to the back so each m is one (lat,n)x(n,batch) matmul
+    coefs_mat = np.moveaxis( coefs_k.reshape((-1, nM, nN)), 0, -1 )[:,n_lb:,:] # [m,n,batch]
+    inner     = np.matmul( hough_k[:,:,n_lb:], coefs_mat )                     # [m,lat,batch]
+
+    return np.moveaxis(inner, -1, 0).reshape(batch + inner.shape[:2])
+
+def apply_vsf_int(inner, vsf_int):
+    """
+    Calculates the m portion of the qk sum (the "outer sum"),
+
+        qk(plev,lat) = sum_m vsf_int(m,plev) * inner(m,lat)
+
+    inner has indexing [...,m,lat] and vsf_int has indexing [m,plev]. The
+    sum is done as a single matrix multiply. Output indexing is [...,plev,lat].
+    """
+    return np.matmul( vsf_int.T, inner )
+
+def get_vsf_int_plev_weights(vgrid_int, plevs):
+    """
+    Returns the [vgrid_int, plevs] weights that interpolate vsf_int
+    (linearly in log pressure) from the vgrid_int levels to the pressures
+    plevs (same units as vgrid_int), i.e. vsf_int(m,plevs) = vsf_int @ weights.
+    qk is linear in vsf_int, so this gives the interpolated qk values.
+    Pressures that are vgrid_int levels get exactly that level.
+    """
+    plevs = np.asarray(plevs, dtype=float)
+    if plevs.min() < vgrid_int.min() or plevs.max() > vgrid_int.max():
+        raise ValueError(f"pressures must be between {vgrid_int.min()} and {vgrid_int.max()} (the vgrid_int range)")
+
+    order      = np.argsort(vgrid_int)
+    logp       = np.log(vgrid_int[order])
+    j          = np.clip(np.searchsorted(logp, np.log(plevs)), 1, len(logp)-1)
+    w          = (np.log(plevs) - logp[j-1]) / (logp[j] - logp[j-1])
+
+    weights = np.zeros((vgrid_int.shape[0], plevs.shape[0]))
+    ipoint  = np.arange(plevs.shape[0])
+    weights[order[j-1], ipoint] += 1.0 - w
+    weights[order[j],   ipoint] += w
+    return weights
+
+def get_vsf_int_levels(vsf_int, vgrid_int, levels=None, plevs=None):
+    """
+    Reduces vsf_int ([m,plev] indexing) to the pressure levels the qk
+    values are needed on, either the vgrid_int indices in levels or the
+    pressures in plevs (interpolated, see get_vsf_int_plev_weights), so
+    the m portion of the qk sum is only done for those levels. Returns
+    [vsf_int, vgrid_int] for the requested levels.
+    """
+    if levels is not None:
+        return [vsf_int[:,levels], vgrid_int[levels]]
+    if plevs is not None:
+        return [np.matmul(vsf_int, get_vsf_int_plev_weights(vgrid_int, plevs)), np.asarray(plevs, dtype=float)]
+    return [vsf_int, vgrid_int]
+
+def compute_qk_slab(coefs_k, hough_k, vsf_int, n_lb=0):
+    """
+    Calculates qk for a single zonal wavenumber k,
+
+        qk(plev,lat) = sum_m vsf_int(m,plev) sum_{n >= n_lb} coefs(m,n) * hough(m,lat,n)
+
+    coefs_k has indexing [...,m,n] (normally [Re+Im,m,n]), hough_k has
+    indexing [m,lat,n], and vsf_int has indexing [m,plev]. Output indexing
+    is [...,plev,lat].
+    """
+    return apply_vsf_int( hough_inner_sum(coefs_k, hough_k, n_lb), vsf_int )
+
+def compute_qk(coefs, hough_dir, vsf_int, mode, n_lb=0):
+    """
+    Calculates qk for every zonal wavenumber of the given mode. coefs has
+    the hough coefficient file indexing [Re+Im,k,m,n] (first timestep only).
+    Output indexing is [Re+Im,k_mode,vgrid_int,lat]. Any extra leading
+    indices of coefs (e.g. date) are kept in the output.
+    """
+    return compute_qk_modes({mode: coefs}, hough_dir, vsf_int, {mode: (mode, n_lb)})[mode]
+
+def compute_qk_modes(coefs, hough_dir, vsf_int, qk_specs, workers=1, operator_dir=None):
+    """
+    Calculates several qk outputs in a single pass over the hough files, so
+    each hough file is opened once no matter how many outputs are requested.
+
+    coefs is a dictionary of [Re+Im,k,m,n] coefficient arrays keyed by mode
+    and qk_specs is a dictionary of (mode, n_lb) tuples keyed by output name,
+    e.g. {'BAL':('BAL',0), 'BAL_noMRG':('BAL',1)}. Output is a dictionary of
+    [Re+Im,k_mode,vgrid_int,lat] arrays keyed by output name.
+
+    The coefficients for several dates can be stacked along extra leading
+    indices (e.g. [date,Re+Im,k,m,n]), in which case every hough slab is
+    contracted against all of the dates at once and the leading indices
+    are kept in the output.
+
+    If workers > 1 the k slabs are spread over a process pool (see
+    compute_qk_modes_parallel). If operator_dir is given the precomputed qk
+    operator is used in place of the hough functions and vsf_int.
+    """
+    if workers > 1:
+        return compute_qk_modes_parallel(coefs, hough_dir, vsf_int, qk_specs, workers, operator_dir)
+
+    nK   = list(coefs.values())[0].shape[-3]
+    nlat = get_qk_operator_nlat(operator_dir)
+    qk   = {}
+
+    for kk in range(nK):
+        qk_k = compute_qk_modes_slab(coefs, hough_dir, vsf_int, qk_specs, kk, operator_dir, nlat)
+
+        for name in qk_specs:
+            if name not in qk: qk[name] = np.zeros(get_qk_shape(qk_k[name].shape, nK))
+            qk[name][...,kk,:,:] = qk_k[name]
+
+    return qk
+
+def compute_qk_modes_slab(coefs, hough_dir, vsf_int, qk_specs, kk, operator_dir=None, nlat=None):
+    """
+    Calculates every qk output in qk_specs for the single zonal wavenumber
+    kk, reading the hough file for kk once. Output is a dictionary of
+    [...,Re+Im,vgrid_int,lat] arrays keyed by output name. When operator_dir
+    is given nlat is the number of latitudes the operator was built for
+    (see get_qk_operator_nlat).
+    """
+    mode_list = sorted( set(imode for imode, _ in qk_specs.values()) )
+    tic       = time.perf_counter()
+
+    if operator_dir is not None:
+        operator = {imode: open_qk_operator(operator_dir, imode)[kk] for imode in mode_list}
+        add_input_read('operator', sum(operator[imode].nbytes for imode in mode_list), 0.0, files=0) # read during the matmul
+        qk_k     = {name: apply_qk_operator(coefs[imode][...,kk,:,:], operator[imode], nlat, n_lb)
+                    for name, (imode, n_lb) in qk_specs.items()}
+    else:
+        hough = read_hough_q_slabs(hough_dir, kk, mode_list)
+        qk_k  = {name: compute_qk_slab(coefs[imode][...,kk,:,:], hough[imode], vsf_int, n_lb)
+                 for name, (imode, n_lb) in qk_specs.items()}
+
+    add_k_slab_time(kk, time.perf_counter() - tic)
+    return qk_k
+
+def compute_inner_modes(coefs, hough_dir, qk_specs, workers=1):
+    """
+    Calculates the level independent n portion of the qk sum (the "inner
+    sum", see hough_inner_sum) for every zonal wavenumber of each output in
+    qk_specs (same inputs as compute_qk_modes). Output is a dictionary of
+    [Re+Im,k_mode,m,lat] arrays keyed by output name, which apply_vsf_int
+    turns into qk for any set of pressure levels.
+    """
+    # the inner sums are qk with vsf_int replaced by the identity, so the
+    # (serial or parallel) qk engine is reused as is
+    nM = list(coefs.values())[0].shape[-2]
+    return compute_qk_modes(coefs, hough_dir, np.eye(nM), qk_specs, workers)
+
+def get_qk_shape(qk_k_shape, nK):
+    '''returns the full qk shape [...,k_mode,vgrid_int,lat] from the shape of a single k slab [...,vgrid_int,lat]'''
+    return tuple(qk_k_shape[:-2]) + (nK,) + tuple(qk_k_shape[-2:])
+
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# PRECOMPUTED qk OPERATOR
+#
+# The hough functions and vsf_int are the same for every date, so they can
+# be combined ahead of time into a single operator per k,
+#
+#     A_k(m*nN + n, plev*nlat + lat) = vsf_int(m,plev) * hough(k,m,lat,n)
+#
+# and qk for any date is then one matrix multiply of the (flattened)
+# coefficients against A_k. The operator is large (nK*nM*nN*nplev*nlat
+# values per mode, ~2.9 TB for all 137 F320 levels) so it is normally only
+# built for a subset of pressure levels (see Precompute_qk_Operator.py).
+# Since the hough functions are repeated for every level, each date reads
+# (and multiplies) nplev times as much as the hough store path does, so
+# the operator is never faster than compute_qk_modes with a hough store.
+# The operator directory holds one .npy file per mode, indexed
+# [k, m*nN + n, plev*nlat + lat], along with the vgrid_int and lat values.
+
+_qk_operator_cache = {}
+
+def get_qk_operator_file(operator_dir, mode):
+    '''returns the name of the qk operator file for the given mode'''
+    return operator_dir + f"qk_operator_{mode}.npy"
+
+def get_qk_operator_grid_files(operator_dir):
+    '''returns the names of the qk operator vgrid_int and lat files'''
+    return [operator_dir + "qk_operator_vgrid_int.npy", operator_dir + "qk_operator_lat.npy"]
+
+def get_qk_operator_nbytes(nK, nM, nN, nplev, nlat, itemsize=8):
+    '''returns the size (in bytes) of a qk operator for a single mode'''
+    return nK * nM * nN * nplev * nlat * itemsize
+
+def open_qk_operator(operator_dir, mode):
+    """
+    Memory maps (read only) the qk operator for the given mode. The memory
+    maps are cached so each process only opens each file once. Output
+    indexing is [k, m*nN + n, plev*nlat + lat].
+    """
+    key = (operator_dir, mode)
+    if key not in _qk_operator_cache:
+        _qk_operator_cache[key] = np.load(get_qk_operator_file(operator_dir, mode), mmap_mode='r')
+    return _qk_operator_cache[key]
+
+def read_qk_operator_grid(operator_dir):
+    '''reads in the [vgrid_int, lat] values that a qk operator was built for'''
+    return [np.load(grid_file) for grid_file in get_qk_operator_grid_files(operator_dir)]
+
+def get_qk_operator_nlat(operator_dir):
+    '''returns the number of latitudes a qk operator was built for (None if no operator_dir is given)'''
+    if operator_dir is None: return None
+    return read_qk_operator_grid(operator_dir)[1].shape[0]
+
+def build_qk_operator_slab(hough_k, vsf_int, operator_k=None):
+    """
+    Builds the qk operator for a single zonal wavenumber from hough_k
+    ([m,lat,n] indexing) and vsf_int ([m,plev] indexing). The operator is
+    filled in one pressure level at a time, into operator_k if it is given
+    (e.g. a slice of a memory mapped operator file). Output indexing is
+    [m*nN + n, plev*nlat + lat].
+    """
+    nM, nlat, nN = hough_k.shape
+    nplev        = vsf_int.shape[1]
+
+    if operator_k is None: operator_k = np.zeros((nM*nN, nplev*nlat))
+
+    hough_mnl = np.transpose(hough_k, (0,2,1)) # [m,n,lat]
+    for iplev in range(nplev):
+        operator_k[:, iplev*nlat:(iplev+1)*nlat] = ( vsf_int[:,iplev,None,None] * hough_mnl ).reshape((nM*nN, nlat))
+
+    return operator_k
+
+def apply_qk_operator(coefs_k, operator_k, nlat, n_lb=0):
+    """
+    Calculates qk for a single zonal wavenumber as one matrix multiply of
+    the coefficients ([...,m,n] indexing) against the qk operator for that
+    wavenumber. n modes below n_lb are zeroed before the multiply. Output
+    indexing is [...,plev,lat].
+    """
+    coefs_k = np.asarray(coefs_k)
+    if n_lb > 0:
+        coefs_k = coefs_k.copy()
+        coefs_k[...,:n_lb] = 0.0
+
+    qk_k = np.matmul( coefs_k.reshape(coefs_k.shape[:-2] + (-1,)), operator_k )
+    return qk_k.reshape(coefs_k.shape[:-2] + (-1, nlat))
+
+def create_qk_operator(hough_dir, operator_dir, vsf_int, vgrid_int, nK, mode_list=['EIG','WIG','BAL']):
+    """
+    Builds the qk operators for every mode in mode_list from the hough
+    functions in hough_dir (netCDF files or a hough store) and saves them in
+    operator_dir. vsf_int and vgrid_int should already be reduced to the
+    pressure levels the operator is wanted for. Each hough file is read
+    once and the operator files are filled one k slab at a time.
+    """
+    operator = {}
+    for kk in range(nK):
+        hough = read_hough_q_slabs(hough_dir, kk, mode_list)
+
+        for imode in mode_list:
+            nM, nlat, nN = hough[imode].shape
+            if imode not in operator:
+                operator[imode] = np.lib.format.open_memmap(get_qk_operator_file(operator_dir, imode), mode='w+',
+                                                            dtype=np.float64, shape=(nK, nM*nN, vsf_int.shape[1]*nlat))
+            build_qk_operator_slab(hough[imode], vsf_int, operator[imode][kk])
+
+    for imode in mode_list:
+        operator[imode].flush()
+
+    # saving the grid the operator was built for
+    if is_hough_store(hough_dir):
+        lat = read_hough_store_lat(hough_dir)
+    else:
+        hough_ds = xa.open_dataset(get_hough_infile(hough_dir, 0))
+        lat      = hough_ds["lat"].values
+        hough_ds.close()
+
+    vgrid_int_file, lat_file = get_qk_operator_grid_files(operator_dir)
+    np.save(vgrid_int_file, vgrid_int)
+    np.save(lat_file, lat)
+
+    return [get_qk_operator_file(operator_dir, imode) for imode in mode_list]
+
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# PARALLEL qk CALCULATION
+#
+# Every k slab is independent (one hough file, one slice of coefs, one
+# slice of qk), so the k slabs are handed out to a process pool one at a
+# time. Workers write their slab straight into shared memory qk arrays so
+# only the k index is ever sent between processes.
+#
+# NOTE: the pool uses the "fork" start method where it is available since
+# the qMODES scripts are not wrapped in a __main__ guard. It is also best
+# to set OMP_NUM_THREADS=1 (or similar for your BLAS) when using many
+# workers so the workers don't compete for cores.
+
+_qk_worker_state = {}
+
+def _init_qk_worker(coefs, hough_dir, vsf_int, qk_specs, operator_dir, nlat, shm_info):
+    '''sets up the inputs and attaches the shared memory qk arrays for a qk worker process'''
+    _qk_worker_state['inputs'] = (coefs, hough_dir, vsf_int, qk_specs)
+    _qk_worker_state['operator'] = (operator_dir, nlat)
+    _qk_worker_state['shm']    = {name: shared_memory.SharedMemory(name=shm_name) for name, (shm_name, _) in shm_info.items()}
+    _qk_worker_state['qk']     = {name: np.ndarray(shape, dtype=np.float64, buffer=_qk_worker_state['shm'][name].buf)
+                                  for name, (_, shape) in shm_info.items()}
+
+def _qk_worker(kk):
+    '''calculates the k slab kk and writes it into the shared memory qk arrays, returns the run statistics for the slab'''
+    reset_run_stats()
+    qk_k = compute_qk_modes_slab(*_qk_worker_state['inputs'], kk, *_qk_worker_state['operator'])
+    for name in qk_k:
+        _qk_worker_state['qk'][name][...,kk,:,:] = qk_k[name]
+    return copy_run_stats()
+
+def compute_qk_modes_parallel(coefs, hough_dir, vsf_int, qk_specs, workers, operator_dir=None):
+    """
+    Same as compute_qk_modes but with the k slabs spread over a pool of
+    worker processes. The slabs are handed out one at a time as workers
+    become free, which load balances the uneven hough file read times.
+    """
+    nK   = list(coefs.values())[0].shape[-3]
+    nlat = get_qk_operator_nlat(operator_dir)
+
+    # the k=0 slab is done here to get the output shapes
+    qk_0 = compute_qk_modes_slab(coefs, hough_dir, vsf_int, qk_specs, 0, operator_dir, nlat)
+
+    shm    = {}
+    qk_shm = {}
+    try:
+        shm_info = {}
+        for name in qk_specs:
+            shape          = get_qk_shape(qk_0[name].shape, nK)
+            shm[name]      = shared_memory.SharedMemory(create=True, size=int(np.prod(shape))*8)
+            shm_info[name] = (shm[name].name, shape)
+            qk_shm[name]   = np.ndarray(shape, dtype=np.float64, buffer=shm[name].buf)
+            qk_shm[name][...,0,:,:] = qk_0[name]
+
+        if 'fork' in mp.get_all_start_methods(): ctx = mp.get_context('fork')
+        else:                                    ctx = mp.get_context()
+
+        with ctx.Pool(workers, initializer=_init_qk_worker, initargs=(coefs, hough_dir, vsf_int, qk_specs, operator_dir, nlat, shm_info)) as pool:
+            for slab_stats in pool.imap_unordered(_qk_worker, range(1,nK), chunksize=1):
+                merge_run_stats(slab_stats)
+
+        # copying out of shared memory so the shared blocks can be released
+        qk = {name: np.array(qk_shm[name]) for name in qk_shm}
+
+    finally:
+        qk_shm.clear()
+        for name in shm:
+            shm[name].close()
+            shm[name].unlink()
+
+    return qk
+
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# qMODES SYNTHESIS (FOURIER SPACE TO PHYSICAL SPACE)
+#
+# The physical space values are the real Fourier series in longitude
+#
+#     q(lon) = qk_Re(0) + sum_{k>=1} 2 * ( qk_Re(k)*cos(k*lon) - qk_Im(k)*sin(k*lon) )
+#
+# with the k=0 term only included when the lower bound k_lb is 0. The sum
+# can also be limited to a band of k modes k_lb <= k <= k_ub.
+
+def get_k_weights(nK, k_lb=0, k_ub=None):
+    '''returns the weight of each k term in the longitude Fourier series (zero for the filtered out k modes)'''
+    k_weights        = np.full(nK, 2.0)
+    k_weights[0]     = 1.0
+    k_weights[:k_lb] = 0.0
+    if k_ub is not None: k_weights[k_ub+1:] = 0.0
+    return k_weights
+
+def is_fft_lon_grid(lon, nK):
+    '''returns True if lon is a uniform, full circle grid with enough points for all nK modes (so an FFT can be used)'''
+    nlon = lon.shape[0]
+    dlon = np.diff(lon)
+    return 2*(nK-1) < nlon and np.allclose(dlon, 360.0/nlon)
+
+def synthesize_qmodes(qk_mode, lon, k_lb=0, k_ub=None):
+    """
+    Calculates the physical space values of qk_mode (indexing
+    [...,Re+Im,k_mode,vgrid_int,lat]) on the longitudes lon (in degrees),
+    keeping only the k modes >= k_lb (and <= k_ub if given). Output
+    indexing is [...,vgrid_int,lat,lon].
+
+    For a uniform full circle longitude grid the series is summed with a
+    real inverse FFT (the qk values are zero padded to nlon and the grid
+    offset lon[0] is applied as a phase shift), otherwise the cos/sin terms
+    are summed directly as a matrix multiply.
+    """
+    if not is_fft_lon_grid(lon, qk_mode.shape[-3]):
+        return synthesize_qmodes_at_lon(qk_mode, lon, k_lb, k_ub)
+
+    nK   = qk_mode.shape[-3]
+    nlon = lon.shape[0]
+    kk   = np.arange(nK)
+
+    # scaled complex coefficients with indexing [...,vgrid_int,lat,k]
+    # (irfft already counts the k>=1 terms twice and only uses the real part
+    # of the k=0 term, as in the series above, so they are only scaled by nlon)
+    k_scale    = nlon * (get_k_weights(nK, k_lb, k_ub) > 0.0) * np.exp(1j * kk * np.radians(lon[0]))
+    qk_complex = qk_mode[...,0,:,:,:] + 1j * qk_mode[...,1,:,:,:]
+    qk_complex = qk_complex * k_scale[:,None,None]
+    qk_complex = np.moveaxis(qk_complex, -3, -1)
+
+    return np.fft.irfft(qk_complex, n=nlon, axis=-1)
+
+def synthesize_qmodes_at_lon(qk_mode, lon, k_lb=0, k_ub=None):
+    """
+    Same as synthesize_qmodes, but the cos/sin terms of the series are
+    summed directly (as a matrix multiply over k) at each of the given
+    longitudes, which can be any set of longitudes.
+    """
+    nK        = qk_mode.shape[-3]
+    k_weights = get_k_weights(nK, k_lb, k_ub)
+    k_lon     = np.outer(np.arange(nK), np.radians(lon)) # [k,lon]
+
+    cos_mat = k_weights[:,None] * np.cos(k_lon)
+    sin_mat = k_weights[:,None] * np.sin(k_lon)
+
+    qk_Re = np.moveaxis(qk_mode[...,0,:,:,:], -3, -1) # [...,vgrid_int,lat,k]
+    qk_Im = np.moveaxis(qk_mode[...,1,:,:,:], -3, -1) # [...,vgrid_int,lat,k]
+
+    return np.matmul(qk_Re, cos_mat) - np.matmul(qk_Im, sin_mat)
+
+def get_k_bands(k_bands, nK):
+    '''returns the list of (k_lb, k_ub) bands in a comma separated list of k ranges (e.g. "0-3,4-20,21-350"), a single k is a band of one mode'''
+    band_list = []
+    for band in k_bands.split(','):
+        if '-' in band: [k_lb, k_ub] = [int(k) for k in band.split('-')]
+        else:           k_lb = k_ub = int(band)
+
+        if k_lb < 0 or k_ub < k_lb or k_ub >= nK:
+            raise ValueError(f"k band {band} isn't a valid range of k modes (0 to {nK-1})")
+        band_list.append( (k_lb, k_ub) )
+    return band_list
+
+def get_k_band_name(k_lb, k_ub):
+    '''returns the k band part of the output names (e.g. k000-003)'''
+    return f"k{k_lb:03d}-{k_ub:03d}"
+
+def synthesize_qmodes_bands(qk_mode, lon, k_bands):
+    """
+    Same as synthesize_qmodes, but for each (k_lb, k_ub) band in k_bands
+    in one pass, i.e. the qk values are only read and rearranged (and
+    phase shifted for the FFT) once and each band only does its own
+    inverse FFT (or matrix multiply). Returns a list of the band limited
+    values (indexing [...,vgrid_int,lat,lon]) in the order of k_bands.
+    """
+    nK = qk_mode.shape[-3]
+    if not is_fft_lon_grid(lon, nK):
+        k_lon = np.outer(np.arange(nK), np.radians(lon)) # [k,lon]
+        qk_Re = np.moveaxis(qk_mode[...,0,:,:,:], -3, -1) # [...,vgrid_int,lat,k]
+        qk_Im = np.moveaxis(qk_mode[...,1,:,:,:], -3, -1) # [...,vgrid_int,lat,k]
+
+        q_bands = []
+        for (k_lb, k_ub) in k_bands:
+            k = slice(k_lb, k_ub+1) # only the k modes in the band are summed
+            k_weights = get_k_weights(nK, k_lb, k_ub)[k]
+            q_bands.append( np.matmul(qk_Re[...,k], k_weights[:,None]*np.cos(k_lon[k])) - np.matmul(qk_Im[...,k], k_weights[:,None]*np.sin(k_lon[k])) )
+        return q_bands
+
+    nlon = lon.shape[0]
+    kk   = np.arange(nK)
+
+    # scaled complex coefficients with indexing [...,vgrid_int,lat,k] (see synthesize_qmodes)
+    qk_complex = qk_mode[...,0,:,:,:] + 1j * qk_mode[...,1,:,:,:]
+    qk_complex = qk_complex * (nlon * np.exp(1j * kk * np.radians(lon[0])))[:,None,None]
+    qk_complex = np.moveaxis(qk_complex, -3, -1)
+
+    return [np.fft.irfft(qk_complex * (get_k_weights(nK, k_lb, k_ub) > 0.0), n=nlon, axis=-1) for (k_lb, k_ub) in k_bands]
+
+def get_lat_window_index(lat, lat_min, lat_max):
+    '''returns the indices of the latitudes lat_min <= lat <= lat_max (in degrees) in the order of lat'''
+    return np.where( (lat >= min(lat_min, lat_max)) & (lat <= max(lat_min, lat_max)) )[0]
+
+def get_lon_window_index(lon, lon_min, lon_max):
+    """
+    Returns the indices of the longitudes from lon_min east to lon_max (in
+    degrees, either -180 to 180 or 0 to 360, windows that cross 0/360 are
+    fine), ordered from lon_min eastward.
+    """
+    lon_offset = np.mod(lon - lon_min, 360.0)
+    index      = np.where( lon_offset <= np.mod(lon_max - lon_min, 360.0) )[0]
+    return index[np.argsort(lon_offset[index], kind='stable')]
+
+def synthesize_qmodes_window(qk_mode, lat, lon, lat_bounds, lon_bounds, k_lb=0):
+    """
+    Calculates the physical space values of qk_mode (indexing
+    [...,Re+Im,k_mode,vgrid_int,lat]) only inside the lat/lon box given by
+    lat_bounds = (lat_min, lat_max) and lon_bounds = (lon_min, lon_max)
+    (see get_lon_window_index), where lat and lon are the full grid. Only
+    the cos/sin terms at the longitudes inside the box are summed (see
+    synthesize_qmodes_at_lon). Returns [q_window, lat_window, lon_window]
+    with q_window indexing [...,vgrid_int,lat_window,lon_window].
+    """
+    lat_index = get_lat_window_index(lat, *lat_bounds)
+    lon_index = get_lon_window_index(lon, *lon_bounds)
+
+    q_window = synthesize_qmodes_at_lon(qk_mode[...,lat_index], lon[lon_index], k_lb)
+    return [q_window, lat[lat_index], lon[lon_index]]
+
+def get_qmodes_window(qk_infile, lon, lat_bounds, lon_bounds, levels=slice(None), k_lb=0, mode_list=['EIG','WIG','BAL']):
+    """
+    Reads only the pressure levels (vgrid_int indices, all by default) and
+    latitudes inside the box from qk_infile and synthesizes the q modes
+    in mode_list inside the lat/lon box (see synthesize_qmodes_window), lon
+    is the full longitude grid. Returns an xarray Dataset with the
+    variables q_{mode} (indexing [(time),plev,lat,lon]).
+    """
+    if np.isscalar(levels): levels = [levels]
+
+    qk_ds     = xa.open_dataset(qk_infile)
+    lat       = qk_ds['lat'].values
+    lat_index = get_lat_window_index(lat, *lat_bounds)
+    lon_index = get_lon_window_index(lon, *lon_bounds)
+    plev      = qk_ds['vgrid_int'].values[levels]
+
+    data_vars = {}
+    for imode in mode_list:
+        qk_mode = qk_ds[f'qk_{imode}'][...,levels,lat_index].values
+        q_mode  = synthesize_qmodes_at_lon(qk_mode, lon[lon_index], k_lb)
+
+        var_dims = ['time','plev','lat','lon'] if 'time' in qk_ds[f'qk_{imode}'].dims else ['plev','lat','lon']
+        data_vars[f'q_{imode}'] = (var_dims, q_mode, {'long_name':f'{imode} Part of q'})
+
+    coords = {'plev':plev, 'lat':lat[lat_index], 'lon':lon[lon_index]}
+    if 'time' in var_dims: coords['time'] = qk_ds['time'].values
+    qk_ds.close()
+
+    return xa.Dataset(data_vars=data_vars,
+                      coords=coords,
+                      attrs={'lat_bounds':list(lat_bounds), 'lon_bounds':list(lon_bounds), 'k_lb':k_lb})
+
+def get_lat_interp_weights(lat, lat_points):
+    """
+    Returns [i0, i1, w] so that the linear interpolation in latitude of
+    values v[...,lat] to lat_points is (1-w)*v[...,i0] + w*v[...,i1]. lat
+    can be in either order (e.g. the Gaussian grid from north to south),
+    and points beyond the first/last grid latitude get the edge values.
+    """
+    lat_points = np.asarray(lat_points, dtype=float)
+    order      = np.argsort(lat)
+    lat_sorted = lat[order]
+
+    j  = np.clip(np.searchsorted(lat_sorted, lat_points), 1, len(lat)-1)
+    w  = np.clip( (lat_points - lat_sorted[j-1]) / (lat_sorted[j] - lat_sorted[j-1]), 0.0, 1.0 )
+    return [order[j-1], order[j], w]
+
+def synthesize_qmodes_at_points(qk_mode, lat, lat_points, lon_points, k_lb=0):
+    """
+    Calculates the physical space values of qk_mode (indexing
+    [...,Re+Im,k_mode,vgrid_int,lat]) at the (lat_points[i], lon_points[i])
+    points (in degrees). qk is interpolated linearly in latitude (which is
+    the same as interpolating the physical space values) and the series is
+    summed at each point's own longitude. Output indexing is [...,point,vgrid_int].
+    """
+    [i0, i1, w] = get_lat_interp_weights(lat, lat_points)
+    qk_points   = (1.0 - w) * qk_mode[...,i0] + w * qk_mode[...,i1] # [...,Re+Im,k_mode,vgrid_int,point]
+
+    nK        = qk_mode.shape[-3]
+    k_weights = get_k_weights(nK, k_lb)
+    k_lon     = np.outer(np.arange(nK), np.radians(lon_points)) # [k,point]
+
+    cos_mat = k_weights[:,None] * np.cos(k_lon)
+    sin_mat = k_weights[:,None] * np.sin(k_lon)
+
+    return np.einsum('...kvp,kp->...pv', qk_points[...,0,:,:,:], cos_mat) - np.einsum('...kvp,kp->...pv', qk_points[...,1,:,:,:], sin_mat)
+
+def get_qmodes_point_profiles(qk_infiles, lat_points, lon_points, mode_list=['EIG','WIG','BAL'], levels=slice(None), k_lb=0, times=None):
+    """
+    Calculates vertical profiles of the q modes in mode_list at the
+    (lat, lon) points (see synthesize_qmodes_at_points) for every qk file
+    in qk_infiles (e.g. one per date), reading only the levels (vgrid_int
+    indices, all by default) and the latitudes next to the points. A zarr
+    time store (e.g. qk.zarr) can be given in place of a file. Files with
+    a time dimension use their own times, otherwise times[i] (or i if times
+    isn't given) is used for the i-th file.
+
+    Returns an xarray DataArray with dimensions (time, point, plev, component).
+    """
+    if isinstance(qk_infiles, str): qk_infiles = [qk_infiles]
+    if np.isscalar(levels):         levels     = [levels]
+
+    profiles  = []
+    time_list = []
+    for ifile, qk_infile in enumerate(qk_infiles):
+        if qk_infile.rstrip('/').endswith('.zarr'): qk_ds = xa.open_dataset(qk_infile, engine='zarr', chunks=None)
+        else:                                       qk_ds = xa.open_dataset(qk_infile)
+
+        # only the latitude columns next to the points are read
+        [i0, i1, w] = get_lat_interp_weights(qk_ds['lat'].values, lat_points)
+        lat_cols    = np.unique(np.concatenate([i0, i1]))
+        lat_read    = qk_ds['lat'].values[lat_cols]
+        plev        = qk_ds['vgrid_int'].values[levels]
+
+        q_points = []
+        for imode in mode_list:
+            qk_mode = qk_ds[f'qk_{imode}'][...,levels,lat_cols].values
+            q_points.append( synthesize_qmodes_at_points(qk_mode, lat_read, lat_points, lon_points, k_lb) )
+        q_points = np.stack(q_points, axis=-1) # [(time),point,plev,component]
+
+        if 'time' in qk_ds[f'qk_{mode_list[0]}'].dims:
+            time_list.extend( qk_ds['time'].values )
+        else:
+            q_points = q_points[np.newaxis]
+            time_list.append( ifile if times is None else times[ifile] )
+        profiles.append(q_points)
+        qk_ds.close()
+
+    return xa.DataArray(np.concatenate(profiles), dims=['time','point','plev','component'], name='q_profile',
+                        coords={'time':time_list, 'point':np.arange(len(lat_points)), 'plev':plev, 'component':list(mode_list),
+                                'point_lat':('point', np.asarray(lat_points, dtype=float)), 'point_lon':('point', np.asarray(lon_points, dtype=float))},
+                        attrs={'long_name':'q modes at points', 'k_lb':k_lb})
+
+#-------------------------------------------------------------------------
+
+
+#-------------------------------------------------------------------------
+# qk ZONAL VARIANCE (PARSEVAL)
+#
+# On a uniform full circle grid of nlon longitudes (with 2*(nK-1) < nlon,
+# so no k mode is aliased) the zonal mean of the series is qk_Re(0) and,
+# by Parseval's identity, the zonal variance is
+#
+#     var(lon) = sum_{k>=1} 2 * ( qk_Re(k)**2 + qk_Im(k)**2 ) * nlon/(nlon - ddof)
+#
+# so the variance at every pressure level and latitude comes straight from
+# the qk values without synthesizing the physical space field. Limiting
+# the k sum to k_lb <= k <= k_ub gives the variance of the band limited
+# field. ddof=1 matches np.var(..., ddof=1) over the synthesized longitudes.
+
+def get_variance_k_weights(nK, nlon, k_lb=0, k_ub=None):
+    '''returns the weight of each |qk|**2 term in the zonal variance (ddof=0) for the k band [k_lb,k_ub]'''
+    if 2*(nK-1) >= nlon:
+        raise ValueError(f"the zonal variance from qk needs more than 2*(nK-1) = {2*(nK-1)} longitudes, got nlon = {nlon}")
+
+    k_weights    = get_k_weights(nK, k_lb, k_ub)
+    k_weights[0] = 0.0 # the k=0 term is the zonal mean
+    return k_weights
+
+def compute_qk_zonal_variance(qk_mode, nlon, k_lb=0, k_ub=None, ddof=1):
+    """
+    Calculates the zonal variance of the physical space values of qk_mode
+    (indexing [...,Re+Im,k_mode,vgrid_int,lat]) on a uniform full circle
+    grid of nlon longitudes, keeping only the k modes k_lb <= k <= k_ub.
+    Output indexing is [...,vgrid_int,lat].
+    """
+    nK        = qk_mode.shape[-3]
+    k_weights = get_variance_k_weights(nK, nlon, k_lb, k_ub)
+
+    qk_power = qk_mode[...,0,:,:,:]**2 + qk_mode[...,1,:,:,:]**2 # [...,k_mode,vgrid_int,lat]
+    return np.tensordot(qk_power, k_weights, axes=([-3],[0])) * nlon/(nlon - ddof)
+
+def get_qk_variance(qk_infile, nlon, components=None, k_lb=0, k_ub=None, ddof=1, levels=slice(None)):
+    """
+    Calculates the zonal variance of each component in qk_infile for the
+    pressure level indices levels (all by default) and every latitude, see
+    compute_qk_zonal_variance. components is a dictionary of lists of modes
+    keyed by component name, where the qk values of the listed modes are
+    added before the variance is taken, e.g. {'IG':['EIG','WIG'],
+    'ROT':['BAL']}. By default every qk_{mode} variable is its own
+    component.
+
+    Returns an xarray DataArray with dimensions (component, vgrid_int, lat),
+    with time after component if the qk file has a time dimension.
+    """
+    qk_ds = xa.open_dataset(qk_infile)
+    if components is None:
+        components = {name[3:]: [name[3:]] for name in qk_ds.data_vars if name.startswith('qk_')}
+
+    variance = []
+    for name, mode_list in components.items():
+        qk_sum = sum( qk_ds[f'qk_{imode}'][...,levels,:].values for imode in mode_list )
+        variance.append( compute_qk_zonal_variance(qk_sum, nlon, k_lb, k_ub, ddof) )
+
+    qk_var = qk_ds[f'qk_{components[list(components)[0]][0]}'][...,levels,:]
+    dims   = ['component'] + [dim for dim in qk_var.dims if dim not in ['Re+Im','k_mode']]
+    coords = {dim: qk_var[dim].values for dim in dims[1:] if dim in qk_var.coords}
+    qk_ds.close()
+
+    return xa.DataArray(np.array(variance), dims=dims, coords={'component': list(components), **coords}, name='q_variance',
+                        attrs={'long_name':'zonal variance of q', 'k_lb':k_lb, 'k_ub':-1 if k_ub is None else k_ub, 'ddof':ddof})
+
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# OUTPUT ENCODINGS
+#
+# By default the qk and qMODES files are uncompressed float64 with default
+# chunking. The output can instead be saved as float32, or as int16 scaled
+# by a per variable scale_factor and add_offset (netCDF packing, xarray
+# unpacks it when reading), compressed with zlib, and chunked for the way
+# the files are read, i.e. one pressure level (chunking='level'), one band
+# of latitudes (chunking='band'), or both (chunking='level_band') per
+# chunk. The encoding used is saved in the global attributes of the file.
+#
+# WARNING: int16 only has ~4.5 significant digits over the full range of
+# each variable, and needs the whole variable to set the scaling, so it
+# can't be used for the streamed output files.
+
+OUTPUT_DTYPES     = ['float64','float32','int16']
+OUTPUT_CHUNKINGS  = ['default','level','band','level_band']
+OUTPUT_LEVEL_DIMS = ['vgrid_int','plev']
+
+def add_output_encoding_args(parser):
+    '''adds the output encoding command line arguments to an argparse parser'''
+    parser.add_argument('--out_dtype', help='data type of the saved values (float64, float32, or int16 with a scale factor and offset)', choices=OUTPUT_DTYPES, default='float64')
+    parser.add_argument('--zlib', help='zlib compression level (1-9) of the saved values, 0 for no compression', type=int, default=0)
+    parser.add_argument('--chunking', help='chunk the saved values by single pressure level (level), by bands of latitude (band), by both (level_band), or use the default chunking (level_band for zarr stores)', choices=OUTPUT_CHUNKINGS, default='default')
+    parser.add_argument('--band_size', help='number of latitudes per chunk when --chunking band is used', type=int, default=32)
+
+def get_output_encoding_args(args):
+    '''returns the output encoding keyword arguments from parsed command line arguments (see add_output_encoding_args)'''
+    return {'dtype':args.out_dtype, 'complevel':args.zlib, 'chunking':args.chunking, 'band_size':args.band_size}
+
+def get_output_chunks(var_dims, var_shape, chunking='default', band_size=32):
+    '''returns the chunk shape of a variable for the given chunking, or None for the default chunking'''
+    if chunking == 'default': return None
+
+    chunks = list(var_shape)
+    for idim, dim in enumerate(var_dims):
+        if   chunking in ['level','level_band'] and dim in OUTPUT_LEVEL_DIMS: chunks[idim] = 1
+        elif chunking in ['band', 'level_band'] and dim == 'lat':             chunks[idim] = min(band_size, var_shape[idim])
+    return tuple(chunks)
+
+def get_int16_scaling(values):
+    '''returns the scale_factor, add_offset, and _FillValue packing values array into int16 (values are mapped to [-32766,32766])'''
+    vmin = float(np.nanmin(values))
+    vmax = float(np.nanmax(values))
+
+    scale_factor = (vmax - vmin) / (2*32766)
+    if scale_factor == 0.0: scale_factor = 1.0
+
+    return {'scale_factor':scale_factor, 'add_offset':(vmax + vmin)/2.0, '_FillValue':np.int16(-32768)}
+
+def get_output_encoding(ds, dtype='float64', complevel=0, chunking='default', band_size=32):
+    """
+    Returns the xarray encoding (for Dataset.to_netcdf) of every data
+    variable in ds (besides the noMRG flag) for the given output encoding.
+    """
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        if name == 'noMRG': continue
+
+        var_encoding = {'dtype':dtype}
+        if dtype == 'int16': var_encoding.update( get_int16_scaling(var.values) )
+        if complevel > 0:    var_encoding.update( {'zlib':True, 'complevel':complevel, 'shuffle':True} )
+
+        chunks = get_output_chunks(var.dims, var.shape, chunking, band_size)
+        if chunks is not None: var_encoding['chunksizes'] = chunks
+
+        encoding[name] = var_encoding
+
+    return encoding
+
+def get_encoding_attrs(dtype='float64', complevel=0, chunking='default', band_size=32):
+    '''returns the global attributes that record the output encoding'''
+    attrs = {'encoding_dtype'      : dtype,
+             'encoding_compression': f'zlib (level {complevel})' if complevel > 0 else 'none',
+             'encoding_chunking'   : chunking}
+    if chunking in ['band','level_band']: attrs['encoding_chunking'] += f' ({band_size} lat)'
+    return attrs
+
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# ZARR TIME STORES
+#
+# In place of one netCDF file per date, the qk and qMODES outputs can be
+# appended into a single zarr store per output type with a time dimension
+# (e.g. qmodes.zarr), which can then be opened lazily for a whole season,
+#
+#     ds = xa.open_dataset("qmodes.zarr", engine='zarr', chunks=None)
+#
+# Every date is its own time chunk (so rewriting a date only rewrites its
+# own chunks) and each date is further chunked by pressure level and bands
+# of latitude (chunking='level_band'), so both single date maps and long
+# time series at a single point only read a small part of the store.
+# Dates are appended in the order they are computed, so use sortby('time')
+# if they were not computed in order.
+#
+# NOTE: zarr is an optional dependency (pip install zarr), and only one
+# process should write to a store at a time.
+
+def get_date_time(date):
+    '''returns the time coordinate value of a YYYYMMDD date'''
+    return np.datetime64(datetime.strptime(date, "%Y%m%d"), 'ns')
+
+def get_zarr_encoding(ds, dtype='float64', chunking='level_band', band_size=32):
+    '''returns the xarray encoding for a zarr store of every data variable in ds (ds already has the time dimension, which is chunked by single dates)'''
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        if name == 'noMRG': continue
+        chunks = get_output_chunks(var.dims[1:], var.shape[1:], chunking, band_size)
+        if chunks is None: chunks = var.shape[1:]
+        encoding[name] = {'dtype':dtype, 'chunks':(1,) + tuple(chunks)}
+    return encoding
+
+def write_zarr_date(ds, store, date, dtype='float64', chunking='level_band', band_size=32):
+    """
+    Writes the single date output dataset ds (e.g. from make_qk_dataset)
+    into the zarr time store, creating the store if it doesn't exist yet.
+    A date that is already in the store is overwritten in place (only its
+    own time chunks are rewritten), otherwise the date is appended along
+    the time dimension. Every write must have the same data variables.
+    """
+    if importlib.util.find_spec('zarr') is None:
+        raise ImportError("writing zarr stores needs the zarr package (pip install zarr)")
+    if dtype == 'int16':
+        raise ValueError("int16 output can't be used for zarr stores since the scaling is fixed by the first date, use float32 instead")
+
+    ds = ds.expand_dims(time=[get_date_time(date)])
+
+    if not os.path.exists(store):
+        ds.attrs.update( get_encoding_attrs(dtype, 0, chunking, band_size) )
+        ds.attrs['encoding_compression'] = 'zarr default compressor'
+        ds.to_zarr(store, mode='w-', encoding=get_zarr_encoding(ds, dtype, chunking, band_size))
+        return
+
+    with xa.open_dataset(store, engine='zarr', chunks=None) as store_ds:
+        store_times = store_ds['time'].values
+        store_vars  = set(store_ds.data_vars)
+
+    if set(ds.data_vars) != store_vars:
+        raise ValueError(f"data variables {sorted(ds.data_vars)} don't match the variables {sorted(store_vars)} already in {store}")
+
+    itime = np.nonzero(store_times == ds['time'].values[0])[0]
+    if len(itime) > 0:
+        # only the time dependent variables are written for a region write
+        ds = ds.drop_vars([name for name in ds.variables if 'time' not in ds[name].dims])
+        ds.to_zarr(store, region={'time': slice(itime[0], itime[0] + 1)})
+    else:
+        ds.to_zarr(store, append_dim='time')
+
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# STREAMED OUTPUT FILES
+#
+# Output files that are written one block (e.g. a chunk of pressure levels)
+# at a time, so the full output never has to be held in memory. The files
+# are written with h5netcdf and can be read back with xarray as usual.
+
+def create_streamed_outfile(outfile, dims, coords, data_vars, attrs, dtype='float64', complevel=0, chunking='default', band_size=32):
+    """
+    Creates (overwriting) the netCDF file outfile with empty data variables
+    that can then be filled in one block at a time, e.g.
+
+        ds = create_streamed_outfile(...)
+        ds['q_EIG'][i0:i1,:,:] = q_block
+        ds.close()
+
+    dims is a dictionary of dimension sizes for dimensions without
+    coordinates, coords is a dictionary of coordinate values, data_vars is
+    a dictionary of (dims, attrs) tuples keyed by variable name, and attrs
+    are the global attributes. The remaining arguments set the output
+    encoding (see OUTPUT ENCODINGS, int16 is not supported). Returns the
+    open h5netcdf file.
+    """
+    if dtype == 'int16':
+        raise ValueError("int16 output needs the full data range for the scaling and can't be used for streamed output files, use float32 instead")
+
+    ds = h5netcdf.File(outfile, 'w')
+
+    for name, size in dims.items():
+        ds.dimensions[name] = size
+
+    for name, values in coords.items():
+        values = np.asarray(values)
+        ds.dimensions[name] = len(values)
+        if np.issubdtype(values.dtype, np.datetime64):
+            # times are saved with CF units the same way xarray saves them
+            [values, units, calendar] = xa.coding.times.encode_cf_datetime(values)
+            var = ds.create_variable(name, (name,), data=values)
+            var.attrs.update({'units':units, 'calendar':calendar})
+        else:
+            ds.create_variable(name, (name,), data=values)
+
+    for name, (var_dims, var_attrs) in data_vars.items():
+        var_shape  = tuple(ds.dimensions[dim].size for dim in var_dims)
+        var_kwargs = {'chunks': get_output_chunks(var_dims, var_shape, chunking, band_size)}
+        if complevel > 0: var_kwargs.update( {'compression':'gzip', 'compression_opts':complevel, 'shuffle':True} )
+
+        var = ds.create_variable(name, var_dims, np.dtype(dtype), **var_kwargs)
+        var.attrs.update(var_attrs)
+
+    ds.attrs.update(attrs)
+    ds.attrs.update( get_encoding_attrs(dtype, complevel, chunking, band_size) )
+
+    return ds
+
+def get_qmodes_block_size(mem_budget_mb, nK, nrow, nlon):
+    """
+    Returns the number of pressure levels (or latitudes) of a single mode
+    that can be synthesized at a time within mem_budget_mb (in MB), where
+    nrow is the size of the other (not blocked) dimension. Per level (or
+    latitude) the qk block takes 2*nK*nrow float64 values, the padded
+    complex FFT input and its copies about (2*nK + nlon)*nrow complex128
+    values, and the output nrow*nlon float64 values.
+    """
+    bytes_per_row = nrow * ( 2*8*nK + 16*(2*nK + nlon) + 8*nlon )
+    return max(1, int( mem_budget_mb*1.0e6 // bytes_per_row ))
+
+def add_noMRG_flag(ds):
+    '''adds the noMRG flag variable (stored the same way xarray stores the True flag in Calculate_qk.py) to a streamed output file'''
+    var = ds.create_variable('noMRG', (), np.int8, data=np.int8(1))
+    var.attrs['dtype'] = 'bool'
+
+def get_qk_streamed_layout(qk_names, nK, vgrid_int, lat):
+    '''returns the (dims, coords, data_vars) layout of a streamed qk file with the variables qk_{name}'''
+    dims      = {'Re+Im': 2}
+    coords    = {'k_mode': np.array(range(nK)), 'vgrid_int': vgrid_int, 'lat': lat}
+    data_vars = {f'qk_{name}': (('Re+Im', 'k_mode', 'vgrid_int', 'lat'), {'long_name':f'{name} Part of specific humidity'}) for name in qk_names}
+    return dims, coords, data_vars
+
+def get_qmodes_streamed_layout(mode_names, plev, lat, lon, time=None):
+    '''returns the (dims, coords, data_vars) layout of a streamed qMODES file with the variables q_{name} (with a leading time dimension if time is given)'''
+    dims      = {}
+    coords    = {'plev': plev, 'lat': lat, 'lon': lon}
+    var_dims  = ('plev', 'lat', 'lon')
+    if time is not None:
+        coords   = {'time': time, **coords}
+        var_dims = ('time',) + var_dims
+    data_vars = {f'q_{name}': (var_dims, {'long_name':f'{name} Part of q'}) for name in mode_names}
+    return dims, coords, data_vars
+
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# DATE HELPERS
+
+def get_date_list(dates):
+    """
+    Converts a dates string into a list of YYYYMMDD dates. The string is a
+    comma separated list of dates and/or date ranges, where a range
+    YYYYMMDD-YYYYMMDD includes every day from the first to the last date,
+    e.g. "20200101,20200105-20200107" gives
+    ['20200101', '20200105', '20200106', '20200107'].
+    """
+    date_list = []
+    for item in dates.split(','):
+        if '-' in item:
+            [start, end] = [datetime.strptime(i.strip(), "%Y%m%d") for i in item.split('-')]
+            date_list += [(start + timedelta(days=i)).strftime("%Y%m%d") for i in range((end - start).days + 1)]
+        else:
+            date_list.append( datetime.strptime(item.strip(), "%Y%m%d").strftime("%Y%m%d") )
+    return date_list
+
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# OUTPUT DATASETS
+
+def make_qk_dataset(qk, lat, vgrid_int, attrs, noMRG=False, time=None):
+    """
+    Builds the qk output dataset. qk is a dictionary of [Re+Im,k_mode,vgrid_int,lat]
+    arrays keyed by mode, each of which is saved as the variable qk_{mode}.
+    If time is given the arrays are [time,Re+Im,k_mode,vgrid_int,lat].
+    """
+    nK = list(qk.values())[0].shape[-3]
+
+    coords    = {'k_mode'    : ( ['k_mode'    ], np.array(range(nK)) ),
+                 'vgrid_int' : ( ['vgrid_int' ], vgrid_int           ),
+                 'lat'       : ( ['lat'       ], lat                 )  }
+
+    var_dims  = ['Re+Im', 'k_mode', 'vgrid_int', 'lat']
+    if time is not None:
+        coords['time'] = ( ['time'], time )
+        var_dims       = ['time'] + var_dims
+
+    data_vars = {f'qk_{imode}' :(var_dims, qk[imode],
+                        { 'long_name':f'{imode} Part of specific humidity'}) for imode in qk }
+
+    if noMRG:
+        data_vars.update({'noMRG':True})
+
+    return xa.Dataset(data_vars=data_vars,
+                      coords=coords,
+                      attrs=attrs)
+
+#-------------------------------------------------------------------------
+
+
+
+#-------------------------------------------------------------------------
+# RUN STATISTICS (INSTRUMENTATION)
+#
+# Lightweight timing and I/O counters for the qk and qMODES scripts, so a
+# slow production run can be traced to the hough reads, the contractions
+# (BLAS), or the netCDF writes. The counters are kept in _run_stats:
+#
+#     stages  : {stage: {'time_s', 'calls'}}            compute/write time
+#     inputs  : {input: {'bytes', 'time_s', 'files'}}   open + read of each input type
+#     k_slabs : {k: time_s}                              read + compute time of each k slab
+#
+# The qk engine records the hough (or operator) reads, the per k slab
+# times, and the 'qk_compute' stage itself (parallel workers send their
+# counters back with each slab). The scripts record the other inputs and
+# stages and then save the counters, together with the peak RSS, as a
+# JSON sidecar next to each output file (outfile + ".stats.json") and as
+# a summary in the global attributes of the output file.
+#
+# NOTE: the attributes are written with the file, so they don't include
+# the time to write that file, which is only in the JSON sidecar.
+
+_run_stats = {'stages':{}, 'inputs':{}, 'k_slabs':{}}
+
+def reset_run_stats():
+    '''clears all of the run statistics'''
+    for key in _run_stats: _run_stats[key].clear()
+
+def add_stage_time(stage, seconds, calls=1):
+    '''adds seconds of compute (or write) time to stage'''
+    record = _run_stats['stages'].setdefault(stage, {'time_s':0.0, 'calls':0})
+    record['time_s'] += seconds
+    record['calls']  += calls
+
+def add_input_read(name, nbytes, seconds, files=1):
+    '''adds a read of nbytes taking seconds from files of input type name (e.g. hough, coef, vsf_int, ERA, qk)'''
+    record = _run_stats['inputs'].setdefault(name, {'bytes':0, 'time_s':0.0, 'files':0})
+    record['bytes']  += int(nbytes)
+    record['time_s'] += seconds
+    record['files']  += files
+
+def add_k_slab_time(kk, seconds):
+    '''records the read + compute time of the k slab kk'''
+    _run_stats['k_slabs'][int(kk)] = _run_stats['k_slabs'].get(int(kk), 0.0) + seconds
+
+@contextmanager
+def timed_stage(stage):
+    '''context manager that adds the time spent inside it to stage, e.g. with timed_stage('write'): ds.to_netcdf(...)'''
+    tic = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage_time(stage, time.perf_counter() - tic)
+
+def merge_run_stats(stats):
+    '''adds the counters of another _run_stats like dictionary (e.g. from a worker process) to the run statistics'''
+    for stage, record in stats['stages'].items(): add_stage_time(stage, record['time_s'], record['calls'])
+    for name,  record in stats['inputs'].items(): add_input_read(name, record['bytes'], record['time_s'], record['files'])
+    for kk,    seconds in stats['k_slabs'].items(): add_k_slab_time(kk, seconds)
+
+def copy_run_stats():
+    '''returns a copy of the run statistics counters'''
+    return {key: {name: (dict(value) if isinstance(value, dict) else value) for name, value in _run_stats[key].items()} for key in _run_stats}
+
+def get_peak_rss_mb():
+    '''returns the peak resident memory (in MB) of this process and of its finished child processes (worker pools), None if it is not available'''
+    if importlib.util.find_spec('resource') is None: return None
+    import resource
+
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    scale = 1.0e-6 if os.uname().sysname == 'Darwin' else 1.0e-3
+    return {'self'    : resource.getrusage(resource.RUSAGE_SELF    ).ru_maxrss * scale,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale}
+
+def get_run_stats(script=None, extra=None):
+    '''returns the run statistics as a JSON serializable dictionary, with the peak RSS and a summary of the k slab times'''
+    stats = copy_run_stats()
+    stats['k_slabs'] = {str(kk): round(seconds, 6) for kk, seconds in sorted(stats['k_slabs'].items())}
+
+    k_times = np.array(list(stats['k_slabs'].values()))
+    summary = {'peak_rss_mb' : get_peak_rss_mb(),
+               'total_read_s': sum(record['time_s'] for record in stats['inputs'].values()),
+               'total_read_mb': sum(record['bytes'] for record in stats['inputs'].values()) / 1.0e6}
+    if len(k_times) > 0:
+        summary.update( {'k_slab_mean_s': float(np.mean(k_times)), 'k_slab_max_s': float(np.max(k_times)),
+                         'k_slab_max_k' : int(list(stats['k_slabs'])[np.argmax(k_times)])} )
+
+    return {'script' : script,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'host'   : os.uname().nodename,
+            **(extra if extra is not None else {}),
+            'summary': summary,
+            **stats}
+
+def get_run_stats_attrs():
+    """
+    Returns a summary of the run statistics as netCDF global attributes,
+    i.e. the time and MB read for each input (stats_read_{input}_s and
+    stats_read_{input}_mb), the time of each stage (stats_{stage}_s), the
+    slowest k slab, and the peak RSS.
+    """
+    stats = get_run_stats()
+    attrs = {}
+    for name, record in stats['inputs'].items():
+        attrs[f'stats_read_{name}_s']  = round(record['time_s'], 4)
+        attrs[f'stats_read_{name}_mb'] = round(record['bytes'] / 1.0e6, 3)
+    for stage, record in stats['stages'].items():
+        attrs[f'stats_{stage}_s'] = round(record['time_s'], 4)
+    if 'k_slab_max_s' in stats['summary']:
+        attrs['stats_k_slab_max_s'] = round(stats['summary']['k_slab_max_s'], 4)
+        attrs['stats_k_slab_max_k'] = stats['summary']['k_slab_max_k']
+    if stats['summary']['peak_rss_mb'] is not None:
+        attrs['stats_peak_rss_mb'] = round(max(stats['summary']['peak_rss_mb'].values()), 1)
+    return attrs
+
+def get_run_stats_file(outfile):
+    '''returns the JSON sidecar file name for an output file (or zarr store)'''
+    return outfile.rstrip('/') + ".stats.json"
+
+def write_run_stats(outfile, script=None, extra=None):
+    '''saves the run statistics as a JSON sidecar next to outfile, returns the sidecar file name'''
+    stats_file = get_run_stats_file(outfile)
+    with open(stats_file, 'w') as f: json.dump(get_run_stats(script, {'outfile':outfile, **(extra if extra is not None else {})}), f, indent=2)
+    return stats_file
+
+#-------------------------------------------------------------------------
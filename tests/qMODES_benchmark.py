@@ -0,0 +1,590 @@
+#--------------------------------------------------------------------------
+# File:          qMODES_benchmark.py
+# Author:        Bradley Kumm (bkumm@wisc.edu)
+# Last Modified: 2026/10/18 (YYYY/MM/DD)
+# Description:   Benchmark suite for the main qMODES computations. For each
+#                requested size the script generates synthetic (random) but
+#                correctly shaped inputs (hough, coefficient, vsf, vsf_int,
+#                and ERA q files) in the same directory layout as the
+#                package, and then times
+#
+#                    Calculate_qk.py (-m ALL, --dates in batches, --levels,
+#                                     --plevs, and with --hough_store and
+#                                     --operator)
+#                    Calculate_qMODES.py (and --noMRG, --k_bands, --lev)
+#                    Calculate_Integrated_VSFs.py
+#                    Deriv / Deriv_Along_Axis
+#                    the OmegaMODES_Functions decomposition readers
+#                    the qMODES_Functions qk readers (get_qk_variance)
+#                    the qk band spectra (get_qk_band_spectra)
+#                    the variance profiles (get_lat_variance_profiles)
+#                    the qMODES lat/lon window (get_qmodes_window)
+#                    the point profiles (get_qmodes_point_profiles, and
+#                                        Extract_qMODES_Points.py)
+#
+#                On the small sizes the outputs are also checked against
+#                the original loop implementations (reference_* below).
+#                The results are saved to a JSON file that can be passed
+#                back in with --compare to check for regressions.
+#
+# Notes:         Run from the tests directory, e.g.
+#                    python qMODES_benchmark.py --sizes tiny,small
+#                The tiny size is also run by test_qMODES_benchmark.py
+#                (python -m pytest tests).
+#                WARNING!!! The full size (F320, 351 k, 60 m, 200 n, 137
+#                levels) needs ~200 GB of disk for the hough files alone,
+#                so it is only run if asked for explicitly.
+#
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#IMPORTS
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy    as np
+import xarray   as xa
+from datetime import datetime
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#READING IN COMMAND LINE ARGUMENTS
+
+parser = argparse.ArgumentParser(description="This script benchmarks the qMODES computations on synthetic inputs")
+parser.add_argument('--sizes', help='comma separated list of sizes to run (tiny, small, medium, full)', default='tiny,small')
+parser.add_argument('--results', help='JSON file to save the results to (default qMODES_benchmark_results.json in --workdir, or in output_data if no --workdir is given)', default=None)
+parser.add_argument('--compare', help='previous results JSON file to compare the timings against', default=None)
+parser.add_argument('--tolerance', help='slow down (ratio to the --compare timings) that is reported as a regression', type=float, default=1.25)
+parser.add_argument('--workdir', help='directory to generate the synthetic inputs in (default a temporary directory that is removed at the end)', default=None)
+parser.add_argument('-n', '--nrepeat', help='number of times to repeat the in-process benchmarks (the best time is reported)', type=int, default=3)
+args = parser.parse_args()
+
+size_list = args.sizes.split(',')
+nrepeat   = args.nrepeat
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#BENCHMARK SIZES AND CONSTANTS
+
+# (nK, nM, nN, nlat, nlon, nplev) for each size
+SIZES = {'tiny'  : (  6,  4,   6,   8,   16,   7),
+         'small' : ( 32,  8,  20,  32,   64,  16),
+         'medium': (128, 30, 100, 160,  320,  60),
+         'full'  : (351, 60, 200, 640, 1280, 137)}
+
+# sizes that are small enough to check against the (slow) loop implementations
+CHECK_SIZES = ['tiny','small']
+
+# largest qk operator (all modes and levels) that is built for the --operator benchmark
+operator_max_gb = 1.0
+
+# Calculate_Integrated_VSFs.py is hard coded to 60 modes and 137 levels
+vsf_nM    = 60
+vsf_nplev = 137
+
+Mode_list = ['EIG','WIG','BAL']
+date      = "20200101"
+date_list = ["20200101", "20200102", "20200103"] # dates with coefficient files (for the --dates checks)
+
+repo_dir = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+results_file = args.results
+if results_file is None:
+    results_dir  = args.workdir if args.workdir is not None else os.path.join(repo_dir, 'output_data')
+    results_file = os.path.join(results_dir, 'qMODES_benchmark_results.json')
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# SYNTHETIC INPUTS
+
+def make_synthetic_inputs(base_dir, nK, nM, nN, nlat, nlon, nplev, seed=0):
+    """
+    Creates the input_data and output_data directories under base_dir with
+    random hough, coefficient, vsf, vsf_int, and ERA q files of the given
+    size, and copies the scripts to base_dir/src so the scripts' relative
+    paths point at the synthetic data.
+    """
+    rng = np.random.default_rng(seed)
+
+    for data_dir in ['input_data/MODES_data/hough', 'input_data/MODES_data/coef', 'input_data/MODES_data/vsf',
+                     'input_data/MODES_data/vsf_int', 'input_data/ERA_Data']:
+        os.makedirs(os.path.join(base_dir, data_dir), exist_ok=True)
+
+    shutil.copytree(os.path.join(repo_dir, 'src'), os.path.join(base_dir, 'src'), dirs_exist_ok=True,
+                    ignore=shutil.ignore_patterns('__pycache__'))
+
+    # MODES lat runs north to south, ERA lat south to north (the MODES data is flipped when compared)
+    lat  = np.linspace(90.0, -90.0, nlat+2)[1:-1]
+    lon  = np.arange(nlon) * 360.0 / nlon
+    plev = np.linspace(100.0, 100000.0, nplev)
+
+    # hough files, indexing is [m,component,lat,n]
+    hough_dir = os.path.join(base_dir, 'input_data/MODES_data/hough')
+    for kk in range(nK):
+        hough_ds = xa.Dataset({imode: (['m','component','lat','n'], rng.standard_normal((nM,3,nlat,nN))) for imode in Mode_list},
+                              coords={'lat': lat})
+        hough_ds.to_netcdf(os.path.join(hough_dir, f"hough_F320_M60.wn00{kk:03d}.nc"))
+    shutil.copy(os.path.join(hough_dir, "hough_F320_M60.wn00000.nc"), os.path.join(hough_dir, "...SAMPLE_HOUGH_FILE.wn00000.nc"))
+
+    # coefficient files, indexing is [time,Re+Im,k,m,n]
+    for coef_date in date_list:
+        coef_ds = xa.Dataset({imode: (['time','Re+Im','k','m','n'], rng.standard_normal((1,2,nK,nM,nN))) for imode in Mode_list})
+        coef_ds.to_netcdf(os.path.join(base_dir, f'input_data/MODES_data/coef/Hough_coeff_M60_F320_{coef_date}0000000.nc'))
+
+    # vsf file (surface to top of the atmosphere) and vsf_int file
+    vgrid  = np.linspace(100000.0, 100.0, vsf_nplev)
+    vsf_ds = xa.Dataset({'vsf': (['num_vmode','vgrid'], rng.standard_normal((vsf_nM,vsf_nplev)))}, coords={'vgrid': vgrid})
+    vsf_ds.to_netcdf(os.path.join(base_dir, 'input_data/MODES_data/vsf/vsf.data.nc'))
+
+    vsf_int_ds = xa.Dataset({'vsf_int': (['num_vmode','vgrid_int'], rng.standard_normal((nM,nplev)))},
+                            coords={'vgrid_int': plev, 'vmodes': np.arange(nM)})
+    vsf_int_ds.to_netcdf(os.path.join(base_dir, 'input_data/MODES_data/vsf_int/vsf_int.data.nc'))
+
+    # ERA q file, indexing is [time,plev,lat,lon]
+    ERA_ds = xa.Dataset({'q': (['time','plev','lat','lon'], 1.0e-3 * rng.random((1,nplev,nlat,nlon)))},
+                        coords={'plev': plev, 'lat': lat[::-1], 'lon': lon})
+    ERA_ds.to_netcdf(os.path.join(base_dir, 'input_data/ERA_Data/ERA_FILE_HERE.nc'))
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# REFERENCE (ORIGINAL LOOP) IMPLEMENTATIONS
+
+def reference_qk(coefs, hough_dir, vsf_int, mode, n_lb, nK, nM, nN, nplev, nlat):
+    '''original Calculate_qk.py loop, coefs indexing is [Re+Im,k,m,n]'''
+    qk = np.zeros((2, nK, nplev, nlat))
+    for kk in range(nK):
+        hough = xa.open_dataset(os.path.join(hough_dir, f"hough_F320_M60.wn00{kk:03d}.nc"))[mode].values
+        for iplev in range(nplev):
+            for mm in range(nM):
+                RE_inner_sum = 0
+                IM_inner_sum = 0
+                for nn in range(n_lb,nN):
+                    RE_inner_sum += coefs[0,kk,mm,nn] * hough[mm,2,:,nn]
+                    IM_inner_sum += coefs[1,kk,mm,nn] * hough[mm,2,:,nn]
+                qk[0,kk,iplev,:] += vsf_int[mm,iplev] * RE_inner_sum
+                qk[1,kk,iplev,:] += vsf_int[mm,iplev] * IM_inner_sum
+    return qk
+
+def reference_qmodes(qk_mode, lon, k_lb):
+    '''original Calculate_qMODES.py loop, qk_mode indexing is [Re+Im,k,plev,lat]'''
+    nK     = qk_mode.shape[1]
+    q_mode = np.zeros(qk_mode.shape[2:] + (len(lon),))
+    for ilon in range(len(lon)):
+        k_lb_ilon = k_lb
+        if k_lb_ilon == 0:
+            q_mode[:,:,ilon] += qk_mode[0,0,:,:]
+            k_lb_ilon += 1
+        for kk in range(k_lb_ilon,nK):
+            q_mode[:,:,ilon] += 2.0 * ( qk_mode[0,kk,:,:] * np.cos(float(kk) * np.radians(lon[ilon])) - qk_mode[1,kk,:,:] * np.sin(float(kk) * np.radians(lon[ilon])) )
+    return q_mode
+
+def reference_vsf_int(vsf, vgrid):
+    '''original Calculate_Integrated_VSFs.py loop'''
+    ps0 = 101325
+    mp  = len(vgrid)
+    vsfint_temp = np.zeros([vsf_nM,mp+1])
+
+    dz = np.zeros(mp+1)
+    for k in range(1,mp):
+        dz[k] = vgrid[k - 1] - vgrid[k]
+    dz[mp] = 2.0 * vgrid[mp-1]
+    dz[0]  = 2.0 * (ps0-vgrid[0])
+
+    for k in range(1,mp+1):
+        dp = 0.5 * (dz[mp - k] + dz[mp + 1 - k])
+        for m in range(0,vsf_nM):
+            vsfint_temp[m,k] = vsfint_temp[m,k - 1] + vsf[m,mp - k] * dp
+    return vsfint_temp[:,1:]
+
+def reference_single_plev_p_and_lat(OmegaMODES, ERA_datafile, MODES_datafile, iplev):
+    '''original get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background loops'''
+    ERA_ds   = xa.open_dataset(ERA_datafile)
+    MODES_ds = xa.open_dataset(MODES_datafile)
+
+    qERA  = ERA_ds['q'].values[0,:,:,:]
+    plev  = ERA_ds['plev'].values
+    [nplev, nlat, nlon] = qERA.shape
+
+    qbkg       = np.mean(qERA, axis=2)
+    qbkg_deriv = np.zeros((nplev,nlat))
+    for ilat in range(nlat):
+        qbkg_deriv[:,ilat] = OmegaMODES.Deriv(plev,qbkg[:,ilat])
+
+    qERA = qERA[iplev,:,:]
+    q_modes = {}
+    for imode in Mode_list:
+        q_modes[imode] = np.zeros((nlat,nlon))
+        for ilat in range(nlat):
+            q_modes[imode][ilat,:] = qbkg_deriv[iplev,ilat] * np.flip( MODES_ds[f'q_{imode}'].values[iplev,:,:], axis=0 )[ilat,:]
+    for ilat in range(nlat):
+        qERA[ilat,:] = qERA[ilat,:] - qbkg[iplev,ilat]
+
+    qM = qERA - q_modes['EIG'] - q_modes['WIG'] - q_modes['BAL']
+    return np.array([qERA, q_modes['EIG'], q_modes['WIG'], q_modes['BAL'], qM])
+
+def reference_point_profiles(q_datafile, point_index):
+    '''[point,plev,component] profiles from the full qMODES field, point_index is a list of (lat indices to average, lon index)'''
+    q_ds   = xa.open_dataset(q_datafile)
+    q_full = np.stack([q_ds[f'q_{imode}'].values for imode in Mode_list], axis=-1) # indexing is [plev,lat,lon,component]
+    q_ds.close()
+    return np.array([np.mean(q_full[:,ilat_list,ilon], axis=1) for ilat_list, ilon in point_index])
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# TIMING HELPERS
+
+def run_script(script_dir, script, script_args):
+    '''runs a script in script_dir and returns the wall time and the "time to complete main loop" time (both in s)'''
+    tic    = time.perf_counter()
+    result = subprocess.run([sys.executable, script] + script_args, cwd=script_dir, capture_output=True, text=True)
+    toc    = time.perf_counter()
+
+    if result.returncode != 0:
+        raise RuntimeError(f"{script} {' '.join(script_args)} failed:\n{result.stdout}\n{result.stderr}")
+
+    main_loop = re.search(r"time to complete main loop = ([0-9.eE+-]+) min", result.stdout)
+    timing    = {'wall_s': round(toc - tic, 4)}
+    if main_loop is not None: timing['main_loop_s'] = round(float(main_loop.group(1)) * 60.0, 4)
+    return timing
+
+def time_call(func, *func_args, **func_kwargs):
+    '''returns the best time (in s) of nrepeat calls of func'''
+    times = []
+    for i in range(nrepeat):
+        tic = time.perf_counter()
+        func(*func_args, **func_kwargs)
+        times.append(time.perf_counter() - tic)
+    return {'best_s': round(min(times), 6)}
+
+def max_abs_err(a, b):
+    '''returns the largest absolute difference relative to the largest absolute value of b'''
+    return float( np.max(np.abs(np.asarray(a) - np.asarray(b))) / max(np.max(np.abs(b)), 1.0e-300) )
+
+def read_qk_date(base_dir, qk_date):
+    '''returns the [qk datasets, run statistics] of the qk and qk_noMRG files of qk_date (loaded, so the files can be written over)'''
+    qk_files = [os.path.join(base_dir, f'output_data/qk_data/qk{tag}_{qk_date}0000000.nc') for tag in ['', '_noMRG']]
+    qk_stats = []
+    for qk_file in qk_files:
+        with open(qk_file + '.stats.json') as f: qk_stats.append(json.load(f))
+    return [[xa.load_dataset(qk_file) for qk_file in qk_files], qk_stats]
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# RUNNING THE BENCHMARKS
+
+def run_size(size, base_dir):
+    '''generates the inputs for size in base_dir and returns the (timings, checks) dictionaries'''
+    [nK, nM, nN, nlat, nlon, nplev] = SIZES[size]
+    timings = {}
+    checks  = {}
+
+    tic = time.perf_counter()
+    make_synthetic_inputs(base_dir, nK, nM, nN, nlat, nlon, nplev)
+    timings['make_inputs'] = {'wall_s': round(time.perf_counter() - tic, 4)}
+
+    qMODES_script_dir   = os.path.join(base_dir, 'src', 'qMODES_scripts')
+    plotting_script_dir = os.path.join(base_dir, 'src', 'plotting_scripts')
+
+    # Main scripts
+    timings['Calculate_Integrated_VSFs'] = run_script(qMODES_script_dir, 'Calculate_Integrated_VSFs.py', [])
+    # the integration writes over vsf_int with 137 levels, so the synthetic vsf_int is kept in a copy
+    vsf_int_file = os.path.join(base_dir, 'input_data/MODES_data/vsf_int/vsf_int.data.nc')
+    vsf_int_calc = xa.load_dataset(vsf_int_file)
+    make_vsf_int = xa.Dataset({'vsf_int': (['num_vmode','vgrid_int'], np.random.default_rng(1).standard_normal((nM,nplev)))},
+                              coords={'vgrid_int': np.linspace(100.0, 100000.0, nplev), 'vmodes': np.arange(nM)})
+    make_vsf_int.to_netcdf(vsf_int_file)
+
+    timings['Calculate_qk_ALL']         = run_script(qMODES_script_dir, 'Calculate_qk.py',     ['-d', date, '-m', 'ALL'])
+    timings['Calculate_qMODES']         = run_script(qMODES_script_dir, 'Calculate_qMODES.py', ['-d', date])
+    timings['Calculate_qMODES_noMRG']   = run_script(qMODES_script_dir, 'Calculate_qMODES.py', ['-d', date, '--noMRG'])
+
+    # In-process benchmarks of the derivative and decomposition readers
+    sys.path.insert(0, plotting_script_dir)
+    import OmegaMODES_Functions as OmegaMODES
+    sys.path.remove(plotting_script_dir)
+    OmegaMODES.q_data_cache_dir  = None # timing the computation, not the cache
+    OmegaMODES.q_data_cache_mb   = 0
+
+    sys.path.insert(0, qMODES_script_dir)
+    import qMODES_Functions as qMODES
+    sys.path.remove(qMODES_script_dir)
+
+    ERA_datafile   = os.path.join(base_dir, 'input_data/ERA_Data/ERA_FILE_HERE.nc')
+    MODES_datafile = os.path.join(base_dir, f'output_data/qMODES_Data/qmodes_{date}0000000.nc')
+    plev = xa.open_dataset(ERA_datafile)['plev'].values
+    qbkg = np.mean(xa.open_dataset(ERA_datafile)['q'].values[0], axis=2)
+    iplev = nplev // 2
+
+    timings['Deriv_loop_over_lat'] = time_call(lambda: [OmegaMODES.Deriv(plev, qbkg[:,ilat]) for ilat in range(nlat)])
+    timings['Deriv_Along_Axis']    = time_call(OmegaMODES.Deriv_Along_Axis, plev, qbkg, axis=0)
+    timings['get_single_plev_q_data']                = time_call(OmegaMODES.get_single_plev_ERA_and_flippedMODES_q_data, ERA_datafile, MODES_datafile, iplev)
+    timings['get_single_plev_q_data_p_and_lat_bkg']  = time_call(OmegaMODES.get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background, ERA_datafile, MODES_datafile, iplev)
+    timings['get_full_field_q_data']                 = time_call(OmegaMODES.get_full_field_ERA_and_flippedMODES_q_data, ERA_datafile, MODES_datafile)
+    timings['get_full_field_q_data_p_and_lat_bkg']   = time_call(OmegaMODES.get_full_field_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background, ERA_datafile, MODES_datafile)
+
+    # Checking against the original loop implementations
+    if size in CHECK_SIZES:
+        hough_dir = os.path.join(base_dir, 'input_data/MODES_data/hough')
+        coef_ds   = xa.open_dataset(os.path.join(base_dir, f'input_data/MODES_data/coef/Hough_coeff_M60_F320_{date}0000000.nc'))
+        qk_ds     = xa.open_dataset(os.path.join(base_dir, f'output_data/qk_data/qk_{date}0000000.nc'))
+        qk_noMRG_ds = xa.open_dataset(os.path.join(base_dir, f'output_data/qk_data/qk_noMRG_{date}0000000.nc'))
+        vsf_int   = make_vsf_int['vsf_int'].values
+
+        for imode in Mode_list:
+            qk_ref = reference_qk(coef_ds[imode].values[0], hough_dir, vsf_int, imode, 0, nK, nM, nN, nplev, nlat)
+            checks[f'qk_{imode}'] = max_abs_err(qk_ds[f'qk_{imode}'].values, qk_ref)
+        qk_ref = reference_qk(coef_ds['BAL'].values[0], hough_dir, vsf_int, 'BAL', 1, nK, nM, nN, nplev, nlat)
+        checks['qk_BAL_noMRG'] = max_abs_err(qk_noMRG_ds['qk_BAL'].values, qk_ref)
+
+        lon      = xa.open_dataset(ERA_datafile)['lon'].values
+        q_ds     = xa.open_dataset(MODES_datafile)
+        for imode in Mode_list:
+            checks[f'q_{imode}'] = max_abs_err(q_ds[f'q_{imode}'].values, reference_qmodes(qk_ds[f'qk_{imode}'].values, lon, 0))
+
+        vsf_ds = xa.open_dataset(os.path.join(base_dir, 'input_data/MODES_data/vsf/vsf.data.nc'))
+        checks['vsf_int'] = max_abs_err(vsf_int_calc['vsf_int'].values, reference_vsf_int(vsf_ds['vsf'].values, vsf_ds['vgrid'].values))
+
+        deriv_ref = np.array([OmegaMODES.Deriv(plev, qbkg[:,ilat]) for ilat in range(nlat)]).T
+        checks['Deriv_Along_Axis'] = max_abs_err(OmegaMODES.Deriv_Along_Axis(plev, qbkg, axis=0), deriv_ref)
+
+        checks['get_single_plev_q_data_p_and_lat_bkg'] = max_abs_err(
+            OmegaMODES.get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background(ERA_datafile, MODES_datafile, iplev),
+            reference_single_plev_p_and_lat(OmegaMODES, ERA_datafile, MODES_datafile, iplev))
+
+        # zonal variance from the qk power (Parseval) against the variance of the synthesized field
+        qk_datafile = os.path.join(base_dir, f'output_data/qk_data/qk_{date}0000000.nc')
+        q_variance  = qMODES.get_qk_variance(qk_datafile, nlon, {**{imode: [imode] for imode in Mode_list}, 'IG': ['EIG','WIG']})
+        q_var_ref   = [np.var(q_ds[f'q_{imode}'].values, axis=-1, ddof=1) for imode in Mode_list] \
+                    + [np.var(q_ds['q_EIG'].values + q_ds['q_WIG'].values, axis=-1, ddof=1)]
+        checks['get_qk_variance'] = max_abs_err(q_variance.values, np.array(q_var_ref))
+        timings['get_qk_variance'] = time_call(qMODES.get_qk_variance, qk_datafile, nlon)
+
+        # latitude band spectra from qk against the rfft of the band means of the synthesized field
+        bands      = {'NH':(10.0,90.0), 'Tropics':(-30.0,30.0), 'SH':(-90.0,-10.0)}
+        lat_scale  = np.random.default_rng(2).random((nplev,nlat))
+        components = {**{imode: [imode] for imode in Mode_list}, 'IG': ['EIG','WIG']}
+        q_data     = np.array([sum(q_ds[f'q_{imode}'].values for imode in mode_list) for mode_list in components.values()]) * lat_scale[...,None]
+        amplitudes = OmegaMODES.get_qk_band_spectra(qk_datafile, bands, components, lat_scale=lat_scale)
+        checks['get_qk_band_spectra'] = max_abs_err(amplitudes.values, OmegaMODES.get_band_spectra(q_data, q_ds['lat'].values, bands)[1][...,:nK])
+        timings['get_qk_band_spectra'] = time_call(OmegaMODES.get_qk_band_spectra, qk_datafile, bands)
+
+        # latitude variance profiles of several levels at once against the single level readers
+        plev_list     = [0, iplev, nplev-1]
+        single_reader = {'p'        : OmegaMODES.get_single_plev_ERA_and_flippedMODES_q_data,
+                         'p_and_lat': OmegaMODES.get_single_plev_ERA_and_flippedMODES_q_data_with_p_and_lat_dependent_background}
+        checks['get_lat_variance_profiles'] = max(
+            max_abs_err(OmegaMODES.get_lat_variance_profiles(ERA_datafile, MODES_datafile, plev_list, bkg_type=bkg_type).values,
+                        np.stack([np.var(single_reader[bkg_type](ERA_datafile, MODES_datafile, jplev), axis=-1, ddof=1) for jplev in plev_list], axis=1))
+            for bkg_type in single_reader)
+        timings['get_lat_variance_profiles'] = time_call(OmegaMODES.get_lat_variance_profiles, ERA_datafile, MODES_datafile, plev_list)
+
+        # lat/lon box (crossing 0 longitude) of two levels against slicing the full field
+        q_window = qMODES.get_qmodes_window(qk_datafile, lon, (-40.0,60.0), (300.0,60.0), levels=[1,iplev])
+        checks['get_qmodes_window'] = max(max_abs_err(q_window[f'q_{imode}'].values,
+                                                      q_ds[f'q_{imode}'].sel(plev=q_window['plev'], lat=q_window['lat'], lon=q_window['lon']).values)
+                                          for imode in Mode_list)
+        timings['get_qmodes_window'] = time_call(qMODES.get_qmodes_window, qk_datafile, lon, (-40.0,60.0), (300.0,60.0), levels=[1,iplev])
+
+        # point profiles (two grid points and one point half way between two latitudes) against the full field
+        point_index  = [([1], 3), ([nlat-3], nlon-6), ([2,3], 0)]
+        lat_points   = np.array([np.mean(q_ds['lat'].values[ilat_list]) for ilat_list, _ in point_index])
+        lon_points   = np.array([lon[ilon] for _, ilon in point_index])
+        q_points_ref = reference_point_profiles(MODES_datafile, point_index)
+        q_points     = qMODES.get_qmodes_point_profiles([qk_datafile], lat_points, lon_points, levels=[1,iplev])
+        points_errs  = [max_abs_err(q_points.values[0], q_points_ref[:,[1,iplev]])]
+
+        points_arg = ';'.join(f"{lat_point},{lon_point}" for lat_point, lon_point in zip(lat_points, lon_points))
+        for noMRG_args, q_datafile in [([], MODES_datafile), (['--noMRG'], os.path.join(base_dir, f'output_data/qMODES_Data/qmodes_noMRG_{date}0000000.nc'))]:
+            points_file = os.path.join(base_dir, 'output_data/qMODES_Data/qmodes_points_check.nc')
+            run_script(qMODES_script_dir, 'Extract_qMODES_Points.py', ['--dates', date, '--points', points_arg, '-o', points_file] + noMRG_args)
+            points_errs.append( max_abs_err(xa.load_dataset(points_file)['q_profile'].values[0], reference_point_profiles(q_datafile, point_index)) )
+        checks['get_qmodes_point_profiles'] = max(points_errs)
+        timings['get_qmodes_point_profiles'] = time_call(qMODES.get_qmodes_point_profiles, [qk_datafile], lat_points, lon_points)
+
+        # k bands against the reference loop (with the k modes above the band zeroed), their sum against
+        # the full field, and the top band against a -k (high pass) run
+        k_bands = [(0,1), (2,nK//2), (nK//2+1,nK-1)]
+        timings['Calculate_qMODES_k_bands'] = run_script(qMODES_script_dir, 'Calculate_qMODES.py',
+                                                         ['-d', date, '--k_bands', ','.join(f"{k_lb}-{k_ub}" for k_lb, k_ub in k_bands)])
+        run_script(qMODES_script_dir, 'Calculate_qMODES.py', ['-d', date, '-k', str(k_bands[-1][0])])
+        q_bands_ds = xa.load_dataset(os.path.join(base_dir, f'output_data/qMODES_Data/qmodes_kbands_{date}0000000.nc'))
+        q_high_ds  = xa.load_dataset(os.path.join(base_dir, f'output_data/qMODES_Data/qmodes_{qMODES.get_k_band_name(k_bands[-1][0], 351)}_{date}0000000.nc'))
+        bands_errs = []
+        for imode in Mode_list:
+            q_bands = [q_bands_ds[f'q_{imode}_{qMODES.get_k_band_name(k_lb, k_ub)}'].values for k_lb, k_ub in k_bands]
+            for (k_lb, k_ub), q_band in zip(k_bands, q_bands):
+                qk_band = qk_ds[f'qk_{imode}'].values.copy()
+                qk_band[:,k_ub+1:] = 0.0
+                bands_errs.append( max_abs_err(q_band, reference_qmodes(qk_band, lon, k_lb)) )
+            bands_errs.append( max_abs_err(sum(q_bands), q_ds[f'q_{imode}'].values) )
+            bands_errs.append( max_abs_err(q_bands[-1], q_high_ds[f'q_{imode}'].values) )
+        checks['qMODES_k_bands'] = max(bands_errs)
+
+        # level subsets (qk_lev files) against slicing the full qk, by index (--levels) and by pressure (--plevs,
+        # one grid level and one half way between two levels in log pressure, where qk is the mean of the two levels)
+        qk_lev_files = [os.path.join(base_dir, f'output_data/qk_data/qk{tag}_lev_{date}0000000.nc') for tag in ['', '_noMRG']]
+        qk_full      = [qk_ds, qk_noMRG_ds]
+        levels_errs  = []
+        run_script(qMODES_script_dir, 'Calculate_qk.py', ['-d', date, '-m', 'ALL', '--levels', f'1,{iplev}'])
+        for qk_lev_file, qk_full_ds in zip(qk_lev_files, qk_full):
+            qk_lev_ds = xa.load_dataset(qk_lev_file)
+            levels_errs += [max_abs_err(qk_lev_ds[name].values, qk_full_ds[name].values[...,[1,iplev],:]) for name in qk_full_ds.data_vars if name.startswith('qk_')]
+
+        plevs = [plev[1], np.sqrt(plev[2]*plev[3])]
+        run_script(qMODES_script_dir, 'Calculate_qk.py', ['-d', date, '-m', 'ALL', '--plevs', ','.join(repr(float(p)/100.0) for p in plevs)])
+        for qk_lev_file, qk_full_ds in zip(qk_lev_files, qk_full):
+            qk_lev_ds = xa.load_dataset(qk_lev_file)
+            levels_errs += [max_abs_err(qk_lev_ds[name].values, np.stack([qk_full_ds[name].values[...,1,:], np.mean(qk_full_ds[name].values[...,2:4,:], axis=-2)], axis=-2))
+                            for name in qk_full_ds.data_vars if name.startswith('qk_')]
+            levels_errs.append( max_abs_err(qk_lev_ds['vgrid_int'].values, plevs) )
+
+        # synthesizing only the qk_lev levels (--lev)
+        run_script(qMODES_script_dir, 'Calculate_qMODES.py', ['-d', date, '--lev'])
+        q_lev_ds     = xa.load_dataset(os.path.join(base_dir, f'output_data/qMODES_Data/qmodes_lev_{date}0000000.nc'))
+        levels_errs += [max_abs_err(q_lev_ds[f'q_{imode}'].values, np.stack([q_ds[f'q_{imode}'].values[1], np.mean(q_ds[f'q_{imode}'].values[2:4], axis=0)]))
+                        for imode in Mode_list]
+        checks['qk_levels'] = max(levels_errs)
+        qk_ds.close()
+        qk_noMRG_ds.close()
+
+    # Hough store and precomputed qk operator (these runs write over the qk files, so they are done last)
+    qk_files = [os.path.join(base_dir, f'output_data/qk_data/qk{tag}_{date}0000000.nc') for tag in ['', '_noMRG']]
+    qk_std   = [xa.load_dataset(qk_file) for qk_file in qk_files]
+
+    hough_dir    = os.path.join(base_dir, 'input_data/MODES_data/hough/')
+    store_dir    = os.path.join(base_dir, 'input_data/MODES_data/hough_store/')
+    operator_dir = os.path.join(base_dir, 'input_data/MODES_data/qk_operator/')
+    os.makedirs(store_dir, exist_ok=True)
+    os.makedirs(operator_dir, exist_ok=True)
+
+    tic = time.perf_counter()
+    qMODES.create_hough_store(hough_dir, store_dir, nK, Mode_list)
+    timings['create_hough_store']            = {'wall_s': round(time.perf_counter() - tic, 4)}
+    timings['Calculate_qk_ALL_hough_store'] = run_script(qMODES_script_dir, 'Calculate_qk.py', ['-d', date, '-m', 'ALL', '--hough_store'])
+    if size in CHECK_SIZES:
+        checks['qk_hough_store'] = max(max_abs_err(xa.load_dataset(qk_file)[name].values, qk_ds_std[name].values)
+                                       for qk_file, qk_ds_std in zip(qk_files, qk_std) for name in qk_ds_std.data_vars if name.startswith('qk_'))
+
+    # the operator has every level built in, so it is only run for the sizes where it fits on disk
+    if len(Mode_list) * qMODES.get_qk_operator_nbytes(nK, nM, nN, nplev, nlat) / 1.0e9 <= operator_max_gb:
+        tic = time.perf_counter()
+        qMODES.create_qk_operator(store_dir, operator_dir, make_vsf_int['vsf_int'].values, make_vsf_int['vgrid_int'].values, nK, Mode_list)
+        timings['create_qk_operator']        = {'wall_s': round(time.perf_counter() - tic, 4)}
+        timings['Calculate_qk_ALL_operator'] = run_script(qMODES_script_dir, 'Calculate_qk.py', ['-d', date, '-m', 'ALL', '--operator'])
+        if size in CHECK_SIZES:
+            checks['qk_operator'] = max(max_abs_err(xa.load_dataset(qk_file)[name].values, qk_ds_std[name].values)
+                                        for qk_file, qk_ds_std in zip(qk_files, qk_std) for name in qk_ds_std.data_vars if name.startswith('qk_'))
+
+    # Several dates (--dates) in batches of two, checked against single date (-d) runs. Each
+    # date's run statistics should have the dates and coef reads of its batch, and the same
+    # hough reads as a single date run (every hough file read once per batch)
+    if size in CHECK_SIZES:
+        qk_single = {}
+        for qk_date in date_list:
+            run_script(qMODES_script_dir, 'Calculate_qk.py', ['-d', qk_date, '-m', 'ALL'])
+            qk_single[qk_date] = read_qk_date(base_dir, qk_date)
+
+        timings['Calculate_qk_ALL_dates_batch2'] = run_script(qMODES_script_dir, 'Calculate_qk.py',
+                                                              ['--dates', f'{date_list[0]}-{date_list[-1]}', '--date_batch', '2', '-m', 'ALL'])
+        batch_errs = []
+        stats_errs = 0
+        for batch_dates in [date_list[:2], date_list[2:]]:
+            for qk_date in batch_dates:
+                [qk_batch, stats_batch]       = read_qk_date(base_dir, qk_date)
+                [qk_ds_single, stats_single] = qk_single[qk_date]
+                batch_errs += [max_abs_err(ds_batch[name].values, ds_single[name].values)
+                               for ds_batch, ds_single in zip(qk_batch, qk_ds_single) for name in ds_single.data_vars if name.startswith('qk_')]
+                for stats, stats_1 in zip(stats_batch, stats_single):
+                    stats_errs += int(stats['dates'] != batch_dates) + int(stats['inputs']['coef']['files'] != len(batch_dates)) \
+                                + int(stats['inputs']['hough']['files'] != stats_1['inputs']['hough']['files']) + int(stats['mode'] != stats_1['mode'])
+        checks['qk_dates_batches']       = max(batch_errs)
+        checks['qk_dates_batches_stats'] = float(stats_errs) # number of mismatched sidecar entries
+
+        # one date per batch, the last date should only have the reads of its own batch (one coef file, each hough file once)
+        timings['Calculate_qk_ALL_dates_batch1'] = run_script(qMODES_script_dir, 'Calculate_qk.py',
+                                                              ['--dates', f'{date_list[0]}-{date_list[-1]}', '--date_batch', '1', '-m', 'ALL'])
+        batch_reads = {name: record['files'] for name, record in read_qk_date(base_dir, date_list[-1])[1][0]['inputs'].items()}
+        # number of files that are missing from (or extra in) the last batch's reads
+        checks['qk_batch_stats'] = float(sum(abs(batch_reads.get(name, 0) - nfiles) for name, nfiles in {'coef':1, 'hough':nK}.items())
+                                         + sum(batch_reads[name] for name in batch_reads if name not in ['coef','hough']))
+
+    del sys.modules['OmegaMODES_Functions']
+    del sys.modules['qMODES_Functions']
+    return timings, checks
+
+results = {'created': datetime.now().strftime("%m/%d/%Y, %H:%M:%S"),
+           'host'   : platform.node(),
+           'python' : platform.python_version(),
+           'numpy'  : np.__version__,
+           'sizes'  : {}}
+
+for size in size_list:
+    print(f"running {size} {SIZES[size]} (nK, nM, nN, nlat, nlon, nplev)")
+
+    if args.workdir is None:
+        with tempfile.TemporaryDirectory() as base_dir: [timings, checks] = run_size(size, base_dir)
+    else:
+        base_dir = os.path.join(args.workdir, size)
+        [timings, checks] = run_size(size, base_dir)
+
+    results['sizes'][size] = {'dims': dict(zip(['nK','nM','nN','nlat','nlon','nplev'], SIZES[size])), 'timings': timings, 'checks': checks}
+
+    for name, timing in timings.items(): print(f"\t{name:<40} {timing}")
+    for name, err    in checks.items():  print(f"\tcheck {name:<34} max rel err = {err:.2e} {'OK' if err < 1.0e-10 else 'FAILED'}")
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# SAVING AND COMPARING RESULTS
+
+os.makedirs(os.path.dirname(os.path.abspath(results_file)), exist_ok=True)
+with open(results_file, 'w') as f: json.dump(results, f, indent=2)
+print(f"results saved to:\n\t{results_file}")
+
+failed = [f"{size} {name}" for size in results['sizes'] for name, err in results['sizes'][size]['checks'].items() if err >= 1.0e-10]
+
+if args.compare is not None:
+    with open(args.compare) as f: old_results = json.load(f)
+
+    print(f"comparing against {args.compare} ({old_results['created']}, {old_results['host']})")
+    for size in results['sizes']:
+        if size not in old_results['sizes']: continue
+        for name, timing in results['sizes'][size]['timings'].items():
+            old_timing = old_results['sizes'][size]['timings'].get(name)
+            if old_timing is None or name == 'make_inputs': continue
+            key   = 'main_loop_s' if 'main_loop_s' in timing else list(timing)[0]
+            ratio = timing[key] / max(old_timing[key], 1.0e-9)
+            flag  = 'REGRESSION' if ratio > args.tolerance else ''
+            print(f"\t{size:<6} {name:<40} {key:<11} {old_timing[key]:>10.4f} -> {timing[key]:>10.4f} ({ratio:.2f}x) {flag}")
+
+if failed:
+    print(f"FAILED equivalence checks: {', '.join(failed)}")
+    sys.exit(1)
+#--------------------------------------------------------------------------
@@ -0,0 +1,57 @@
+#--------------------------------------------------------------------------
+# File:          test_qMODES_benchmark.py
+# Author:        Bradley Kumm (bkumm@wisc.edu)
+# Last Modified: 2026/10/18 (YYYY/MM/DD)
+# Description:   pytest wrapper for qMODES_benchmark.py. Runs the tiny
+#                size (synthetic inputs generated in a temporary
+#                directory) and checks that the qk, qMODES, vsf_int, and
+#                OmegaMODES_Functions outputs match the original loop
+#                implementations.
+#
+# Notes:         Run from the base directory with
+#                    python -m pytest tests
+#
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+#IMPORTS
+
+import os
+import sys
+import json
+import subprocess
+
+#--------------------------------------------------------------------------
+
+
+
+#--------------------------------------------------------------------------
+# TESTS
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+
+# checks that the benchmark runs against the reference loops for the tiny size
+expected_checks = ['qk_EIG', 'qk_WIG', 'qk_BAL', 'qk_BAL_noMRG', 'q_EIG', 'q_WIG', 'q_BAL',
+                   'vsf_int', 'Deriv_Along_Axis', 'get_single_plev_q_data_p_and_lat_bkg',
+                   'qk_hough_store', 'qk_operator', 'qk_batch_stats',
+                   'qk_dates_batches', 'qk_dates_batches_stats', 'get_qk_variance',
+                   'get_qk_band_spectra', 'get_lat_variance_profiles',
+                   'get_qmodes_window', 'get_qmodes_point_profiles',
+                   'qMODES_k_bands', 'qk_levels']
+
+def test_tiny_outputs_match_reference_loops(tmp_path):
+    '''runs the tiny benchmark and checks every output against the reference loop implementation'''
+    result = subprocess.run([sys.executable, "qMODES_benchmark.py", "--sizes", "tiny", "--workdir", str(tmp_path), "-n", "1"],
+                            cwd=test_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
+
+    results_file = os.path.join(tmp_path, 'qMODES_benchmark_results.json')
+    with open(results_file) as f: checks = json.load(f)['sizes']['tiny']['checks']
+
+    assert sorted(checks) == sorted(expected_checks)
+    for name, err in checks.items():
+        assert err < 1.0e-10, f"{name} max rel err = {err:.2e}"
+
+#--------------------------------------------------------------------------